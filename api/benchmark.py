@@ -0,0 +1,376 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from urllib.parse import urlencode, urlsplit
+
+# Benchmark de carga da API.
+# Dispara requisições em todos os endpoints (buscas com filtros variados e páginas profundas, detalhes_devedor,
+# consultas em lote e as rotas /resumo/*), cada cenário por vez, com N clientes simultâneos, e mede a vazão
+# (requisições/s) e as latências p50/p95/p99 de cada um.
+# O alvo pode ser uma API já no ar (--url, por exemplo o nginx do docker compose) ou um backend embutido
+# (--embutido): um SQLite montado a partir dos CSVs de data/ (ou dos sintéticos de etl/sintetico.py) com as mesmas
+# transformações do ETL, os mesmos índices do DW, as tabelas de resumo e os payloads pré-renderizados, servido por
+# um uvicorn local. Assim, mudanças de desempenho na API podem ser medidas em qualquer máquina, sem o compose.
+# Os parâmetros das requisições são sorteados com uma semente fixa a partir de amostras lidas da própria API.
+# Os clientes usam só a biblioteca padrão (uma thread e uma conexão HTTP keep-alive por cliente).
+
+RAIZ_PROJETO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ_PROJETO not in sys.path:
+    sys.path.append(RAIZ_PROJETO)
+
+TAMANHO_PAGINA = 100
+PERCENTIS = (50, 95, 99)
+
+
+# Backend embutido (SQLite)
+
+def _ddl_dw_sqlite():
+    """Traduz para o SQLite os CREATE TABLE do DW em database/criacao_tabelas.sql. Devolve (tabelas, índices)."""
+    with open(os.path.join(RAIZ_PROJETO, 'database', 'criacao_tabelas.sql'), encoding='utf-8') as arquivo:
+        sql = arquivo.read()
+    sql = re.sub(r'--[^\n]*', '', sql.split('USE dw_db;', 1)[1])
+    tabelas, indices = [], []
+    for nome, corpo in re.findall(r'CREATE TABLE (\w+) \((.*?)\n\);', sql, flags=re.S):
+        definicoes = []
+        for linha in (linha.strip().rstrip(',') for linha in corpo.split('\n')):
+            indice = re.match(r'INDEX (\w+) \((.*)\)$', linha)
+            if indice:
+                indices.append(f"CREATE INDEX {indice.group(1)} ON {nome} ({indice.group(2)})")
+            elif linha:
+                linha = linha.replace('INT NOT NULL AUTO_INCREMENT PRIMARY KEY', 'INTEGER PRIMARY KEY')
+                definicoes.append(linha.replace('UNIQUE KEY', 'UNIQUE'))
+        tabelas.append(f"CREATE TABLE {nome} ({', '.join(definicoes)})")
+    return tabelas, indices
+
+
+def semear(caminho, dir_dados):
+    """Monta o DW em SQLite a partir dos CSVs de dir_dados, como o ETL faria no MySQL."""
+    os.environ['ETL_DIR_DADOS'] = dir_dados
+    os.environ['API_DATABASE_URL'] = f'sqlite:///{caminho}'
+    #O pipeline cria os engines do MySQL ao ser importado (sem conectar): sem .env, basta uma porta válida
+    os.environ.setdefault('DB_PORT', '3306')
+    #Os módulos do ETL se importam pelo nome (e etl/snapshot.py tem o mesmo nome de api/snapshot.py)
+    sys.path.insert(0, os.path.join(RAIZ_PROJETO, 'etl'))
+    import pipeline
+    import resumos
+    import snapshot
+    from sqlalchemy import create_engine, text
+
+    inicio = time.perf_counter()
+    transacional = pipeline.extrair_transacional()
+    tabelas_dw = pipeline.transformar_dimensoes(transacional)
+    tabelas_dw['fatos_cdas'] = pipeline.transformar_fatos(transacional)
+    tabelas_dw['jun_cdas_devedores'] = pipeline.transformar_juncao(
+        transacional, tabelas_dw['fatos_cdas']['num_cda'], tabelas_dw['dim_devedores']['id_devedor']
+    )
+
+    temporario = caminho + '.tmp'
+    if os.path.exists(temporario):
+        os.remove(temporario)
+    engine = create_engine(f'sqlite:///{temporario}')
+    criacoes, indices = _ddl_dw_sqlite()
+    with engine.begin() as conexao:
+        for comando in criacoes:
+            conexao.exec_driver_sql(comando)
+    for tabela, df in tabelas_dw.items():
+        df.to_sql(tabela, engine, if_exists='append', index=False, chunksize=50_000)
+    with engine.begin() as conexao:
+        for comando in indices:
+            conexao.exec_driver_sql(comando)
+        #Resumos com o mesmo SQL do ETL; as marcas de atualização e a geração são gravadas sem o upsert do MySQL
+        agora = datetime.now()
+        conexao.execute(text("INSERT INTO atualizacoes_dw VALUES ('dados', :t)"), {'t': agora.isoformat(sep=' ')})
+        for resumo in resumos.RESUMOS:
+            resumos.calcular_resumo(conexao, resumo)
+            agora += timedelta(microseconds=1)
+            conexao.execute(text("INSERT INTO atualizacoes_dw VALUES (:item, :t)"), {'item': resumo, 't': agora.isoformat(sep=' ')})
+        conexao.execute(text("INSERT INTO geracao_dw VALUES (1, 1, :t)"), {'t': agora.isoformat(sep=' ')})
+    engine.dispose()
+    os.replace(temporario, caminho)
+
+    #Payloads pré-renderizados pelo próprio código da API, como no estágio 'payloads' do ETL
+    from api.main import SessionLocal, pre_renderizar_resumos
+    with SessionLocal() as db:
+        pre_renderizar_resumos(db)
+        snapshot.gravar_snapshot(db.get_bind())
+    print(f"Backend embutido montado em {caminho} em {time.perf_counter() - inicio:.1f}s "
+          f"({len(tabelas_dw['fatos_cdas'])} CDAs)")
+
+
+def servir(porta):
+    #Processo do uvicorn do backend embutido. O sqlite3 não aceita Decimal como parâmetro (cursor do /cda/search).
+    import sqlite3
+    import uvicorn
+    sqlite3.register_adapter(Decimal, float)
+    uvicorn.run('api.main:app', host='127.0.0.1', port=porta, log_level='warning')
+
+
+def iniciar_embutido(caminho, porta):
+    ambiente = {**os.environ, 'API_DATABASE_URL': f'sqlite:///{caminho}', 'API_MODO_BANCO': 'sync'}
+    processo = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--servir', str(porta)], cwd=RAIZ_PROJETO, env=ambiente
+    )
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError("O uvicorn do backend embutido terminou antes de ficar pronto")
+        try:
+            conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=1)
+            conexao.request('GET', '/resumo/inscricoes')
+            if conexao.getresponse().status == 200:
+                return processo
+        except OSError:
+            time.sleep(0.2)
+    processo.terminate()
+    raise RuntimeError("O backend embutido não respondeu em 60s")
+
+
+# Cenários
+
+class Cliente:
+    #Uma conexão keep-alive por cliente (thread). Os cabeçalhos extras (Accept, Accept-Encoding) vão em toda requisição.
+    def __init__(self, url, cabecalhos=None):
+        partes = urlsplit(url)
+        self.host, self.porta = partes.hostname, partes.port or 80
+        self.cabecalhos = dict(cabecalhos or {})
+        self.conexao = http.client.HTTPConnection(self.host, self.porta, timeout=60)
+
+    def requisitar(self, metodo, caminho, params=None, corpo=None):
+        if params:
+            caminho += '?' + urlencode(params)
+        cabecalhos = dict(self.cabecalhos)
+        if corpo is not None:
+            corpo = json.dumps(corpo)
+            cabecalhos['Content-Type'] = 'application/json'
+        try:
+            self.conexao.request(metodo, caminho, body=corpo, headers=cabecalhos)
+            resposta = self.conexao.getresponse()
+        except (OSError, http.client.HTTPException):
+            self.conexao.close()
+            self.conexao = http.client.HTTPConnection(self.host, self.porta, timeout=60)
+            raise
+        return resposta.status, resposta.getheader('X-Next-Cursor'), resposta.read()
+
+
+def amostrar(url):
+    """Lê da API os valores usados para sortear os parâmetros (naturezas, anos, situações, saldos, CDAs e devedores)."""
+    cliente = Cliente(url)
+
+    def obter(caminho, params=None):
+        status, _, conteudo = cliente.requisitar('GET', caminho, params)
+        if status != 200:
+            raise RuntimeError(f"{caminho} respondeu {status}")
+        return json.loads(conteudo)
+
+    naturezas = obter('/resumo/quantidade_cdas')
+    cdas = obter('/cda/search', {'limit': 1000, 'sort_by': 'valor'})
+    return {
+        'total_cdas': sum(n['Quantidade'] for n in naturezas),
+        'naturezas': [n['name'] for n in naturezas],
+        'anos': [i['ano'] for i in obter('/resumo/inscricoes')],
+        'tributos': [chave for chave in obter('/resumo/montante_acumulado')[0] if chave != 'Percentual'],
+        'situacoes': sorted({c['agrupamento_situacao'] for c in cdas}),
+        'saldos': sorted(c['valor_saldo_atualizado'] for c in cdas),
+        'cdas': [c['numCDA'] for c in cdas],
+        'devedores': [d['id_devedor'] for d in obter('/cda/detalhes_devedor', {'limit': 1000}) if d.get('id_devedor')],
+    }
+
+
+def _ordem(rng):
+    return {'sort_by': rng.choice(['ano', 'valor']), 'sort_order': rng.choice(['asc', 'desc'])}
+
+
+def _faixa(rng, valores):
+    a, b = sorted(rng.sample(valores, 2)) if len(valores) > 1 else (valores[0], valores[0])
+    return a, b
+
+
+# Cada cenário recebe (rng, amostra, estado do cliente) e devolve (método, caminho, parâmetros, corpo)
+CENARIOS = {
+    'search_sem_filtros': lambda rng, a, e: ('GET', '/cda/search', _ordem(rng), None),
+    'search_natureza': lambda rng, a, e: ('GET', '/cda/search', {'natureza': rng.choice(a['naturezas']), **_ordem(rng)}, None),
+    'search_saldo': lambda rng, a, e: ('GET', '/cda/search', dict(zip(('minSaldo', 'maxSaldo'), _faixa(rng, a['saldos'])), sort_by='valor'), None),
+    'search_ano_situacao': lambda rng, a, e: ('GET', '/cda/search', {
+        **dict(zip(('minAno', 'maxAno'), _faixa(rng, a['anos']))), 'agrupamento_situacao': rng.choice(a['situacoes']), **_ordem(rng)
+    }, None),
+    'search_numcda': lambda rng, a, e: ('GET', '/cda/search', {'numCDA': rng.choice(a['cdas'])}, None),
+    # Página profunda por OFFSET (skip sorteado em todo o resultado) e a mesma varredura pelo cursor
+    'search_pagina_profunda': lambda rng, a, e: ('GET', '/cda/search', {
+        'skip': rng.randrange(max(a['total_cdas'] - TAMANHO_PAGINA, 1)), 'limit': TAMANHO_PAGINA, 'sort_by': 'valor', 'sort_order': 'desc'
+    }, None),
+    'search_cursor': lambda rng, a, e: ('GET', '/cda/search', {
+        'limit': TAMANHO_PAGINA, 'sort_by': 'valor', 'sort_order': 'desc', **({'cursor': e['cursor']} if e.get('cursor') else {})
+    }, None),
+    'detalhes_devedor': lambda rng, a, e: ('GET', '/cda/detalhes_devedor', {
+        'sort_by': rng.choice(['saldo', 'quantidade']), 'skip': rng.randrange(0, 10) * TAMANHO_PAGINA
+    }, None),
+    'detalhes_devedor_id': lambda rng, a, e: ('GET', '/cda/detalhes_devedor', {'id_devedor': rng.choice(a['devedores'])}, None),
+    'lote_cdas': lambda rng, a, e: ('POST', '/cda/lote', None, {'numCDAs': rng.sample(a['cdas'], min(100, len(a['cdas'])))}),
+    'lote_devedores': lambda rng, a, e: ('POST', '/cda/detalhes_devedor/lote', None, {
+        'ids_devedores': rng.sample(a['devedores'], min(100, len(a['devedores'])))
+    }),
+    'resumo_quantidade_cdas': lambda rng, a, e: ('GET', '/resumo/quantidade_cdas', None, None),
+    'resumo_saldo_cdas': lambda rng, a, e: ('GET', '/resumo/saldo_cdas', None, None),
+    'resumo_inscricoes': lambda rng, a, e: ('GET', '/resumo/inscricoes', None, None),
+    'resumo_distribuicao_cdas': lambda rng, a, e: ('GET', '/resumo/distribuicao_cdas', None, None),
+    'resumo_montante_acumulado': lambda rng, a, e: ('GET', '/resumo/montante_acumulado', None, None),
+    # Curva filtrada pelos sketches: tributos e anos sorteados, percentis de 1 a 100
+    'resumo_curva': lambda rng, a, e: ('GET', '/resumo/montante_acumulado/curva', {
+        'tributos': ','.join(rng.sample(a['tributos'], rng.randint(1, len(a['tributos'])))),
+        **dict(zip(('minAno', 'maxAno'), _faixa(rng, a['anos']))), 'percentis': ','.join(map(str, range(1, 101)))
+    }, None),
+}
+
+
+def percentil(ordenados, p):
+    #Percentil pelo método do posto mais próximo
+    if not ordenados:
+        return 0.0
+    return ordenados[min(len(ordenados) - 1, max(0, -(-len(ordenados) * p // 100) - 1))]
+
+
+def executar_cenario(url, nome, amostra, concorrencia, duracao, aquecimento, semente, cabecalhos=None):
+    montar = CENARIOS[nome]
+    latencias, erros, tamanhos = [], [], []
+    trava = threading.Lock()
+    inicio_medicao = time.monotonic() + aquecimento
+    fim = inicio_medicao + duracao
+
+    def trabalhar(indice):
+        rng = random.Random(f'{semente}-{nome}-{indice}')
+        cliente, estado, minhas, meus_erros, meus_tamanhos = Cliente(url, cabecalhos), {}, [], [], []
+        while True:
+            agora = time.monotonic()
+            if agora >= fim:
+                break
+            metodo, caminho, params, corpo = montar(rng, amostra, estado)
+            antes = time.perf_counter()
+            try:
+                status, cursor, conteudo = cliente.requisitar(metodo, caminho, params, corpo)
+            except (OSError, http.client.HTTPException) as erro:
+                status, cursor, conteudo = type(erro).__name__, None, b''
+            latencia = time.perf_counter() - antes
+            estado['cursor'] = cursor
+            if agora >= inicio_medicao:
+                minhas.append(latencia)
+                meus_tamanhos.append(len(conteudo))
+                if status != 200:
+                    meus_erros.append(status)
+        with trava:
+            latencias.extend(minhas)
+            erros.extend(meus_erros)
+            tamanhos.extend(meus_tamanhos)
+
+    threads = [threading.Thread(target=trabalhar, args=(i,)) for i in range(concorrencia)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencias.sort()
+    return {
+        'requisicoes': len(latencias),
+        'erros': len(erros),
+        'status_erros': sorted({str(e) for e in erros}),
+        'vazao_rps': len(latencias) / duracao,
+        **{f'p{p}_ms': percentil(latencias, p) * 1000 for p in PERCENTIS},
+        'max_ms': (latencias[-1] if latencias else 0.0) * 1000,
+        # Tamanho médio do corpo recebido (comprimido, se a resposta veio comprimida)
+        'bytes_medios': sum(tamanhos) / len(tamanhos) if tamanhos else 0.0,
+    }
+
+
+def imprimir(resultado):
+    print(f"\n{resultado['alvo']} | {resultado['concorrencia']} clientes | {resultado['duracao_s']:.0f}s por cenário")
+    print(f"{'cenário':<28}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'KB/req':>10}{'erros':>8}")
+    for nome, medicao in resultado['cenarios'].items():
+        print(f"{nome:<28}{medicao['vazao_rps']:>10.1f}{medicao['p50_ms']:>10.1f}{medicao['p95_ms']:>10.1f}"
+              f"{medicao['p99_ms']:>10.1f}{medicao['bytes_medios'] / 1024:>10.1f}{medicao['erros']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de carga da API.")
+    alvo = parser.add_mutually_exclusive_group()
+    alvo.add_argument('--url', default='http://localhost', help="API já no ar (padrão: nginx do docker compose)")
+    alvo.add_argument('--embutido', action='store_true', help="sobe a API local com o backend SQLite embutido")
+    parser.add_argument('--banco', default=os.path.join(RAIZ_PROJETO, 'benchmarks', 'api_embutido.db'),
+                        help="arquivo SQLite do backend embutido (montado se ainda não existir)")
+    parser.add_argument('--dados', default=os.path.join(RAIZ_PROJETO, 'data'), help="CSVs usados para montar o backend embutido")
+    parser.add_argument('--recriar', action='store_true', help="monta o backend embutido de novo")
+    parser.add_argument('--porta', type=int, default=8765, help="porta do uvicorn do backend embutido")
+    parser.add_argument('--cenarios', nargs='+', choices=list(CENARIOS), default=list(CENARIOS))
+    parser.add_argument('--concorrencia', type=int, default=16, help="clientes simultâneos")
+    parser.add_argument('--duracao', type=float, default=10.0, help="segundos medidos por cenário")
+    parser.add_argument('--aquecimento', type=float, default=2.0, help="segundos descartados no início de cada cenário")
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--accept', help="cabeçalho Accept das requisições (ex.: application/msgpack; ver api/formatos.py)")
+    parser.add_argument('--accept-encoding', help="cabeçalho Accept-Encoding das requisições (ex.: br, gzip)")
+    parser.add_argument('--saida', default=os.path.join(RAIZ_PROJETO, 'benchmarks'), help="pasta do resultado (JSON)")
+    parser.add_argument('--servir', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.servir:
+        servir(args.servir)
+        return
+
+    processo = None
+    url = args.url
+    if args.embutido:
+        if args.recriar or not os.path.exists(args.banco):
+            os.makedirs(os.path.dirname(os.path.abspath(args.banco)), exist_ok=True)
+            semear(os.path.abspath(args.banco), os.path.abspath(args.dados))
+        processo = iniciar_embutido(os.path.abspath(args.banco), args.porta)
+        url = f'http://127.0.0.1:{args.porta}'
+
+    cabecalhos = {}
+    if args.accept:
+        cabecalhos['Accept'] = args.accept
+    if args.accept_encoding:
+        cabecalhos['Accept-Encoding'] = args.accept_encoding
+
+    try:
+        amostra = amostrar(url)
+        cenarios = {}
+        for nome in args.cenarios:
+            print(f"  cenário {nome}...")
+            cenarios[nome] = executar_cenario(
+                url, nome, amostra, args.concorrencia, args.duracao, args.aquecimento, args.semente, cabecalhos
+            )
+    finally:
+        if processo is not None:
+            processo.terminate()
+            processo.wait()
+
+    #Mesmo registro de commit do benchmark do ETL (que importa os módulos do ETL pelo nome)
+    sys.path.append(os.path.join(RAIZ_PROJETO, 'etl'))
+    from etl.benchmark import commit_atual
+    commit, sujo = commit_atual()
+    resultado = {
+        'commit': commit,
+        'commit_com_alteracoes': sujo,
+        'data': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'alvo': f'embutido:{os.path.basename(args.banco)}' if args.embutido else url,
+        'concorrencia': args.concorrencia,
+        'duracao_s': args.duracao,
+        'semente': args.semente,
+        'cabecalhos': cabecalhos,
+        'cenarios': cenarios,
+    }
+    imprimir(resultado)
+    os.makedirs(args.saida, exist_ok=True)
+    nome = f"api-{(commit or 'sem-commit')[:12]}-c{args.concorrencia}.json"
+    with open(os.path.join(args.saida, nome), 'w', encoding='utf-8') as arquivo:
+        json.dump(resultado, arquivo, indent=2)
+
+
+if __name__ == '__main__':
+    main()
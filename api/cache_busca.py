@@ -0,0 +1,143 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from prometheus_client import Counter, Gauge
+from sqlalchemy.orm import Session
+
+from api import payloads
+
+# Cache de resultados do /cda/search, em memória em cada réplica.
+# Os painéis disparam muitas buscas idênticas ao mesmo tempo (mesmos filtros, primeira página). A chave do cache são
+# os parâmetros normalizados da busca mais a geração do DW (ver api/payloads.py): quando o ETL publica uma geração
+# nova, as entradas antigas deixam de valer e são descartadas.
+# O cache é um LRU limitado pelo total de linhas guardadas (API_CACHE_BUSCA_LINHAS) e pela idade das entradas
+# (API_CACHE_BUSCA_TTL, que também limita por quanto tempo um resultado pode ficar velho se a geração não existir).
+# Buscas idênticas que chegam enquanto a primeira ainda está consultando o banco não fazem outra consulta: esperam
+# o resultado dela (single-flight). Se a primeira falhar, o mesmo erro é devolvido às que esperavam.
+# Acertos, faltas e buscas agrupadas são contados em /metrics, para ajustar os limites.
+
+# Máximo de linhas de resultado guardadas na réplica (0 desativa o cache e o agrupamento)
+LINHAS_MAXIMAS = int(os.getenv('API_CACHE_BUSCA_LINHAS', 100_000))
+# Segundos que um resultado pode ficar no cache
+TTL = float(os.getenv('API_CACHE_BUSCA_TTL', 60))
+
+BUSCAS = Counter('api_cache_busca', 'Buscas do /cda/search por resultado no cache', ['resultado'])
+ACERTOS = BUSCAS.labels('acerto')
+FALTAS = BUSCAS.labels('falta')
+AGRUPADAS = BUSCAS.labels('agrupada')
+
+_entradas = OrderedDict()  # chave -> (expira_em, linhas, valor), da menos para a mais recentemente usada
+_em_andamento = {}  # chave -> Future da busca que está consultando o banco
+_estado = {'geracao': None, 'linhas': 0}
+_trava = threading.Lock()
+
+Gauge('api_cache_busca_entradas', 'Buscas guardadas no cache do /cda/search').set_function(lambda: len(_entradas))
+Gauge('api_cache_busca_linhas', 'Linhas guardadas no cache do /cda/search').set_function(lambda: _estado['linhas'])
+
+
+def _remover(chave):
+    _estado['linhas'] -= _entradas.pop(chave)[1]
+
+
+def _guardar(chave, valor, linhas: int):
+    #Uma geração nova invalida o cache inteiro; resultados de uma geração anterior que terminaram depois não entram
+    geracao = chave[0]
+    if geracao != _estado['geracao']:
+        if _estado['geracao'] is not None and geracao is not None and geracao < _estado['geracao']:
+            return
+        _entradas.clear()
+        _estado['geracao'], _estado['linhas'] = geracao, 0
+    if linhas > LINHAS_MAXIMAS:
+        return
+    if chave in _entradas:
+        _remover(chave)
+    while _entradas and _estado['linhas'] + linhas > LINHAS_MAXIMAS:
+        _remover(next(iter(_entradas)))
+    _entradas[chave] = (time.monotonic() + TTL, linhas, valor)
+    _estado['linhas'] += linhas
+
+
+def _consultar(chave):
+    """Devolve (resultado, None) se a busca estiver no cache; senão (None, (futuro, lider)): o Future da busca
+    idêntica em andamento ou, se não houver, um novo, que quem o criou (o líder) deve concluir com _concluir."""
+    with _trava:
+        entrada = _entradas.get(chave)
+        if entrada is not None:
+            if entrada[0] > time.monotonic():
+                _entradas.move_to_end(chave)
+                ACERTOS.inc()
+                return entrada[2], None
+            _remover(chave)
+        futuro = _em_andamento.get(chave)
+        lider = futuro is None
+        if lider:
+            futuro = _em_andamento[chave] = Future()
+    if lider:
+        FALTAS.inc()
+    else:
+        AGRUPADAS.inc()
+    return None, (futuro, lider)
+
+
+def _concluir(chave, futuro: Future, valor=None, erro=None, tamanho=len):
+    with _trava:
+        if erro is None:
+            _guardar(chave, valor, max(tamanho(valor), 1))
+        del _em_andamento[chave]
+    if erro is None:
+        futuro.set_result(valor)
+    else:
+        futuro.set_exception(erro)
+
+
+def obter(db: Session, parametros: tuple, calcular, tamanho=len):
+    """Devolve o resultado da busca: do cache, da busca idêntica em andamento ou chamando calcular()."""
+    if LINHAS_MAXIMAS <= 0:
+        return calcular()
+
+    chave = (payloads.geracao_atual(db), *parametros)
+    valor, andamento = _consultar(chave)
+    if andamento is None:
+        return valor
+    futuro, lider = andamento
+    if not lider:
+        #Devolve a conexão ao pool enquanto espera: quem espera não consulta o banco
+        db.close()
+        return futuro.result()
+
+    try:
+        valor = calcular()
+    except BaseException as erro:
+        _concluir(chave, futuro, erro=erro)
+        raise
+    _concluir(chave, futuro, valor, tamanho=tamanho)
+    return valor
+
+
+async def obter_async(db, parametros: tuple, calcular, tamanho=len):
+    """obter com uma AsyncSession (modo 'async' da API); calcular é uma função assíncrona. A espera pela busca
+    idêntica em andamento é feita pelo event loop, sem bloquear as outras requisições."""
+    if LINHAS_MAXIMAS <= 0:
+        return await calcular()
+
+    chave = (await payloads.geracao_atual_async(db), *parametros)
+    valor, andamento = _consultar(chave)
+    if andamento is None:
+        return valor
+    futuro, lider = andamento
+    if not lider:
+        await db.close()
+        #shield: se a requisição for cancelada, o Future compartilhado com as outras não é cancelado junto
+        return await asyncio.shield(asyncio.wrap_future(futuro))
+
+    try:
+        valor = await calcular()
+    except BaseException as erro:
+        _concluir(chave, futuro, erro=erro)
+        raise
+    _concluir(chave, futuro, valor, tamanho=tamanho)
+    return valor
@@ -0,0 +1,109 @@
+import numpy as np
+
+from etl import classificacao, montante
+
+# Motor vetorizado das curvas de montante acumulado (/resumo/montante_acumulado).
+# Para cada grupo de tributo, o endpoint responde: "qual o percentual do saldo total que está nos p% menores CDAs?",
+# com os percentis definidos como no NTILE(100) do MySQL (ordenando as CDAs pelo saldo).
+# As somas de cada percentil vêm de etl/montante.py (as mesmas do resumo gravado pelo ETL), e o percentual acumulado
+# é calculado com a mesma conta em float da versão original com pandas, então a resposta é igual bit a bit.
+
+# Grupos de tributo, na ordem dos códigos gravados pelo ETL (cod_tributo)
+TRIBUTOS = classificacao.TRIBUTOS
+N_PERCENTIS = montante.N_PERCENTIS
+PERCENTIS_DESEJADOS = [1] + list(range(5, 101, 5))
+
+
+def somas_por_percentil(codigos, saldos):
+    """Somas por percentil de cada tributo (ver etl/montante.py) a partir dos saldos em reais.
+    codigos: cod_tributo de cada linha (posição em TRIBUTOS, -1 para nenhum).
+    Devolve (somas, totais, presentes)."""
+    return somas_por_percentil_centavos(codigos, montante.centavos(saldos))
+
+
+def somas_por_percentil_centavos(codigos, centavos):
+    """Mesmo que somas_por_percentil, com o saldo já em centavos."""
+    return montante.somas_por_percentil(codigos, centavos, len(TRIBUTOS))
+
+
+def somas_do_resumo(linhas):
+    """Monta as mesmas matrizes de somas_por_percentil a partir das linhas (tributo, percentil, saldo, saldo_tributo)
+    de resumo_montante."""
+    somas = np.zeros((len(TRIBUTOS), N_PERCENTIS), dtype='float64')
+    totais = np.zeros(len(TRIBUTOS), dtype='float64')
+    presentes = np.zeros((len(TRIBUTOS), N_PERCENTIS), dtype=bool)
+    indice = {tributo: i for i, tributo in enumerate(TRIBUTOS)}
+    linhas = [linha for linha in linhas if linha[0] in indice]
+    if linhas:
+        tributos, percentis, saldos, saldos_tributo = zip(*linhas)
+        posicao_tributo = np.array([indice[t] for t in tributos])
+        posicao_percentil = np.asarray(percentis, dtype='int64') - 1
+        somas[posicao_tributo, posicao_percentil] = np.asarray(saldos, dtype='float64')
+        totais[posicao_tributo] = np.asarray(saldos_tributo, dtype='float64')
+        presentes[posicao_tributo, posicao_percentil] = True
+    return somas, totais, presentes
+
+
+def montar_resposta(somas, totais, presentes):
+    """Converte as somas por percentil no formato de resposta do endpoint (uma linha por percentil desejado)."""
+    #Soma cumulativa compensada ao longo dos percentis, como o cumsum do groupby do pandas (não é o np.cumsum)
+    acumulado = montante.soma_compensada(somas, acumulada=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percentual = (acumulado / totais[:, None]) * 100
+    #Percentis sem linhas (grupos com menos de 100 CDAs) ou grupos com saldo total zero ficam com 0.0
+    percentual = np.where(presentes & (totais[:, None] != 0), percentual, 0.0)
+
+    resposta = []
+    for percentil in PERCENTIS_DESEJADOS:
+        coluna = percentil - 1
+        #Um percentil só aparece se algum tributo tiver CDAs nele (como no pivot da versão com pandas)
+        if not presentes[:, coluna].any():
+            continue
+        linha = {'Percentual': percentil}
+        linha.update({tributo: float(percentual[i, coluna]) for i, tributo in enumerate(TRIBUTOS)})
+        resposta.append(linha)
+    return resposta
+
+
+def curva_de_sketches(faixas, quantidades, saldos, minimos, maximos, percentis):
+    """Curva de montante acumulado nos percentis pedidos (quaisquer valores entre 0 e 100), a partir das linhas dos
+    sketches das células filtradas (ver etl/sketches.py). As linhas de mesma faixa são somadas; o percentil p
+    corresponde às p% CDAs de menor saldo (p/100 * n CDAs, com a fração da CDA seguinte contada proporcionalmente).
+    Devolve (pontos, quantidade de CDAs, saldo total); cada ponto traz o percentual acumulado do saldo (Montante) e o
+    erro máximo dele, em pontos percentuais."""
+    if len(faixas) == 0:
+        return [], 0, 0.0
+
+    #Junta as células: ordena pelas faixas e reduz cada sequência de faixas iguais
+    ordem = np.argsort(faixas, kind='stable')
+    faixas = np.asarray(faixas)[ordem]
+    inicios = np.flatnonzero(np.r_[True, faixas[1:] != faixas[:-1]])
+    quantidade = np.add.reduceat(np.asarray(quantidades, dtype='int64')[ordem], inicios)
+    soma = np.add.reduceat(np.asarray(saldos, dtype='float64')[ordem], inicios)
+    minimo = np.minimum.reduceat(np.asarray(minimos, dtype='float64')[ordem], inicios)
+    maximo = np.maximum.reduceat(np.asarray(maximos, dtype='float64')[ordem], inicios)
+
+    quantidade_acumulada = np.cumsum(quantidade)
+    soma_acumulada = np.cumsum(soma)
+    total_cdas, total_saldo = int(quantidade_acumulada[-1]), float(soma_acumulada[-1])
+
+    #Faixa onde cai o posto de cada percentil e quantas CDAs dela (fração) entram no acumulado
+    percentis = np.asarray(percentis, dtype='float64')
+    posto = percentis / 100 * total_cdas
+    i = np.minimum(np.searchsorted(quantidade_acumulada, posto), len(quantidade) - 1)
+    antes = soma_acumulada[i] - soma[i]
+    dentro = posto - (quantidade_acumulada[i] - quantidade[i])
+    fora = quantidade[i] - dentro
+    #A parte da faixa é estimada pela média dela; os saldos estão entre o mínimo e o máximo da faixa, o que limita
+    #a soma das CDAs incluídas (e, portanto, o erro da estimativa)
+    estimado = antes + dentro * soma[i] / quantidade[i]
+    inferior = antes + np.maximum(dentro * minimo[i], soma[i] - fora * maximo[i])
+    superior = antes + np.minimum(dentro * maximo[i], soma[i] - fora * minimo[i])
+    erro = np.maximum(estimado - inferior, superior - estimado)
+
+    escala = 100 / total_saldo if total_saldo > 0 else 0.0
+    pontos = [
+        {'Percentual': float(percentil), 'Montante': float(valor * escala), 'erro_maximo': float(max(limite, 0.0) * escala)}
+        for percentil, valor, limite in zip(percentis, estimado, erro)
+    ]
+    return pontos, total_cdas, total_saldo
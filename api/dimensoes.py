@@ -0,0 +1,86 @@
+import threading
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from api import payloads
+from etl import classificacao
+
+# Cache em memória das dimensões pequenas do DW (dim_naturezas e dim_situacoes).
+# Elas têm poucas dezenas de linhas e só mudam quando o ETL roda, então cada réplica da API as carrega
+# na inicialização e de novo quando a geração do DW muda (ver api/payloads.py).
+# Com isso, as consultas à tabela fato não precisam de JOIN: o filtro de natureza vira uma lista de ids
+# (fk_natureza IN (...)) e os nomes são colocados nas linhas em Python.
+
+# A comparação sem acentos e maiúsculas é a mesma usada pelas regras de classificação do ETL
+normalizar = classificacao.normalizar
+
+
+class Dimensoes:
+    def __init__(self, geracao, naturezas: dict, situacoes: dict):
+        self.geracao = geracao
+        self.naturezas = naturezas  # id_natureza -> descricao_natureza
+        self.situacoes = situacoes  # id_situacao -> descricao_situacao
+        self.chaves_naturezas = {id_natureza: normalizar(descricao) for id_natureza, descricao in naturezas.items()}
+
+    def ids_natureza(self, trecho: str):
+        """Ids das naturezas cuja descrição contém o trecho (equivalente a descricao_natureza LIKE '%trecho%')."""
+        chave = normalizar(trecho)
+        return sorted(id_natureza for id_natureza, descricao in self.chaves_naturezas.items() if chave in descricao)
+
+
+_atual = None
+_trava = threading.Lock()
+
+
+SELECT_NATUREZAS = "SELECT id_natureza, descricao_natureza FROM dim_naturezas"
+SELECT_SITUACOES = "SELECT id_situacao, descricao_situacao FROM dim_situacoes"
+
+
+def carregar(db: Session, geracao) -> Dimensoes:
+    naturezas = db.execute(text(SELECT_NATUREZAS)).fetchall()
+    situacoes = db.execute(text(SELECT_SITUACOES)).fetchall()
+    return Dimensoes(geracao, dict(naturezas), dict(situacoes))
+
+
+def _em_cache(geracao, naturezas, situacoes):
+    #As dimensões em cache, se forem da geração e tiverem todos os ids informados; senão None
+    atual = _atual
+    if (
+        atual is not None
+        and atual.geracao == geracao
+        and all(id_natureza in atual.naturezas for id_natureza in naturezas)
+        and all(id_situacao in atual.situacoes for id_situacao in situacoes)
+    ):
+        return atual
+    return None
+
+
+def _guardar(novo: Dimensoes) -> Dimensoes:
+    global _atual
+    with _trava:
+        _atual = novo
+    return novo
+
+
+def obter(db: Session, naturezas=(), situacoes=()) -> Dimensoes:
+    """Devolve as dimensões em cache, recarregando-as se a geração do DW mudou ou se algum dos ids
+    informados ainda não estiver no cache (por exemplo, uma carga em andamento que ainda não virou a geração)."""
+    geracao = payloads.geracao_atual(db)
+    atual = _em_cache(geracao, naturezas, situacoes)
+    if atual is not None:
+        return atual
+    #A consulta é feita fora da trava, para não segurar as outras requisições enquanto o banco responde.
+    #Duas requisições podem recarregar ao mesmo tempo; a última a terminar fica no cache.
+    return _guardar(carregar(db, geracao))
+
+
+async def obter_async(db, naturezas=(), situacoes=()) -> Dimensoes:
+    """obter com uma AsyncSession (modo 'async' da API)."""
+    geracao = await payloads.geracao_atual_async(db)
+    atual = _em_cache(geracao, naturezas, situacoes)
+    if atual is not None:
+        return atual
+    naturezas_dw = (await db.execute(text(SELECT_NATUREZAS))).fetchall()
+    situacoes_dw = (await db.execute(text(SELECT_SITUACOES))).fetchall()
+    return _guardar(Dimensoes(geracao, dict(naturezas_dw), dict(situacoes_dw)))
@@ -0,0 +1,199 @@
+import gzip
+import json
+import os
+import threading
+import typing
+
+import brotli
+import msgpack
+import pyarrow as pa
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+
+from api import metricas, payloads
+
+# Representações das respostas do /cda/search e das rotas /resumo/* (negociação de conteúdo).
+# Além do JSON original (lista de objetos, com os nomes das colunas repetidos em cada linha), o cliente pode pedir,
+# pelo cabeçalho Accept ou pelo parâmetro 'formato':
+#   colunar  JSON por colunas: {"coluna": [valores...], ...} (pd.DataFrame(resposta) monta a tabela direto)
+#   msgpack  as mesmas colunas em MessagePack
+#   arrow    um record batch no formato Arrow IPC (stream), com os tipos das colunas
+# As linhas são convertidas direto nos tipos dos modelos de resposta, sem construir um modelo Pydantic por linha.
+# Corpos a partir de API_COMPRESSAO_MINIMA bytes são comprimidos com brotli ou gzip, conforme o Accept-Encoding.
+# As respostas das rotas de resumo mudam só com a geração do DW: cada réplica guarda cada representação já
+# codificada e comprimida, com um ETag próprio, e só a recalcula quando a geração muda.
+
+FORMATOS = {
+    'json': 'application/json',
+    'colunar': 'application/vnd.lamdec.colunar+json',
+    'msgpack': 'application/msgpack',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+# Outros nomes aceitos no Accept para os mesmos formatos
+SINONIMOS = {
+    'application/x-msgpack': 'msgpack',
+    'application/vnd.msgpack': 'msgpack',
+    'application/vnd.apache.arrow.file': 'arrow',
+}
+
+# Tamanho mínimo (bytes) de um corpo para ser comprimido (abaixo disso, a compressão custa mais do que economiza)
+COMPRESSAO_MINIMA = int(os.getenv('API_COMPRESSAO_MINIMA', 1024))
+# Níveis de compressão: respostas calculadas a cada requisição usam níveis rápidos; as de resumo, que são
+# comprimidas uma vez por geração, usam os níveis máximos
+NIVEIS = {
+    False: {'br': 3, 'gzip': 3},
+    True: {'br': 11, 'gzip': 9},
+}
+VARY = 'Accept, Accept-Encoding'
+
+TIPOS_ARROW = {str: pa.string(), int: pa.int64(), float: pa.float64()}
+
+_representacoes = {}  # (rota, formato, codificação pedida) -> (geração, etag, conteúdo, codificação usada)
+_trava = threading.Lock()
+
+
+def _preferencias(cabecalho):
+    #Itens de um Accept/Accept-Encoding com o peso (q), na ordem em que aparecem
+    itens = []
+    for parte in (cabecalho or '').split(','):
+        valor, *parametros = [trecho.strip() for trecho in parte.split(';')]
+        if not valor:
+            continue
+        peso = 1.0
+        for parametro in parametros:
+            nome, _, numero = parametro.partition('=')
+            if nome.strip().lower() == 'q':
+                try:
+                    peso = float(numero)
+                except ValueError:
+                    peso = 0.0
+        itens.append((valor.lower(), peso))
+    return itens
+
+
+def negociar_formato(request: Request, formato=None) -> str:
+    """Formato da resposta: o parâmetro 'formato', se informado, ou o tipo de maior peso no Accept que a API conhece.
+    Sem Accept, com */* ou só com tipos desconhecidos, a resposta é o JSON original."""
+    if formato is not None:
+        if formato not in FORMATOS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Parâmetro inválido: 'formato' deve ser um de {list(FORMATOS)}."
+            )
+        return formato
+
+    por_tipo = {tipo: nome for nome, tipo in FORMATOS.items()}
+    por_tipo.update(SINONIMOS)
+    melhor, maior_peso = 'json', 0.0
+    for tipo, peso in _preferencias(request.headers.get('accept')):
+        nome = por_tipo.get(tipo)
+        if nome is not None and peso > maior_peso:
+            melhor, maior_peso = nome, peso
+    return melhor
+
+
+def negociar_codificacao(request: Request):
+    """Compressão aceita pelo cliente ('br', 'gzip') ou None. Com pesos iguais, brotli é preferido."""
+    pesos = dict(_preferencias(request.headers.get('accept-encoding')))
+    escolhida, maior_peso = None, 0.0
+    for codificacao in ('br', 'gzip'):
+        peso = pesos.get(codificacao, pesos.get('*', 0.0))
+        if peso > maior_peso:
+            escolhida, maior_peso = codificacao, peso
+    return escolhida
+
+
+def colunas_do_modelo(modelo):
+    """(nome na resposta, tipo) de cada campo de um modelo de resposta, na ordem do modelo."""
+    colunas = []
+    for nome, campo in modelo.model_fields.items():
+        tipo = campo.annotation
+        #Optional[X] -> X (os valores nulos são mantidos)
+        argumentos = [argumento for argumento in typing.get_args(tipo) if argumento is not type(None)]
+        if typing.get_origin(tipo) is typing.Union and len(argumentos) == 1:
+            tipo = argumentos[0]
+        colunas.append((campo.alias or nome, tipo))
+    return colunas
+
+
+def para_colunas(linhas, modelo):
+    """Converte as linhas (dicts com os nomes da resposta) em colunas, nos tipos do modelo."""
+    return {
+        nome: [None if linha[nome] is None else tipo(linha[nome]) for linha in linhas]
+        for nome, tipo in colunas_do_modelo(modelo)
+    }
+
+
+def _json(dados) -> bytes:
+    #Mesmas opções do JSONResponse do FastAPI: os bytes do formato 'json' são iguais aos da validação pelo modelo
+    return json.dumps(dados, ensure_ascii=False, allow_nan=False, indent=None, separators=(',', ':')).encode('utf-8')
+
+
+def codificar(colunas, modelo, formato: str) -> bytes:
+    """Serializa as colunas no formato pedido."""
+    with metricas.fase('serializacao'):
+        if formato == 'json':
+            nomes = list(colunas)
+            return _json([dict(zip(nomes, valores)) for valores in zip(*colunas.values())])
+        if formato == 'colunar':
+            return _json(colunas)
+        if formato == 'msgpack':
+            return msgpack.packb(colunas, use_bin_type=True)
+        tipos = dict(colunas_do_modelo(modelo))
+        tabela = pa.table({nome: pa.array(valores, type=TIPOS_ARROW[tipos[nome]]) for nome, valores in colunas.items()})
+        saida = pa.BufferOutputStream()
+        with pa.ipc.new_stream(saida, tabela.schema) as escritor:
+            escritor.write_table(tabela)
+        return saida.getvalue().to_pybytes()
+
+
+def comprimir(conteudo: bytes, codificacao, maximo: bool = False):
+    """Devolve (conteúdo, codificação efetivamente usada). Corpos pequenos não são comprimidos."""
+    if codificacao is None or len(conteudo) < COMPRESSAO_MINIMA:
+        return conteudo, None
+    with metricas.fase('serializacao'):
+        nivel = NIVEIS[maximo][codificacao]
+        if codificacao == 'br':
+            return brotli.compress(conteudo, quality=nivel), codificacao
+        return gzip.compress(conteudo, compresslevel=nivel, mtime=0), codificacao
+
+
+def cabecalhos(formato: str, codificacao, extras=None) -> dict:
+    resultado = {'Content-Type': FORMATOS[formato], 'Vary': VARY, **(extras or {})}
+    if codificacao is not None:
+        resultado['Content-Encoding'] = codificacao
+    return resultado
+
+
+def responder(request: Request, linhas, modelo, formato: str, extras=None) -> Response:
+    """Resposta de uma lista de linhas no formato negociado, comprimida se o cliente aceitar."""
+    conteudo = codificar(para_colunas(linhas, modelo), modelo, formato)
+    conteudo, codificacao = comprimir(conteudo, negociar_codificacao(request))
+    return Response(content=conteudo, headers=cabecalhos(formato, codificacao, extras))
+
+
+def representacao_guardada(rota: str, geracao, formato: str, codificacao):
+    """(etag, conteúdo, codificação) da representação já calculada na geração, ou None."""
+    with _trava:
+        guardada = _representacoes.get((rota, formato, codificacao))
+    if guardada is not None and guardada[0] == geracao:
+        return guardada[1:]
+    return None
+
+
+def representar_resumo(rota: str, geracao, formato: str, codificacao, payload_json: bytes, modelo):
+    """Devolve (etag, conteúdo, codificação) de uma rota de resumo no formato e compressão pedidos, a partir do payload
+    JSON pré-renderizado da geração. Cada representação é calculada uma vez por geração em cada réplica."""
+    guardada = representacao_guardada(rota, geracao, formato, codificacao)
+    if guardada is not None:
+        return guardada
+
+    conteudo = payload_json
+    if formato != 'json':
+        conteudo = codificar(para_colunas(json.loads(payload_json), modelo), modelo, formato)
+    conteudo, usada = comprimir(conteudo, codificacao, maximo=True)
+    #ETag forte por representação: o mesmo conteúdo em outro formato ou com outra compressão tem outro ETag
+    etag = payloads.calcular_etag(conteudo)
+    with _trava:
+        _representacoes[(rota, formato, codificacao)] = (geracao, etag, conteudo, usada)
+    return etag, conteudo, usada
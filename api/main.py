@@ -1,14 +1,24 @@
 from fastapi import FastAPI, Depends, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.exceptions import ResponseValidationError
-from pydantic import BaseModel, Field
-from sqlalchemy import create_engine, text
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from sqlalchemy import bindparam, create_engine, text
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import NullPool
+from starlette.concurrency import run_in_threadpool
 import pandas as pd
 import os
-from typing import List, Optional
+import inspect
+import csv
+import io
+import json
+from collections import namedtuple
+from typing import Dict, List, Optional, get_args
 from datetime import date
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+from api import cache_busca, curvas, dimensoes, formatos, metricas, paginacao, payloads, sketches, snapshot
+from etl import classificacao, montante
 
 load_dotenv()
 
@@ -19,18 +29,63 @@ DB_HOST = os.getenv('DB_HOST')
 DB_DW_NAME = os.getenv('DB_DW_NAME')
 DB_PORT = os.getenv('DB_PORT')
 
-DATABASE_URL = f'mysql+mysqlconnector://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_DW_NAME}'
+# API_DATABASE_URL substitui o MySQL do DW por outro banco (por exemplo, o SQLite do benchmark em api/benchmark.py)
+DATABASE_URL = os.getenv('API_DATABASE_URL') or f'mysql+mysqlconnector://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_DW_NAME}'
+ASYNC_DATABASE_URL = f'mysql+asyncmy://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_DW_NAME}'
 
-engine = create_engine(DATABASE_URL)
+# Modo de acesso ao banco: 'sync' (padrão, endpoints síncronos no threadpool do Starlette, driver mysql-connector)
+# ou 'async' (endpoints assíncronos no event loop, driver asyncmy). Ver rota() mais abaixo.
+API_MODO_BANCO = os.getenv('API_MODO_BANCO', 'sync')
+
+# Pool de conexões (vale para os dois modos): conexões mantidas abertas, conexões extras permitidas em picos
+# e quantos segundos uma requisição espera por uma conexão livre antes de falhar
+POOL = {
+    'pool_size': int(os.getenv('API_POOL_TAMANHO', 5)),
+    'max_overflow': int(os.getenv('API_POOL_EXCEDENTE', 10)),
+    'pool_timeout': float(os.getenv('API_POOL_TIMEOUT', 30)),
+}
+
+# Quantidade de linhas lidas do banco (e enviadas ao cliente) por vez no /cda/export
+TAMANHO_LOTE_EXPORTACAO = int(os.getenv('API_EXPORT_LOTE', 5000))
+
+# Máximo de chaves por requisição nos endpoints de consulta em lote (POST /cda/lote e /cda/detalhes_devedor/lote)
+LOTE_MAXIMO = int(os.getenv('API_LOTE_MAXIMO', 1000))
+
+# Máximo de percentis por requisição no /resumo/montante_acumulado/curva
+PERCENTIS_MAXIMOS = 1000
+
+#No modo 'async', as requisições usam só o pool do engine assíncrono. O engine síncrono fica sem pool: nesse modo,
+#só a exportação (/cda/export) o usa, com uma conexão própria durante todo o envio.
+engine = create_engine(DATABASE_URL, **(POOL if API_MODO_BANCO != 'async' else {'poolclass': NullPool}))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+metricas.instrumentar_engine(engine)
 
+#A conexão é pega do pool logo no início da requisição, para medir a espera por uma conexão livre (ver api/metricas.py)
 def get_db():
     db = SessionLocal()
     try:
+        with metricas.fase('checkout'):
+            db.connection()
         yield db
     finally:
         db.close()
 
+if API_MODO_BANCO == 'async':
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+    engine_async = create_async_engine(ASYNC_DATABASE_URL, **POOL)
+    AsyncSessionLocal = async_sessionmaker(engine_async, autoflush=False, expire_on_commit=False)
+    metricas.instrumentar_engine(engine_async.sync_engine)
+    metricas.observar_pool(engine_async.sync_engine.pool, POOL['pool_size'] + POOL['max_overflow'])
+
+    async def get_db_async():
+        async with AsyncSessionLocal() as db:
+            with metricas.fase('checkout'):
+                await db.connection()
+            yield db
+else:
+    metricas.observar_pool(engine.pool, POOL['pool_size'] + POOL['max_overflow'])
+
 # Modelos de dados (pydantic)
 # Define a estrutura da resposta JSON para garantir o formato correto.
 # Essa é a sessão do código que lida com type errors (internamente pelo pydantic)
@@ -51,6 +106,14 @@ class DetalhesResponse(BaseModel):
     name: str
     tipo_pessoa: str
     cpf_cnpj: Optional[str] = Field(alias="CPF/CNPJ")
+    # Carteira do devedor (resumo_devedores)
+    id_devedor: Optional[int] = None
+    qtde_cdas: Optional[int] = None
+    saldo_total: Optional[float] = None
+    prob_recuperacao_ponderada: Optional[float] = None
+    qtde_em_cobranca: Optional[int] = None
+    qtde_cancelada: Optional[int] = None
+    qtde_quitada: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -82,6 +145,16 @@ class MontanteResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class PontoCurvaResponse(BaseModel):
+    Percentual: float
+    Montante: float
+    erro_maximo: float
+
+class CurvaResponse(BaseModel):
+    quantidade: int
+    saldo_total: float
+    pontos: List[PontoCurvaResponse]
+
 class QtdeResponse(BaseModel):
     name: str
     Quantidade: int
@@ -96,7 +169,142 @@ class SaldoResponse(BaseModel):
     class Config:
         from_attributes = True
 
-app = FastAPI()
+# Consultas em lote: as respostas trazem os resultados indexados pela chave enviada e as chaves não encontradas
+class LoteCdasRequest(BaseModel):
+    numCDAs: List[str]
+
+class LoteCdasResponse(BaseModel):
+    resultados: Dict[str, CdaResponse]
+    nao_encontrados: List[str]
+
+class LoteDevedoresRequest(BaseModel):
+    ids_devedores: List[int]
+
+class LoteDevedoresResponse(BaseModel):
+    resultados: Dict[int, DetalhesResponse]
+    nao_encontrados: List[int]
+
+#Carrega as dimensões em memória na inicialização (ver api/dimensoes.py). Se o DW ainda não estiver pronto,
+#elas são carregadas na primeira requisição que precisar delas.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        if API_MODO_BANCO == 'async':
+            async with AsyncSessionLocal() as db:
+                await dimensoes.obter_async(db)
+        else:
+            with SessionLocal() as db:
+                dimensoes.obter(db)
+    except Exception as e:
+        print(f"Dimensões não carregadas na inicialização: {e}")
+    yield
+    if API_MODO_BANCO == 'async':
+        await engine_async.dispose()
+
+app = FastAPI(lifespan=lifespan)
+app.middleware("http")(metricas.middleware)
+
+#Registra um endpoint (GET, a não ser que outro método seja informado) nos dois modos de acesso ao banco.
+#No modo 'sync', a função síncrona, que recebe uma Session, é registrada como está (o FastAPI a roda no threadpool).
+#No modo 'async', é registrada a variante assíncrona do endpoint, declarada logo depois dele com @<endpoint>.assincrona:
+#ela recebe os mesmos parâmetros (com uma AsyncSession em db) e espera as consultas com await no event loop, então uma
+#réplica atende centenas de requisições ao mesmo tempo sem depender do tamanho do threadpool. O que pesa em Python
+#(varreduras do snapshot, pandas/NumPy, validação pelos modelos de resposta, codificação e compressão) vai para o
+#threadpool com run_in_threadpool, para não travar as outras requisições da réplica.
+def rota(caminho: str, metodo: str = "get", **opcoes):
+    registrar_rota = getattr(app, metodo)
+
+    def registrar(funcao):
+        if API_MODO_BANCO != 'async':
+            registrar_rota(caminho, **opcoes)(metricas.medir_endpoint(funcao))
+
+        def assincrona(variante):
+            if API_MODO_BANCO == 'async':
+                assinatura = inspect.signature(funcao)
+                parametros = [
+                    parametro.replace(annotation=AsyncSession, default=Depends(get_db_async)) if parametro.name == "db" else parametro
+                    for parametro in assinatura.parameters.values()
+                ]
+                medida = metricas.medir_endpoint(variante)
+
+                async def endpoint(**kwargs):
+                    return await medida(**kwargs)
+
+                endpoint.__signature__ = assinatura.replace(parameters=parametros)
+                endpoint.__name__ = funcao.__name__
+                endpoint.__doc__ = funcao.__doc__
+                registrar_rota(caminho, **opcoes)(endpoint)
+            return variante
+
+        funcao.assincrona = assincrona
+        return funcao
+    return registrar
+
+def obter_dimensoes(db: Session, naturezas=(), situacoes=()):
+    try:
+        return dimensoes.obter(db, naturezas, situacoes)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao consultar o banco de dados: {e}")
+
+async def obter_dimensoes_async(db: "AsyncSession", naturezas=(), situacoes=()):
+    try:
+        return await dimensoes.obter_async(db, naturezas, situacoes)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao consultar o banco de dados: {e}")
+
+#Executa uma consulta de leitura e devolve as linhas (erro 500 se o banco falhar)
+def consultar_linhas(db: Session, query, params=None):
+    try:
+        return metricas.buscar(db.execute(query, params))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao consultar o banco de dados: {e}")
+
+async def consultar_linhas_async(db: "AsyncSession", query, params=None):
+    try:
+        return metricas.buscar(await db.execute(query, params))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao consultar o banco de dados: {e}")
+
+#As tabelas de resumo (resumo_*) são recalculadas pelo ETL a cada carga. Um resumo só é usado se for mais recente
+#que a última atualização dos dados do DW (registrada pelo ETL em atualizacoes_dw); se estiver desatualizado ou
+#ainda não existir, o endpoint volta para a consulta direta na tabela fato.
+SELECT_ATUALIZACOES = "SELECT item, atualizado_em FROM atualizacoes_dw WHERE item IN ('dados', :resumo)"
+
+def resumo_atualizado(db: Session, resumo: str) -> bool:
+    try:
+        linhas = db.execute(text(SELECT_ATUALIZACOES), {"resumo": resumo}).fetchall()
+    except Exception:
+        db.rollback()
+        return False
+    return resumo_mais_recente(linhas, resumo)
+
+async def resumo_atualizado_async(db: "AsyncSession", resumo: str) -> bool:
+    try:
+        linhas = (await db.execute(text(SELECT_ATUALIZACOES), {"resumo": resumo})).fetchall()
+    except Exception:
+        await db.rollback()
+        return False
+    return resumo_mais_recente(linhas, resumo)
+
+def resumo_mais_recente(linhas, resumo: str) -> bool:
+    atualizacoes = {linha.item: linha.atualizado_em for linha in linhas}
+    return 'dados' in atualizacoes and resumo in atualizacoes and atualizacoes[resumo] >= atualizacoes['dados']
+
+#Valida os dados pelo modelo de resposta e gera o JSON como o FastAPI faria com o response_model (nomes pelos aliases)
+def serializar(adaptador: TypeAdapter, dados) -> bytes:
+    with metricas.fase('serializacao'):
+        try:
+            validado = adaptador.validate_python(dados, from_attributes=True)
+        except ValidationError as exc:
+            raise ResponseValidationError(errors=exc.errors())
+        return adaptador.dump_json(validado, by_alias=True)
+
+#Nas variantes assíncronas, a resposta é montada (montar(*args)), validada e serializada no threadpool: com o
+#response_model, o FastAPI validaria e serializaria no event loop.
+async def responder_modelo_async(adaptador: TypeAdapter, montar, *args) -> Response:
+    def responder():
+        return Response(content=serializar(adaptador, montar(*args)), media_type="application/json")
+    return await run_in_threadpool(responder)
 
 #Essa função serve para retornar erros internos de servidor (código 500) mais detalhados para facilitar depuração de erros.
 @app.exception_handler(ResponseValidationError)
@@ -106,8 +314,16 @@ async def validation_exception_handler(request: Request, exc: ResponseValidation
         content={"detail": "Ocorreu um erro interno ao validar os dados de resposta.", "validation_errors": exc.errors()},
     )
 
-@app.get("/cda/search", response_model=List[CdaResponse])
+#Métricas no formato do Prometheus (ver api/metricas.py)
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    conteudo, tipo = metricas.exportar()
+    return Response(conteudo, media_type=tipo)
+
+@rota("/cda/search", response_model=List[CdaResponse])
 def search_cda(
+    # Requisição, para negociar o formato (Accept) e a compressão (Accept-Encoding) da resposta
+    request: Request,
     # Parâmetros de filtro opcionais
     numCDA: Optional[str] = None,
     minSaldo: Optional[float] = None,
@@ -121,11 +337,206 @@ def search_cda(
     sort_order: str = "asc",
     skip: int = 0,
     limit: int = 100,
+    # Paginação por cursor: valor do cabeçalho X-Next-Cursor da página anterior
+    cursor: Optional[str] = None,
+    # Formato da resposta ('json', 'colunar', 'msgpack' ou 'arrow'); sem ele, vale o cabeçalho Accept
+    formato: Optional[str] = None,
     # Injeção de dependência da sessão do banco de dados
     db: Session = Depends(get_db)
 ):
 
-    #Verificação dos parâmetros de intervalo e paginação
+    validar_paginacao(skip, limit, cursor)
+    formato = formatos.negociar_formato(request, formato)
+
+    #Buscas idênticas são respondidas pelo cache da réplica ou esperam a que já está consultando o banco (ver api/cache_busca.py)
+    busca = dict(
+        numCDA=numCDA, minSaldo=minSaldo, maxSaldo=maxSaldo, minAno=minAno, maxAno=maxAno, natureza=natureza,
+        agrupamento_situacao=agrupamento_situacao, sort_by=sort_by, sort_order=sort_order, skip=skip, limit=limit,
+        cursor=cursor, current_year=date.today().year
+    )
+    resultado = cache_busca.obter(
+        db, chave_busca(**busca), lambda: executar_busca(db, **busca), tamanho=lambda resultado: len(resultado[0])
+    )
+    return responder_busca(request, resultado, formato)
+
+@search_cda.assincrona
+async def search_cda_async(request: Request, db: "AsyncSession", formato: Optional[str] = None, **busca):
+    validar_paginacao(busca["skip"], busca["limit"], busca["cursor"])
+    formato = formatos.negociar_formato(request, formato)
+
+    busca["current_year"] = date.today().year
+    resultado = await cache_busca.obter_async(
+        db, chave_busca(**busca), lambda: executar_busca_async(db, **busca), tamanho=lambda resultado: len(resultado[0])
+    )
+    return await run_in_threadpool(responder_busca, request, resultado, formato)
+
+#Verificação dos parâmetros de paginação (os de filtro e ordenação são verificados em validar_busca)
+def validar_paginacao(skip: int, limit: int, cursor: Optional[str]):
+    if skip < 0:
+        raise HTTPException(
+            status_code=400,
+            detail="Parâmetro inválido: 'skip' não pode ser um número negativo."
+        )
+    
+    if limit <= 0:
+        raise HTTPException(
+            status_code=400,
+            detail="Parâmetro inválido: 'limit' deve ser um número positivo."
+        )
+
+    if cursor is not None and skip > 0:
+        raise HTTPException(
+            status_code=400,
+            detail="Parâmetro inválido: 'skip' e 'cursor' não podem ser usados juntos."
+        )
+
+#Chave da busca no cache: os parâmetros normalizados (o trecho da natureza sem acentos e maiúsculas)
+def chave_busca(numCDA, minSaldo, maxSaldo, minAno, maxAno, natureza, agrupamento_situacao,
+                sort_by, sort_order, skip, limit, cursor, current_year):
+    return (
+        numCDA or None, minSaldo, maxSaldo, minAno, maxAno, classificacao.normalizar(natureza) if natureza else None,
+        agrupamento_situacao, sort_by, sort_order, skip, limit, cursor, current_year
+    )
+
+def responder_busca(request: Request, resultado, formato: str):
+    final_response, proximo_cursor = resultado
+
+    # Página cheia: pode haver mais linhas, então devolvemos o cursor da próxima página
+    cabecalhos = {}
+    if proximo_cursor is not None:
+        cabecalhos[paginacao.CABECALHO_PROXIMO_CURSOR] = proximo_cursor
+
+    #As linhas já estão nos tipos de CdaResponse: são serializadas direto, sem um modelo Pydantic por linha (ver api/formatos.py)
+    return formatos.responder(request, final_response, CdaResponse, formato, cabecalhos)
+
+#Executa a busca de CDAs (pelo snapshot ou pelo banco) e devolve (linhas da resposta, cursor da próxima página ou None)
+def executar_busca(
+    db: Session,
+    numCDA: Optional[str],
+    minSaldo: Optional[float],
+    maxSaldo: Optional[float],
+    minAno: Optional[int],
+    maxAno: Optional[int],
+    natureza: Optional[str],
+    agrupamento_situacao: Optional[int],
+    sort_by: str,
+    sort_order: str,
+    skip: int,
+    limit: int,
+    cursor: Optional[str],
+    current_year: int
+):
+    #Com o snapshot colunar da geração atual, a busca é feita em memória, sem consultar a tabela fato (ver api/snapshot.py)
+    snap = snapshot.obter(db)
+    if snap is not None:
+        return buscar_no_snapshot(
+            snap, numCDA, minSaldo, maxSaldo, minAno, maxAno, natureza, agrupamento_situacao,
+            sort_by, sort_order, skip, limit, cursor, current_year
+        )
+
+    query_str, params = montar_busca(
+        obter_dimensoes(db), numCDA, minSaldo, maxSaldo, minAno, maxAno, natureza, agrupamento_situacao, sort_by, sort_order, cursor
+    )
+    if query_str is None:
+        return [], None
+
+    results = consultar_linhas(db, *consulta_pagina(query_str, params, limit, skip))
+    dims = obter_dimensoes(db, naturezas={row.fk_natureza for row in results})
+    return montar_pagina(results, dims, sort_by, sort_order, limit, current_year)
+
+async def executar_busca_async(
+    db: "AsyncSession",
+    numCDA: Optional[str],
+    minSaldo: Optional[float],
+    maxSaldo: Optional[float],
+    minAno: Optional[int],
+    maxAno: Optional[int],
+    natureza: Optional[str],
+    agrupamento_situacao: Optional[int],
+    sort_by: str,
+    sort_order: str,
+    skip: int,
+    limit: int,
+    cursor: Optional[str],
+    current_year: int
+):
+    snap = await snapshot.obter_async(db)
+    if snap is not None:
+        return await run_in_threadpool(
+            buscar_no_snapshot, snap, numCDA, minSaldo, maxSaldo, minAno, maxAno, natureza, agrupamento_situacao,
+            sort_by, sort_order, skip, limit, cursor, current_year
+        )
+
+    query_str, params = montar_busca(
+        await obter_dimensoes_async(db), numCDA, minSaldo, maxSaldo, minAno, maxAno, natureza, agrupamento_situacao,
+        sort_by, sort_order, cursor
+    )
+    if query_str is None:
+        return [], None
+
+    results = await consultar_linhas_async(db, *consulta_pagina(query_str, params, limit, skip))
+    dims = await obter_dimensoes_async(db, naturezas={row.fk_natureza for row in results})
+    return await run_in_threadpool(montar_pagina, results, dims, sort_by, sort_order, limit, current_year)
+
+def buscar_no_snapshot(
+    snap,
+    numCDA: Optional[str],
+    minSaldo: Optional[float],
+    maxSaldo: Optional[float],
+    minAno: Optional[int],
+    maxAno: Optional[int],
+    natureza: Optional[str],
+    agrupamento_situacao: Optional[int],
+    sort_by: str,
+    sort_order: str,
+    skip: int,
+    limit: int,
+    cursor: Optional[str],
+    current_year: int
+):
+    validar_busca(minSaldo, maxSaldo, minAno, maxAno, sort_by, sort_order)
+    posicao_cursor = paginacao.decodificar_cursor(cursor, sort_by, sort_order) if cursor is not None else None
+    with metricas.fase('db_leitura'):
+        results = snap.buscar(
+            numCDA, minSaldo, maxSaldo, minAno, maxAno, natureza, agrupamento_situacao,
+            sort_by, sort_order, skip, limit, posicao_cursor
+        )
+    metricas.acumular('linhas', len(results))
+    return montar_pagina(results, snap.dims, sort_by, sort_order, limit, current_year)
+
+# Lógica de Paginação
+def consulta_pagina(query_str: str, params: dict, limit: int, skip: int):
+    query_str += " LIMIT :limit OFFSET :skip"
+    params = {**params, "limit": limit, "skip": skip}
+    return query_busca(query_str, params), params
+
+#Linhas da resposta e cursor da próxima página a partir das linhas da busca
+def montar_pagina(results, dims, sort_by: str, sort_order: str, limit: int, current_year: int):
+    # Página cheia: pode haver mais linhas
+    proximo_cursor = None
+    if len(results) == limit:
+        ultima = results[-1]
+        ultimo_valor = ultima.ano_inscricao if sort_by == "ano" else ultima.valor_saldo_atualizado
+        proximo_cursor = paginacao.codificar_cursor(sort_by, sort_order, ultimo_valor, ultima.numCDA)
+
+    # Resultado
+    final_response = []
+    for row in results:
+        cda_data = montar_cda(row, dims, current_year)
+        if cda_data is not None:
+            final_response.append(cda_data)
+
+    return final_response, proximo_cursor
+
+#Verificação dos parâmetros de intervalo e ordenação da busca de CDAs
+def validar_busca(
+    minSaldo: Optional[float],
+    maxSaldo: Optional[float],
+    minAno: Optional[int],
+    maxAno: Optional[int],
+    sort_by: str,
+    sort_order: str
+):
     if minSaldo is not None and maxSaldo is not None and minSaldo > maxSaldo:
         raise HTTPException(
             status_code=400,
@@ -149,18 +560,23 @@ def search_cda(
             status_code=400,
             detail="Parâmetro inválido: 'sort_order' deve ser 'asc' ou 'desc'."
         )
-    
-    if skip < 0:
-        raise HTTPException(
-            status_code=400,
-            detail="Parâmetro inválido: 'skip' não pode ser um número negativo."
-        )
-    
-    if limit <= 0:
-        raise HTTPException(
-            status_code=400,
-            detail="Parâmetro inválido: 'limit' deve ser um número positivo."
-        )
+
+#Monta o SELECT da busca de CDAs (filtros e ordenação), usado pelo /cda/search e pelo /cda/export.
+#Devolve (None, None) quando o filtro de natureza não corresponde a nenhuma natureza (resultado vazio).
+def montar_busca(
+    dims,
+    numCDA: Optional[str],
+    minSaldo: Optional[float],
+    maxSaldo: Optional[float],
+    minAno: Optional[int],
+    maxAno: Optional[int],
+    natureza: Optional[str],
+    agrupamento_situacao: Optional[int],
+    sort_by: str,
+    sort_order: str,
+    cursor: Optional[str] = None
+):
+    validar_busca(minSaldo, maxSaldo, minAno, maxAno, sort_by, sort_order)
 
     query_str = """
         SELECT 
@@ -168,10 +584,9 @@ def search_cda(
             f.valor_saldo AS valor_saldo_atualizado,
             f.ano_inscricao,
             f.fk_situacao AS agrupamento_situacao,
-            d.descricao_natureza AS natureza,
+            f.fk_natureza,
             f.prob_recuperacao AS score
         FROM fatos_cdas f
-        JOIN dim_naturezas d ON f.fk_natureza = d.id_natureza
     """
     
     # Lista para armazenar as cláusulas WHERE e dicionário para os parâmetros
@@ -195,11 +610,19 @@ def search_cda(
         where_clauses.append("f.ano_inscricao <= :maxAno")
         params["maxAno"] = maxAno
     if natureza:
-        where_clauses.append("d.descricao_natureza LIKE :natureza")
-        params["natureza"] = f"%{natureza}%"
+        # O trecho da natureza é resolvido em memória para a lista de ids que o contêm (sem JOIN nem LIKE no banco)
+        ids_natureza = dims.ids_natureza(natureza)
+        if not ids_natureza:
+            return None, None
+        where_clauses.append("f.fk_natureza IN :naturezas")
+        params["naturezas"] = ids_natureza
     if agrupamento_situacao is not None:
         where_clauses.append("f.fk_situacao = :agrupamento_situacao")
         params["agrupamento_situacao"] = agrupamento_situacao
+    # Paginação por cursor: continua logo depois da última linha da página anterior (ver api/paginacao.py)
+    if cursor is not None:
+        params["cursor_valor"], params["cursor_cda"] = paginacao.decodificar_cursor(cursor, sort_by, sort_order)
+        where_clauses.append(paginacao.condicao_cursor(sort_by, sort_order))
 
     # Junta as cláusulas WHERE, se houver alguma
     if where_clauses:
@@ -207,256 +630,808 @@ def search_cda(
 
     # Lógica de Ordenação
     # Valida os inputs para evitar SQL Injection
-    order_column = "f.ano_inscricao" if sort_by == "ano" else "f.valor_saldo"
+    # num_cda desempata a ordenação, para que as páginas (por offset ou por cursor) sejam estáveis
+    order_column = paginacao.COLUNAS_ORDENACAO[sort_by]
     order_direction = "DESC" if sort_order == "desc" else "ASC"
-    query_str += f" ORDER BY {order_column} {order_direction}"
+    query_str += f" ORDER BY {order_column} {order_direction}, f.num_cda {order_direction}"
 
-    # Lógica de Paginação
-    query_str += " LIMIT :limit OFFSET :skip"
-    params["limit"] = limit
-    params["skip"] = skip
+    return query_str, params
+
+def query_busca(query_str: str, params: dict):
+    query = text(query_str)
+    if "naturezas" in params:
+        query = query.bindparams(bindparam("naturezas", expanding=True))
+    return query
+
+#Converte uma linha da busca no formato de CdaResponse. Devolve None para CDAs de naturezas inexistentes
+#(que ficavam de fora no antigo JOIN com dim_naturezas).
+def montar_cda(row, dims, current_year: int):
+    natureza = dims.naturezas.get(row.fk_natureza)
+    if natureza is None:
+        return None
+    return {
+        "numCDA": str(row.numCDA),
+        "valor_saldo_atualizado": row.valor_saldo_atualizado,
+        # Calcula a idade da CDA
+        "qtde_anos_idade_cda": current_year - row.ano_inscricao,
+        "agrupamento_situacao": row.agrupamento_situacao,
+        "natureza": natureza,
+        "score": row.score,
+    }
 
-    # Executa a query final
+#Formatos do /cda/export e seus media types
+FORMATOS_EXPORTACAO = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+#Exportação do resultado completo de uma busca, com os mesmos filtros e ordenação do /cda/search, mas sem paginação.
+#Em vez de ler tudo com fetchall e validar a lista inteira pelo Pydantic, as linhas são lidas de um cursor não
+#bufferizado do driver e enviadas em lotes (NDJSON, uma CDA por linha, ou CSV). A memória fica constante e o primeiro
+#byte sai logo, qualquer que seja o tamanho do resultado.
+@app.get("/cda/export")
+def exportar_cdas(
+    numCDA: Optional[str] = None,
+    minSaldo: Optional[float] = None,
+    maxSaldo: Optional[float] = None,
+    minAno: Optional[int] = None,
+    maxAno: Optional[int] = None,
+    natureza: Optional[str] = None,
+    agrupamento_situacao: Optional[int] = None,
+    sort_by: str = "ano",
+    sort_order: str = "asc",
+    formato: str = "ndjson"
+):
+    if formato not in FORMATOS_EXPORTACAO:
+        raise HTTPException(
+            status_code=400,
+            detail="Parâmetro inválido: 'formato' deve ser 'ndjson' ou 'csv'."
+        )
+
+    #A sessão fica aberta durante todo o envio, então é criada aqui e fechada pelo gerador (ao terminar ou se o
+    #cliente desconectar). A exportação usa o engine síncrono nos dois modos da API; cada lote é lido no threadpool.
+    db = SessionLocal()
     try:
-        results = db.execute(text(query_str), params).fetchall()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao consultar o banco de dados: {e}")
+        #As dimensões são carregadas antes: com o cursor não bufferizado aberto, a conexão não aceita outras consultas
+        dims = obter_dimensoes(db)
+        query_str, params = montar_busca(
+            dims, numCDA, minSaldo, maxSaldo, minAno, maxAno, natureza, agrupamento_situacao, sort_by, sort_order
+        )
+    except Exception:
+        db.close()
+        raise
 
-    # Resultado
-    final_response = []
-    current_year = date.today().year
-    for row in results:
-        # Cria um dicionário a partir do resultado para manipulação
-        cda_data = dict(row._mapping)
+    return StreamingResponse(
+        gerar_exportacao(db, query_str, params, dims, formato),
+        media_type=FORMATOS_EXPORTACAO[formato],
+        headers={"Content-Disposition": f'attachment; filename="cdas.{formato}"'},
+    )
 
-        cda_data['numCDA'] = str(cda_data['numCDA'])
-        
-        # Calcula a idade da CDA
-        cda_data['qtde_anos_idade_cda'] = current_year - cda_data.get('ano_inscricao', current_year)
-        
-        # Remove a coluna de ano que não faz parte do modelo de resposta final
-        del cda_data['ano_inscricao']
+#Abre a consulta da exportação num cursor do próprio driver. O mysql-connector, pelo SQLAlchemy, usa cursores
+#bufferizados (o resultado inteiro é lido para a memória no execute, e o stream_results do SQLAlchemy não muda isso),
+#então o cursor é pedido com buffered=False: as linhas vêm do MySQL à medida que são lidas com fetchmany.
+def abrir_cursor_exportacao(db: Session, query_str: str, params: dict):
+    dialeto = db.get_bind().dialect
+    compilada = query_busca(query_str, params).bindparams(**params).compile(
+        dialect=dialeto, compile_kwargs={"render_postcompile": True}
+    )
+    argumentos = {"buffered": False} if dialeto.driver == "mysqlconnector" else {}
+    cursor = db.connection().connection.cursor(**argumentos)
+    with metricas.fase("db_execucao"):
+        cursor.execute(compilada.string, [compilada.params[nome] for nome in compilada.positiontup])
+    return cursor
+
+def gerar_exportacao(db: Session, query_str: Optional[str], params: dict, dims, formato: str):
+    colunas = list(CdaResponse.model_fields)
+    cursor, concluida = None, False
+    try:
+        if formato == "csv":
+            yield formatar_csv([colunas])
+        if query_str is None:
+            concluida = True
+            return
+
+        current_year = date.today().year
+        cursor = abrir_cursor_exportacao(db, query_str, params)
+        Linha = namedtuple("Linha", [coluna[0] for coluna in cursor.description])
+        while True:
+            lote = cursor.fetchmany(TAMANHO_LOTE_EXPORTACAO)
+            if not lote:
+                break
+            cdas = [cda for cda in (montar_cda(Linha._make(row), dims, current_year) for row in lote) if cda is not None]
+            if formato == "csv":
+                yield formatar_csv([[cda[coluna] for coluna in colunas] for cda in cdas])
+            else:
+                yield "".join(json.dumps(cda, default=float, ensure_ascii=False) + "\n" for cda in cdas).encode()
+        concluida = True
+    except Exception:
+        #O status 200 e parte do arquivo já foram enviados. A última linha avisa que a exportação foi interrompida e o
+        #erro é relançado, o que encerra a conexão sem o fim da resposta: o cliente vê a falha, e não um arquivo truncado.
+        aviso = {"erro": "Exportação interrompida por um erro no servidor; o arquivo está incompleto."}
+        if formato == "csv":
+            yield formatar_csv([["#erro", aviso["erro"]]])
+        else:
+            yield (json.dumps(aviso, ensure_ascii=False) + "\n").encode()
+        raise
+    finally:
+        if cursor is not None and not concluida:
+            #Um cursor não bufferizado com linhas não lidas deixa a conexão inutilizável: ela é descartada do pool
+            db.connection().invalidate()
+        elif cursor is not None:
+            cursor.close()
+        db.close()
 
-        final_response.append(cda_data)
+def formatar_csv(linhas) -> bytes:
+    saida = io.StringIO()
+    csv.writer(saida).writerows(linhas)
+    return saida.getvalue().encode()
 
-    return final_response
+#Colunas de ordenação do /cda/detalhes_devedor: exposição (saldo total) ou quantidade de CDAs
+ORDENACAO_DEVEDORES = {
+    "saldo": "saldo_total",
+    "quantidade": "qtde_cdas",
+}
 
-@app.get("/cda/detalhes_devedor", response_model=List[DetalhesResponse])
+@rota("/cda/detalhes_devedor", response_model=List[DetalhesResponse])
 def detalhes_devedor(
+    # Ordenação (por padrão, os devedores com maior exposição primeiro) e paginação
+    sort_by: str = "saldo",
+    sort_order: str = "desc",
+    skip: int = 0,
+    limit: int = 100,
     id_devedor: Optional[int] = None,    #Por mais que não esteja especificado no enunciado, detalhes_devedor parece
     db: Session = Depends(get_db) #se referir a um devedor especifico, portanto, faria sentido poder achá-lo a partir de seu id_devedor.
 ):
-    #DISTINCT para não repetir devedores.
+    condicao, ordenacao, params = preparar_detalhes(sort_by, sort_order, skip, limit, id_devedor)
+    return consultar_linhas(
+        db, text(consulta_carteira(resumo_atualizado(db, 'resumo_devedores'), condicao) + ordenacao), params
+    )
+
+@detalhes_devedor.assincrona
+async def detalhes_devedor_async(sort_by: str, sort_order: str, skip: int, limit: int, id_devedor: Optional[int], db: "AsyncSession"):
+    condicao, ordenacao, params = preparar_detalhes(sort_by, sort_order, skip, limit, id_devedor)
+    results = await consultar_linhas_async(
+        db, text(consulta_carteira(await resumo_atualizado_async(db, 'resumo_devedores'), condicao) + ordenacao), params
+    )
+    return await responder_modelo_async(ADAPTADOR_DETALHES, lambda: results)
+
+ADAPTADOR_DETALHES = TypeAdapter(List[DetalhesResponse])
+
+#Valida os parâmetros do /cda/detalhes_devedor e devolve (condição do id, ordenação e paginação, parâmetros da consulta)
+def preparar_detalhes(sort_by: str, sort_order: str, skip: int, limit: int, id_devedor: Optional[int]):
+    if sort_by not in ORDENACAO_DEVEDORES:
+        raise HTTPException(
+            status_code=400,
+            detail="Parâmetro inválido: 'sort_by' deve ser 'saldo' ou 'quantidade'."
+        )
+
+    if sort_order not in ["asc", "desc"]:
+        raise HTTPException(
+            status_code=400,
+            detail="Parâmetro inválido: 'sort_order' deve ser 'asc' ou 'desc'."
+        )
+
+    if skip < 0:
+        raise HTTPException(
+            status_code=400,
+            detail="Parâmetro inválido: 'skip' não pode ser um número negativo."
+        )
+
+    if limit <= 0:
+        raise HTTPException(
+            status_code=400,
+            detail="Parâmetro inválido: 'limit' deve ser um número positivo."
+        )
+
+    params = {"id_devedor": id_devedor, "limit": limit, "skip": skip, **classificacao.CODIGOS_GRUPO}
+    order_direction = "DESC" if sort_order == "desc" else "ASC"
+    ordenacao = f" ORDER BY {ORDENACAO_DEVEDORES[sort_by]} {order_direction}, id_devedor {order_direction} LIMIT :limit OFFSET :skip"
+    condicao = "= :id_devedor" if id_devedor is not None else None
+    return condicao, ordenacao, params
+
+#SELECT da carteira dos devedores, no formato de DetalhesResponse, usado pelo /cda/detalhes_devedor e pela consulta em lote.
+#Caminho rápido (resumo=True): a carteira de cada devedor já calculada pelo ETL (resumo_devedores), lida pelos índices.
+#Sem o resumo, a carteira é agregada na hora a partir da junção com os fatos. Os grupos de situação são os códigos
+#gravados pelo ETL na tabela fato (cod_grupo_situacao), sem JOIN com dim_situacoes (parâmetros em classificacao.CODIGOS_GRUPO).
+#'condicao' filtra pelo id do devedor ("= :id_devedor", "IN :ids"). Nos dois caminhos, só aparecem devedores ligados a alguma CDA.
+def consulta_carteira(resumo: bool, condicao: Optional[str] = None) -> str:
+    if resumo:
+        query_str = """
+            SELECT
+                nome AS name,
+                tipo_pessoa,
+                cpf_cnpj AS `CPF/CNPJ`,
+                id_devedor,
+                qtde_cdas,
+                saldo_total,
+                prob_recuperacao_ponderada,
+                qtde_em_cobranca,
+                qtde_cancelada,
+                qtde_quitada
+            FROM resumo_devedores
+        """
+        if condicao is not None:
+            query_str += f" WHERE id_devedor {condicao}"
+        return query_str
+
     query_str = """
-        SELECT DISTINCT
+        SELECT
            d.nome AS name,
            d.tipo_pessoa,
-           d.cpf_cnpj AS `CPF/CNPJ`
+           d.cpf_cnpj AS `CPF/CNPJ`,
+           d.id_devedor,
+           COUNT(*) AS qtde_cdas,
+           SUM(f.valor_saldo) AS saldo_total,
+           SUM(f.prob_recuperacao * f.valor_saldo) / NULLIF(SUM(f.valor_saldo), 0) AS prob_recuperacao_ponderada,
+           COUNT(CASE WHEN f.cod_grupo_situacao = :em_cobranca THEN 1 END) AS qtde_em_cobranca,
+           COUNT(CASE WHEN f.cod_grupo_situacao = :cancelada THEN 1 END) AS qtde_cancelada,
+           COUNT(CASE WHEN f.cod_grupo_situacao = :quitada THEN 1 END) AS qtde_quitada
         FROM jun_cdas_devedores j
         JOIN dim_devedores d ON j.fk_devedor = d.id_devedor
+        JOIN fatos_cdas f ON j.fk_cda = f.num_cda
     """
-    if id_devedor is not None:
-        query_str += " WHERE j.fk_devedor = :id_devedor"
+    if condicao is not None:
+        query_str += f" WHERE j.fk_devedor {condicao}"
+    return query_str + " GROUP BY d.id_devedor, d.nome, d.tipo_pessoa, d.cpf_cnpj"
 
-    try:
-        results = db.execute(text(query_str), {"id_devedor": id_devedor}).fetchall()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao consultar o banco de dados: {e}")
-    return results
+#Consultas em lote: resolvem até LOTE_MAXIMO chaves com uma única consulta (num_cda IN (...) / id_devedor IN (...),
+#pelas chaves primárias), em vez de uma requisição, sessão e consulta por chave.
+def verificar_lote(chaves: list):
+    if not chaves:
+        raise HTTPException(
+            status_code=400,
+            detail="Parâmetro inválido: o lote deve ter pelo menos uma chave."
+        )
+    if len(chaves) > LOTE_MAXIMO:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Parâmetro inválido: o lote pode ter no máximo {LOTE_MAXIMO} chaves."
+        )
+
+#num_cda é numérico: uma chave só pode existir se for formada por dígitos ASCII (str.isdigit também aceita "²" ou
+#dígitos de outros alfabetos, que int() rejeita ou converte para outro número). Devolve o número ou None.
+def numero_cda(chave: str):
+    chave = chave.strip()
+    return int(chave) if chave.isascii() and chave.isdigit() else None
+
+@rota("/cda/lote", metodo="post", response_model=LoteCdasResponse)
+def buscar_cdas_em_lote(
+    lote: LoteCdasRequest,
+    db: Session = Depends(get_db)
+):
+    numeros = numeros_do_lote(lote)
+    results = consultar_linhas(db, CONSULTA_LOTE_CDAS, {"numeros": numeros}) if numeros else []
+    dims = obter_dimensoes(db, naturezas={row.fk_natureza for row in results})
+    return montar_lote_cdas(lote, results, dims, date.today().year)
+
+@buscar_cdas_em_lote.assincrona
+async def buscar_cdas_em_lote_async(lote: LoteCdasRequest, db: "AsyncSession"):
+    numeros = numeros_do_lote(lote)
+    results = await consultar_linhas_async(db, CONSULTA_LOTE_CDAS, {"numeros": numeros}) if numeros else []
+    dims = await obter_dimensoes_async(db, naturezas={row.fk_natureza for row in results})
+    return await responder_modelo_async(ADAPTADOR_LOTE_CDAS, montar_lote_cdas, lote, results, dims, date.today().year)
+
+ADAPTADOR_LOTE_CDAS = TypeAdapter(LoteCdasResponse)
+
+CONSULTA_LOTE_CDAS = text("""
+    SELECT 
+        f.num_cda AS numCDA,
+        f.valor_saldo AS valor_saldo_atualizado,
+        f.ano_inscricao,
+        f.fk_situacao AS agrupamento_situacao,
+        f.fk_natureza,
+        f.prob_recuperacao AS score
+    FROM fatos_cdas f
+    WHERE f.num_cda IN :numeros
+""").bindparams(bindparam("numeros", expanding=True))
+
+#Números das CDAs do lote, em ordem e sem repetição. Chaves que não são números não podem existir e já vão para os não encontrados
+def numeros_do_lote(lote: LoteCdasRequest):
+    verificar_lote(lote.numCDAs)
+    return sorted({numero for numero in map(numero_cda, lote.numCDAs) if numero is not None})
 
-@app.get("/resumo/distribuicao_cdas", response_model=List[DistribuicaoResponse])
+def montar_lote_cdas(lote: LoteCdasRequest, results, dims, current_year: int):
+    encontrados = {}
+    for row in results:
+        cda_data = montar_cda(row, dims, current_year)
+        if cda_data is not None:
+            encontrados[row.numCDA] = cda_data
+
+    resultados = {}
+    nao_encontrados = []
+    for chave in dict.fromkeys(lote.numCDAs):
+        cda_data = encontrados.get(numero_cda(chave))
+        if cda_data is None:
+            nao_encontrados.append(chave)
+        else:
+            resultados[chave] = cda_data
+    return {"resultados": resultados, "nao_encontrados": nao_encontrados}
+
+@rota("/cda/detalhes_devedor/lote", metodo="post", response_model=LoteDevedoresResponse)
+def detalhes_devedores_em_lote(
+    lote: LoteDevedoresRequest,
+    db: Session = Depends(get_db)
+):
+    verificar_lote(lote.ids_devedores)
+
+    #Mesma carteira do /cda/detalhes_devedor (do resumo_devedores, se estiver atualizado, ou agregada dos fatos)
+    results = consultar_linhas(
+        db, consulta_lote_devedores(resumo_atualizado(db, 'resumo_devedores')), parametros_lote_devedores(lote)
+    )
+    return montar_lote_devedores(lote, results)
+
+@detalhes_devedores_em_lote.assincrona
+async def detalhes_devedores_em_lote_async(lote: LoteDevedoresRequest, db: "AsyncSession"):
+    verificar_lote(lote.ids_devedores)
+    results = await consultar_linhas_async(
+        db, consulta_lote_devedores(await resumo_atualizado_async(db, 'resumo_devedores')), parametros_lote_devedores(lote)
+    )
+    return await responder_modelo_async(ADAPTADOR_LOTE_DEVEDORES, montar_lote_devedores, lote, results)
+
+ADAPTADOR_LOTE_DEVEDORES = TypeAdapter(LoteDevedoresResponse)
+
+def consulta_lote_devedores(resumo: bool):
+    return text(consulta_carteira(resumo, "IN :ids")).bindparams(bindparam("ids", expanding=True))
+
+def parametros_lote_devedores(lote: LoteDevedoresRequest) -> dict:
+    return {"ids": sorted(set(lote.ids_devedores)), **classificacao.CODIGOS_GRUPO}
+
+def montar_lote_devedores(lote: LoteDevedoresRequest, results):
+    encontrados = {row.id_devedor: row for row in results}
+    resultados = {}
+    nao_encontrados = []
+    for id_devedor in dict.fromkeys(lote.ids_devedores):
+        if id_devedor in encontrados:
+            resultados[id_devedor] = encontrados[id_devedor]
+        else:
+            nao_encontrados.append(id_devedor)
+    return {"resultados": resultados, "nao_encontrados": nao_encontrados}
+
+@rota("/resumo/distribuicao_cdas", response_model=List[DistribuicaoResponse])
 def distribuicao_cdas(
+    request: Request,
+    # Formato da resposta ('json', 'colunar', 'msgpack' ou 'arrow'); sem ele, vale o cabeçalho Accept
+    formato: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    #A lógica desse query é setar como 1 e passar para o count, que por padrão ignora os valores Null (que os condicionais
-    #atribuem automaticamente quando a condição não é cumprida), e, portanto, só conta nas colunas especificadas. *100/total é simplesmente
-    #conversão para porcentagem.
-    query_str = """
-        SELECT
-            d.descricao_natureza AS name,
-            (COUNT(CASE 
-                WHEN s.descricao_situacao LIKE 'Cobrança%' OR s.descricao_situacao IN ('Parcelada', 'Leilão', 'Arrematação', 'Negociada', 'Parcelamento Irregular') 
-                THEN 1 
-             END) * 100.0 / COUNT(*)) AS `Em cobranca`,
-            (COUNT(CASE 
-                WHEN s.descricao_situacao LIKE 'Cancelada%' OR s.descricao_situacao = 'Migracao Cancelamento'
-                THEN 1 
-             END) * 100.0 / COUNT(*)) AS `Cancelada`,
-            (COUNT(CASE 
-                WHEN s.descricao_situacao LIKE 'Paga%' OR s.descricao_situacao = 'Migracao Pagos'
-                THEN 1 
-             END) * 100.0 / COUNT(*)) AS `Quitada`
-        FROM 
-            fatos_cdas f
-        JOIN 
-            dim_naturezas d ON f.fk_natureza = d.id_natureza
-        JOIN 
-            dim_situacoes s ON f.fk_situacao = s.id_situacao
-        GROUP BY 
-            d.descricao_natureza
-        ORDER BY
-            d.descricao_natureza;
-    """
+    return servir_resumo(request, db, "/resumo/distribuicao_cdas", formato)
 
-    try:
-        results = db.execute(text(query_str)).fetchall()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao consultar o banco de dados: {e}")
-    return results
+@distribuicao_cdas.assincrona
+async def distribuicao_cdas_async(request: Request, formato: Optional[str], db: "AsyncSession"):
+    return await servir_resumo_async(request, db, "/resumo/distribuicao_cdas", formato)
+
+#Sem o resumo, contamos as CDAs por natureza e grupo de situação (cod_grupo_situacao, gravado pelo ETL) só na
+#tabela fato, pelo índice (fk_natureza, cod_grupo_situacao). Os nomes vêm do cache de dimensões, e o percentual
+#de cada grupo é calculado em Python (arredondado em 5 casas, como a divisão do MySQL).
+def distribuicao_dos_fatos(results, dims):
+    contagens = {}
+    for id_natureza, codigo_grupo, quantidade in results:
+        nome = dims.naturezas.get(id_natureza)
+        if nome is None:
+            continue
+        contagem = contagens.setdefault(nome, dict.fromkeys(['total', *classificacao.GRUPOS], 0))
+        contagem['total'] += quantidade
+        if codigo_grupo is not None:
+            contagem[classificacao.GRUPOS[codigo_grupo]] += quantidade
 
-@app.get("/resumo/inscricoes", response_model=List[InscricoesResponse])
+    return [
+        {
+            "name": nome,
+            "Em cobranca": round(contagem['em_cobranca'] * 100.0 / contagem['total'], 5),
+            "Cancelada": round(contagem['cancelada'] * 100.0 / contagem['total'], 5),
+            "Quitada": round(contagem['quitada'] * 100.0 / contagem['total'], 5),
+        }
+        for nome, contagem in sorted(contagens.items(), key=lambda item: dimensoes.normalizar(item[0]))
+    ]
+
+@rota("/resumo/inscricoes", response_model=List[InscricoesResponse])
 def inscricoes(
+    request: Request,
+    # Formato da resposta ('json', 'colunar', 'msgpack' ou 'arrow'); sem ele, vale o cabeçalho Accept
+    formato: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    query_str = """
-        SELECT
-            f.ano_inscricao AS ano,
-            COUNT(*) AS Quantidade
-        FROM 
-            fatos_cdas f
-        GROUP BY 
-            f.ano_inscricao
-        ORDER BY
-            f.ano_inscricao;
-    """
+    return servir_resumo(request, db, "/resumo/inscricoes", formato)
 
-    try:
-        results = db.execute(text(query_str)).fetchall()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao consultar o banco de dados: {e}")
-    return results
+@inscricoes.assincrona
+async def inscricoes_async(request: Request, formato: Optional[str], db: "AsyncSession"):
+    return await servir_resumo_async(request, db, "/resumo/inscricoes", formato)
 
-@app.get("/resumo/montante_acumulado", response_model=List[MontanteResponse])
+@rota("/resumo/montante_acumulado", response_model=List[MontanteResponse])
 def montante_acumulado(
+    request: Request,
+    # Formato da resposta ('json', 'colunar', 'msgpack' ou 'arrow'); sem ele, vale o cabeçalho Accept
+    formato: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    #Essa query prepara uma tabela para ser ainda mais processada com Pandas e gerar o resultado esperado.
-    #Primeiro, agrupamos as descricao_natureza de acordo (englobamos todos os IPTU em um por exemplo).
-    #Depois, usamos NTILE(100) para criar 100 partições nos grupos especificados, ordenados por saldo (assim,
-    #cada partição é um percentil.
-    query_str = """
-        SELECT
-            CASE
-                WHEN d.descricao_natureza LIKE 'IPTU%' THEN 'IPTU'
-                WHEN d.descricao_natureza LIKE 'ISS%' THEN 'ISS'
-                WHEN d.descricao_natureza LIKE 'Taxa%' THEN 'Taxas'
-                WHEN d.descricao_natureza LIKE 'Multa%' THEN 'Multas'
-                WHEN d.descricao_natureza LIKE 'ITBI%' THEN 'ITBI'
-            END AS tipo_tributo,
-            f.valor_saldo,
-            NTILE(100) OVER (PARTITION BY 
-            CASE
-                WHEN d.descricao_natureza LIKE 'IPTU%' THEN 'IPTU'
-                WHEN d.descricao_natureza LIKE 'ISS%' THEN 'ISS'
-                WHEN d.descricao_natureza LIKE 'Taxa%' THEN 'Taxas'
-                WHEN d.descricao_natureza LIKE 'Multa%' THEN 'Multas'
-                WHEN d.descricao_natureza LIKE 'ITBI%' THEN 'ITBI'
-            END
-            ORDER BY f.valor_saldo) AS percentil
-        FROM 
-            fatos_cdas f
-        JOIN 
-            dim_naturezas d ON f.fk_natureza = d.id_natureza
-        WHERE 
-            d.descricao_natureza LIKE 'IPTU%' OR
-            d.descricao_natureza LIKE 'ISS%' OR
-            d.descricao_natureza LIKE 'Taxa%' OR
-            d.descricao_natureza LIKE 'Multa%' OR 
-            d.descricao_natureza LIKE 'ITBI%'
-    """
+    return servir_resumo(request, db, "/resumo/montante_acumulado", formato)
 
+@montante_acumulado.assincrona
+async def montante_acumulado_async(request: Request, formato: Optional[str], db: "AsyncSession"):
+    return await servir_resumo_async(request, db, "/resumo/montante_acumulado", formato)
+
+#As curvas são calculadas pelo motor vetorizado em api/curvas.py. Com o snapshot colunar, as somas por percentil
+#saem direto das colunas mapeadas; sem ele, o caminho rápido lê as somas já calculadas pelo ETL
+#(no máximo 5 x 100 linhas em resumo_montante).
+def montante_do_resumo(linhas):
+    return curvas.montar_resposta(*curvas.somas_do_resumo(linhas))
+
+#Sem o resumo, buscamos só o código do tributo (cod_tributo, gravado pelo ETL) e o saldo das CDAs dos cinco grupos
+#(IPTU, ISS, Taxas, Multas e ITBI), lidos do índice (cod_tributo, valor_saldo), sem JOIN nem LIKE.
+#A divisão em percentis (equivalente ao NTILE(100)) e as somas acumuladas são feitas com NumPy.
+def montante_dos_fatos(linhas, dims=None):
+    if not linhas:
+        return []
+    df = pd.DataFrame(linhas, columns=['cod_tributo', 'valor_saldo'])
+
+    return curvas.montar_resposta(*curvas.somas_por_percentil(
+        df['cod_tributo'].to_numpy('int64'), df['valor_saldo'].to_numpy()
+    ))
+
+#Lista separada por vírgulas de um parâmetro (None se o parâmetro não foi informado)
+def separar_lista(valor: Optional[str]):
+    if valor is None:
+        return None
+    return [item.strip() for item in valor.split(",") if item.strip()]
+
+@rota("/resumo/montante_acumulado/curva", response_model=CurvaResponse)
+def curva_montante_acumulado(
+    # Filtros opcionais: grupos de tributo e de situação separados por vírgula, e intervalo de anos de inscrição
+    tributos: Optional[str] = None,
+    situacoes: Optional[str] = None,
+    minAno: Optional[int] = None,
+    maxAno: Optional[int] = None,
+    # Percentis da curva separados por vírgula (qualquer valor entre 0 e 100); padrão: os do /resumo/montante_acumulado
+    percentis: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    #Curva de montante acumulado de qualquer combinação de filtros, juntando os sketches gravados pelo ETL
+    #(ver api/sketches.py e etl/sketches.py), sem varrer a tabela fato
+    filtros = validar_curva(tributos, situacoes, minAno, maxAno, percentis)
     try:
-        df = pd.read_sql(text(query_str), db.bind)
+        if resumo_atualizado(db, 'resumo_sketches'):
+            dados = sketches.obter(db)
+        else:
+            #Sem o resumo, os sketches são calculados na hora a partir da tabela fato (mesma consulta do ETL)
+            dados = sketches.da_tabela_fato(db)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao consultar o banco de dados: {e}")
+    return montar_curva(dados, *filtros)
 
+@curva_montante_acumulado.assincrona
+async def curva_montante_acumulado_async(tributos, situacoes, minAno, maxAno, percentis, db: "AsyncSession"):
+    filtros = validar_curva(tributos, situacoes, minAno, maxAno, percentis)
+    try:
+        if await resumo_atualizado_async(db, 'resumo_sketches'):
+            dados = await sketches.obter_async(db)
+        else:
+            dados = await sketches.da_tabela_fato_async(db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao consultar o banco de dados: {e}")
+    return await responder_modelo_async(ADAPTADOR_CURVA, montar_curva, dados, *filtros)
 
-    if df.empty:
-        return []
+ADAPTADOR_CURVA = TypeAdapter(CurvaResponse)
 
-    #Agrupamos o df por tipo do tributo e calculamos a soma do saldo para cada um
-    total_por_tributo = df.groupby('tipo_tributo')['valor_saldo'].sum()
+#Valida os filtros e os percentis da curva. Devolve (códigos dos tributos, códigos das situações, minAno, maxAno, percentis).
+def validar_curva(
+    tributos: Optional[str],
+    situacoes: Optional[str],
+    minAno: Optional[int],
+    maxAno: Optional[int],
+    percentis: Optional[str]
+):
+    nomes_tributos = {classificacao.normalizar(tributo): codigo for codigo, tributo in enumerate(curvas.TRIBUTOS)}
+    codigos_tributos = None
+    if tributos is not None:
+        pedidos = separar_lista(tributos)
+        desconhecidos = [tributo for tributo in pedidos if classificacao.normalizar(tributo) not in nomes_tributos]
+        if not pedidos or desconhecidos:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Parâmetro inválido: 'tributos' deve conter valores de {curvas.TRIBUTOS}."
+            )
+        codigos_tributos = [nomes_tributos[classificacao.normalizar(tributo)] for tributo in pedidos]
 
-    #Agrupamos por tipo e percentil e calculamos a soma de cada um. reset_index serve para criar índices novos e facilitar a manipulação.
-    soma_por_percentil = df.groupby(['tipo_tributo', 'percentil'])['valor_saldo'].sum().reset_index()
+    codigos_situacoes = None
+    if situacoes is not None:
+        pedidas = separar_lista(situacoes)
+        if not pedidas or any(situacao not in sketches.CODIGOS_SITUACAO for situacao in pedidas):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Parâmetro inválido: 'situacoes' deve conter valores de {sketches.SITUACOES}."
+            )
+        codigos_situacoes = [sketches.CODIGOS_SITUACAO[situacao] for situacao in pedidas]
 
-    #Isso acumula a soma cumulativa (no percentil 1, é o valor ATÉ o 1. no 5, é ATÉ o 5 e assim em diante.)
-    soma_por_percentil['valor_acumulado'] = soma_por_percentil.groupby('tipo_tributo')['valor_saldo'].cumsum()
+    if minAno is not None and maxAno is not None and minAno > maxAno:
+        raise HTTPException(
+            status_code=400,
+            detail="Parâmetro inválido: O ano mínimo (minAno) não pode ser maior que o ano máximo (maxAno)."
+        )
 
-    #Apply aplica a função lambda em cada linha row. Isso simplesmente calcula o percentual acumulado.
-    soma_por_percentil['percentual_acumulado'] = soma_por_percentil.apply(
-        lambda row: (row['valor_acumulado'] / total_por_tributo[row['tipo_tributo']]) * 100,
-        axis=1
-    )
+    valores_percentis = curvas.PERCENTIS_DESEJADOS
+    if percentis is not None:
+        try:
+            valores_percentis = [float(percentil) for percentil in separar_lista(percentis)]
+        except ValueError:
+            valores_percentis = []
+        if not valores_percentis or len(valores_percentis) > PERCENTIS_MAXIMOS \
+                or any(not 0 <= percentil <= 100 for percentil in valores_percentis):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Parâmetro inválido: 'percentis' deve ter de 1 a {PERCENTIS_MAXIMOS} números entre 0 e 100."
+            )
+    return codigos_tributos, codigos_situacoes, minAno, maxAno, valores_percentis
 
-    #Aqui, filtramos com indexação booleana. A lista de dentro é uma lista de verdadeiros ou falsos, e usar isso para indexar retorna
-    #um DF apenas com as linhas que eram verdadeiras na lista. Usamos isin para checar se estava entre os percentis desejados.
-    percentis_desejados = [1] + list(range(5, 101, 5))
-    df_filtrado = soma_por_percentil[soma_por_percentil['percentil'].isin(percentis_desejados)]
-
-    #pivot_table serve para "pivotear" a tabela. Da maneira como está feito, serve basicamente para
-    #trocar as linhas pelas colunas. O reset_index faz com que o percentil não seja o próprio index e se torne
-    #uma coluna.
-    df_pivot = df_filtrado.pivot_table(
-        index='percentil', 
-        columns='tipo_tributo',
-        values='percentual_acumulado'
-    ).reset_index()
-    
-    df_pivot = df_pivot.rename(columns={'percentil': 'Percentual'})
+def montar_curva(dados, codigos_tributos, codigos_situacoes, minAno, maxAno, valores_percentis):
+    pontos, quantidade, saldo_total = curvas.curva_de_sketches(
+        *dados.filtrar(codigos_tributos, codigos_situacoes, minAno, maxAno), valores_percentis
+    )
+    return {"quantidade": quantidade, "saldo_total": saldo_total, "pontos": pontos}
 
-    for tributo in ['IPTU', 'ISS', 'Taxas', 'Multas', 'ITBI']:
-        if tributo not in df_pivot.columns:
-            df_pivot[tributo] = 0.0
+@rota("/resumo/quantidade_cdas", response_model=List[QtdeResponse])
+def quantidade_cdas(
+    request: Request,
+    # Formato da resposta ('json', 'colunar', 'msgpack' ou 'arrow'); sem ele, vale o cabeçalho Accept
+    formato: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    return servir_resumo(request, db, "/resumo/quantidade_cdas", formato)
 
-    results = df_pivot.fillna(0.0).to_dict(orient='records')
+@quantidade_cdas.assincrona
+async def quantidade_cdas_async(request: Request, formato: Optional[str], db: "AsyncSession"):
+    return await servir_resumo_async(request, db, "/resumo/quantidade_cdas", formato)
 
-    return results
+#Sem o resumo, contamos por fk_natureza só na tabela fato; os nomes vêm do cache de dimensões.
+def quantidade_dos_fatos(results, dims):
+    return [{"name": nome, "Quantidade": quantidade} for nome, quantidade in somar_por_natureza(dims, results)]
 
-@app.get("/resumo/quantidade_cdas", response_model=List[QtdeResponse])
-def quantidade_cdas(
+@rota("/resumo/saldo_cdas", response_model=List[SaldoResponse])
+def saldo_cdas(
+    request: Request,
+    # Formato da resposta ('json', 'colunar', 'msgpack' ou 'arrow'); sem ele, vale o cabeçalho Accept
+    formato: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    query_str = """
+    return servir_resumo(request, db, "/resumo/saldo_cdas", formato)
+
+@saldo_cdas.assincrona
+async def saldo_cdas_async(request: Request, formato: Optional[str], db: "AsyncSession"):
+    return await servir_resumo_async(request, db, "/resumo/saldo_cdas", formato)
+
+#Sem o resumo, somamos por fk_natureza só na tabela fato; os nomes vêm do cache de dimensões.
+def saldo_dos_fatos(results, dims):
+    return [{"name": nome, "Saldo": saldo} for nome, saldo in somar_por_natureza(dims, results)]
+
+def somar_por_natureza(dims, linhas):
+    #Junta os totais (fk_natureza, valor) por nome de natureza, como o antigo GROUP BY descricao_natureza,
+    #em ordem de nome (como o ORDER BY na collation do MySQL)
+    somas = {}
+    for id_natureza, valor in linhas:
+        nome = dims.naturezas.get(id_natureza)
+        if nome is not None:
+            somas[nome] = somas.get(nome, 0) + valor
+    return sorted(somas.items(), key=lambda item: dimensoes.normalizar(item[0]))
+
+#Como cada rota de resumo consulta os dados. Os caminhos são tentados em ordem:
+#  snapshot   agregação do snapshot colunar da geração atual (método de snapshot.Snapshot, ver api/snapshot.py)
+#  resumo     tabela de resumo do ETL, usada se estiver atualizada: sql_resumo e a conversão das linhas (de_resumo)
+#  fatos      consulta direta na tabela fato: sql_fatos e a conversão das linhas (de_fatos, que recebe as linhas e as
+#             dimensões carregadas para os ids de natureza da primeira coluna, ou None se por_natureza=False)
+#Sem conversão (None), as linhas já estão no formato da resposta.
+ConsultaResumo = namedtuple(
+    'ConsultaResumo', ['snapshot', 'resumo', 'sql_resumo', 'de_resumo', 'sql_fatos', 'de_fatos', 'por_natureza']
+)
+
+CONSULTA_DISTRIBUICAO = ConsultaResumo(
+    snapshot='distribuicao_cdas',
+    resumo='resumo_distribuicao',
+    sql_resumo="""
+        SELECT
+            natureza AS name,
+            em_cobranca AS `Em cobranca`,
+            cancelada AS `Cancelada`,
+            quitada AS `Quitada`
+        FROM resumo_distribuicao
+        ORDER BY natureza;
+    """,
+    de_resumo=None,
+    sql_fatos="""
+        SELECT
+            f.fk_natureza,
+            f.cod_grupo_situacao,
+            COUNT(*) AS quantidade
+        FROM 
+            fatos_cdas f
+        GROUP BY 
+            f.fk_natureza, f.cod_grupo_situacao;
+    """,
+    de_fatos=distribuicao_dos_fatos,
+    por_natureza=True,
+)
+
+CONSULTA_INSCRICOES = ConsultaResumo(
+    snapshot='inscricoes',
+    resumo='resumo_inscricoes',
+    sql_resumo="""
+        SELECT ano, quantidade AS Quantidade
+        FROM resumo_inscricoes
+        ORDER BY ano;
+    """,
+    de_resumo=None,
+    sql_fatos="""
         SELECT
-            d.descricao_natureza AS name,
+            f.ano_inscricao AS ano,
             COUNT(*) AS Quantidade
         FROM 
             fatos_cdas f
-        JOIN
-            dim_naturezas d ON f.fk_natureza = d.id_natureza
         GROUP BY 
-            d.descricao_natureza
+            f.ano_inscricao
         ORDER BY
-            d.descricao_natureza;
-    """
+            f.ano_inscricao;
+    """,
+    de_fatos=None,
+    por_natureza=False,
+)
 
-    try:
-        results = db.execute(text(query_str)).fetchall()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao consultar o banco de dados: {e}")
-    return results
+CONSULTA_MONTANTE = ConsultaResumo(
+    snapshot='montante_acumulado',
+    resumo='resumo_montante',
+    sql_resumo="SELECT tributo, percentil, saldo, saldo_tributo FROM resumo_montante",
+    de_resumo=montante_do_resumo,
+    sql_fatos=montante.SELECT_SALDOS,
+    de_fatos=montante_dos_fatos,
+    por_natureza=False,
+)
 
-@app.get("/resumo/saldo_cdas", response_model=List[SaldoResponse])
-def saldo_cdas(
-    db: Session = Depends(get_db)
-):
-    query_str = """
+CONSULTA_QUANTIDADE = ConsultaResumo(
+    snapshot='quantidade_cdas',
+    resumo='resumo_naturezas',
+    sql_resumo="""
+        SELECT natureza AS name, quantidade AS Quantidade
+        FROM resumo_naturezas
+        ORDER BY natureza;
+    """,
+    de_resumo=None,
+    sql_fatos="""
         SELECT
-            d.descricao_natureza AS name,
-            SUM(f.valor_saldo) AS Saldo
+            f.fk_natureza,
+            COUNT(*) AS quantidade
         FROM 
             fatos_cdas f
-        JOIN
-            dim_naturezas d ON f.fk_natureza = d.id_natureza
         GROUP BY 
-            d.descricao_natureza
-        ORDER BY
-            d.descricao_natureza;
-    """
+            f.fk_natureza;
+    """,
+    de_fatos=quantidade_dos_fatos,
+    por_natureza=True,
+)
 
-    try:
-        results = db.execute(text(query_str)).fetchall()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao consultar o banco de dados: {e}")
-    return results
\ No newline at end of file
+CONSULTA_SALDO = ConsultaResumo(
+    snapshot='saldo_cdas',
+    resumo='resumo_naturezas',
+    sql_resumo="""
+        SELECT natureza AS name, saldo AS Saldo
+        FROM resumo_naturezas
+        ORDER BY natureza;
+    """,
+    de_resumo=None,
+    sql_fatos="""
+        SELECT
+            f.fk_natureza,
+            SUM(f.valor_saldo) AS saldo
+        FROM 
+            fatos_cdas f
+        GROUP BY 
+            f.fk_natureza;
+    """,
+    de_fatos=saldo_dos_fatos,
+    por_natureza=True,
+)
+
+#Endpoints de resumo servidos a partir de payloads pré-renderizados: como consultar os dados e modelo da resposta.
+ROTAS_RESUMO = {
+    "/resumo/distribuicao_cdas": (CONSULTA_DISTRIBUICAO, List[DistribuicaoResponse]),
+    "/resumo/inscricoes": (CONSULTA_INSCRICOES, List[InscricoesResponse]),
+    "/resumo/montante_acumulado": (CONSULTA_MONTANTE, List[MontanteResponse]),
+    "/resumo/quantidade_cdas": (CONSULTA_QUANTIDADE, List[QtdeResponse]),
+    "/resumo/saldo_cdas": (CONSULTA_SALDO, List[SaldoResponse]),
+}
+ADAPTADORES_RESUMO = {rota: TypeAdapter(modelo) for rota, (_, modelo) in ROTAS_RESUMO.items()}
+
+def converter(conversao, *args):
+    return conversao(*args) if conversao is not None else args[0]
+
+def consultar_resumo(db: Session, rota: str):
+    consulta, _ = ROTAS_RESUMO[rota]
+    snap = snapshot.obter(db)
+    if snap is not None:
+        return getattr(snap, consulta.snapshot)()
+
+    if resumo_atualizado(db, consulta.resumo):
+        return converter(consulta.de_resumo, consultar_linhas(db, text(consulta.sql_resumo)))
+
+    linhas = consultar_linhas(db, text(consulta.sql_fatos))
+    dims = obter_dimensoes(db, naturezas={linha[0] for linha in linhas}) if consulta.por_natureza else None
+    return converter(consulta.de_fatos, linhas, dims)
+
+#Mesmos caminhos com uma AsyncSession: as consultas no event loop, as agregações e conversões no threadpool
+async def consultar_resumo_async(db: "AsyncSession", rota: str):
+    consulta, _ = ROTAS_RESUMO[rota]
+    snap = await snapshot.obter_async(db)
+    if snap is not None:
+        return await run_in_threadpool(getattr(snap, consulta.snapshot))
+
+    if await resumo_atualizado_async(db, consulta.resumo):
+        linhas = await consultar_linhas_async(db, text(consulta.sql_resumo))
+        return await run_in_threadpool(converter, consulta.de_resumo, linhas)
+
+    linhas = await consultar_linhas_async(db, text(consulta.sql_fatos))
+    dims = await obter_dimensoes_async(db, naturezas={linha[0] for linha in linhas}) if consulta.por_natureza else None
+    return await run_in_threadpool(converter, consulta.de_fatos, linhas, dims)
+
+def renderizar_resumo(db: Session, rota: str) -> bytes:
+    #Serializa a resposta do mesmo jeito que o FastAPI faria (validação pelo modelo e nomes pelos aliases).
+    return serializar(ADAPTADORES_RESUMO[rota], consultar_resumo(db, rota))
+
+async def renderizar_resumo_async(db: "AsyncSession", rota: str) -> bytes:
+    dados = await consultar_resumo_async(db, rota)
+    return await run_in_threadpool(serializar, ADAPTADORES_RESUMO[rota], dados)
+
+def servir_resumo(request: Request, db: Session, rota: str, formato: Optional[str] = None):
+    #O payload JSON da geração é a base de todas as representações (formato negociado e compressão, ver api/formatos.py)
+    formato = formatos.negociar_formato(request, formato)
+    codificacao = formatos.negociar_codificacao(request)
+
+    #Sem geração registrada pelo ETL, a resposta é renderizada a cada requisição, sem ETag
+    geracao = payloads.geracao_atual(db)
+    if geracao is None:
+        return responder_resumo(rota, renderizar_resumo(db, rota), formato, codificacao)
+
+    _, payload_json = payloads.obter_payload(db, rota, geracao, lambda: renderizar_resumo(db, rota))
+    representacao = formatos.representar_resumo(rota, geracao, formato, codificacao, payload_json, modelo_resumo(rota))
+    return responder_representacao(request, formato, representacao)
+
+async def servir_resumo_async(request: Request, db: "AsyncSession", rota: str, formato: Optional[str] = None):
+    formato = formatos.negociar_formato(request, formato)
+    codificacao = formatos.negociar_codificacao(request)
+
+    geracao = await payloads.geracao_atual_async(db)
+    if geracao is None:
+        conteudo = await renderizar_resumo_async(db, rota)
+        return await run_in_threadpool(responder_resumo, rota, conteudo, formato, codificacao)
+
+    _, payload_json = await payloads.obter_payload_async(db, rota, geracao, lambda: renderizar_resumo_async(db, rota))
+    #A representação já calculada na geração é só lida da memória; a codificação e a compressão vão para o threadpool
+    representacao = formatos.representacao_guardada(rota, geracao, formato, codificacao)
+    if representacao is None:
+        representacao = await run_in_threadpool(
+            formatos.representar_resumo, rota, geracao, formato, codificacao, payload_json, modelo_resumo(rota)
+        )
+    return responder_representacao(request, formato, representacao)
+
+def modelo_resumo(rota: str):
+    #Modelo de cada linha da resposta (List[Modelo] -> Modelo)
+    return get_args(ROTAS_RESUMO[rota][1])[0]
+
+def responder_resumo(rota: str, conteudo: bytes, formato: str, codificacao) -> Response:
+    #Resposta sem ETag, a partir do JSON renderizado na hora
+    if formato != 'json':
+        modelo = modelo_resumo(rota)
+        conteudo = formatos.codificar(formatos.para_colunas(json.loads(conteudo), modelo), modelo, formato)
+    conteudo, usada = formatos.comprimir(conteudo, codificacao)
+    return Response(content=conteudo, headers=formatos.cabecalhos(formato, usada))
+
+def responder_representacao(request: Request, formato: str, representacao) -> Response:
+    etag, conteudo, usada = representacao
+    cabecalhos = {"ETag": etag, "Cache-Control": payloads.CACHE_CONTROL, "Vary": formatos.VARY}
+    if payloads.etag_confere(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cabecalhos)
+    return Response(content=conteudo, headers=formatos.cabecalhos(formato, usada, cabecalhos))
+
+def pre_renderizar_resumos(db: Session) -> int:
+    """Renderiza e grava os payloads de todas as rotas de resumo para a geração atual (chamada pelo ETL)."""
+    geracao = payloads.geracao_atual(db)
+    if geracao is None:
+        return 0
+    for rota in ROTAS_RESUMO:
+        payloads.gravar_payload(db, rota, geracao, renderizar_resumo(db, rota))
+    return len(ROTAS_RESUMO)
@@ -0,0 +1,130 @@
+import functools
+import inspect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, Gauge, Histogram, generate_latest
+from sqlalchemy import event
+
+# Métricas da API no formato do Prometheus, expostas em /metrics (cada réplica expõe as suas).
+# Além da latência total por rota, cada requisição é dividida em fases, para saber se um p99 alto vem do MySQL,
+# do pool de conexões ou do Python:
+#   checkout       espera por uma conexão livre no pool do SQLAlchemy
+#   db_execucao    execução das consultas no MySQL (eventos do engine em volta do cursor.execute)
+#   db_leitura     leitura das linhas do resultado (fetchall)
+#   processamento  o resto do tempo dentro do endpoint (laço de linhas do /cda/search, NumPy das curvas, etc.)
+#   serializacao   validação pelo modelo Pydantic e geração do JSON, depois que o endpoint retorna (ou, nas respostas
+#                  codificadas pelo próprio endpoint em api/formatos.py, a codificação e a compressão)
+# As medições de uma requisição ficam num ContextVar, preenchido pelo middleware, pelo get_db e pelos eventos do engine.
+
+BUCKETS_TEMPO = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+BUCKETS_LINHAS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+LATENCIA = Histogram(
+    'api_requisicao_segundos', 'Latência total das requisições', ['rota'], buckets=BUCKETS_TEMPO
+)
+FASES = Histogram(
+    'api_fase_segundos', 'Tempo de cada fase das requisições', ['rota', 'fase'], buckets=BUCKETS_TEMPO
+)
+LINHAS = Histogram(
+    'api_linhas_retornadas', 'Linhas devolvidas pelo banco em cada requisição', ['rota'], buckets=BUCKETS_LINHAS
+)
+
+_medicoes = ContextVar('medicoes', default=None)
+
+
+def acumular(nome: str, valor):
+    medicoes = _medicoes.get()
+    if medicoes is not None:
+        medicoes[nome] = medicoes.get(nome, 0) + valor
+
+
+@contextmanager
+def fase(nome: str):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        acumular(nome, time.perf_counter() - inicio)
+
+
+def buscar(resultado):
+    """Lê todas as linhas de um resultado do SQLAlchemy, medindo o tempo de leitura e contando as linhas."""
+    with fase('db_leitura'):
+        linhas = resultado.fetchall()
+    acumular('linhas', len(linhas))
+    return linhas
+
+
+def medir_endpoint(funcao):
+    #Mede o tempo dentro do endpoint; a assinatura original continua visível para o FastAPI (via __wrapped__)
+    if inspect.iscoroutinefunction(funcao):
+        @functools.wraps(funcao)
+        async def medida_async(*args, **kwargs):
+            with fase('endpoint'):
+                return await funcao(*args, **kwargs)
+        return medida_async
+
+    @functools.wraps(funcao)
+    def medida(*args, **kwargs):
+        with fase('endpoint'):
+            return funcao(*args, **kwargs)
+    return medida
+
+
+def instrumentar_engine(engine):
+    """Mede o tempo de execução das consultas feitas pelo engine."""
+    @event.listens_for(engine, 'before_cursor_execute')
+    def antes_da_execucao(conexao, cursor, statement, parameters, context, executemany):
+        conexao.info.setdefault('inicio_execucao', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def depois_da_execucao(conexao, cursor, statement, parameters, context, executemany):
+        acumular('db_execucao', time.perf_counter() - conexao.info['inicio_execucao'].pop())
+
+
+def observar_pool(pool, capacidade: int):
+    """Expõe a ocupação do pool de conexões usado pelas requisições."""
+    Gauge('api_pool_conexoes_em_uso', 'Conexões do pool em uso').set_function(pool.checkedout)
+    Gauge('api_pool_conexoes_livres', 'Conexões abertas e livres no pool').set_function(pool.checkedin)
+    Gauge('api_pool_capacidade', 'Máximo de conexões do pool (tamanho + excedente)').set_function(lambda: capacidade)
+    Gauge('api_pool_utilizacao', 'Fração da capacidade do pool em uso').set_function(lambda: pool.checkedout() / capacidade)
+
+
+async def middleware(request, call_next):
+    if request.url.path == '/metrics':
+        return await call_next(request)
+
+    medicoes = {}
+    token = _medicoes.set(medicoes)
+    inicio = time.perf_counter()
+    try:
+        resposta = await call_next(request)
+    finally:
+        _medicoes.reset(token)
+    total = time.perf_counter() - inicio
+
+    rota = getattr(request.scope.get('route'), 'path', 'desconhecida')
+    endpoint = medicoes.get('endpoint', 0.0)
+    execucao = medicoes.get('db_execucao', 0.0)
+    leitura = medicoes.get('db_leitura', 0.0)
+    checkout = medicoes.get('checkout', 0.0)
+    codificacao = medicoes.get('serializacao', 0.0)
+    fases = {
+        'checkout': checkout,
+        'db_execucao': execucao,
+        'db_leitura': leitura,
+        'processamento': max(endpoint - execucao - leitura - codificacao, 0.0),
+        'serializacao': max(total - endpoint - checkout, 0.0) + codificacao,
+    }
+
+    LATENCIA.labels(rota).observe(total)
+    for nome, duracao in fases.items():
+        FASES.labels(rota, nome).observe(duracao)
+    LINHAS.labels(rota).observe(medicoes.get('linhas', 0))
+    return resposta
+
+
+def exportar():
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,55 @@
+import base64
+import json
+from decimal import Decimal, InvalidOperation
+
+from fastapi import HTTPException
+
+# Paginação por cursor (keyset) do /cda/search.
+# Em vez de LIMIT/OFFSET (que obriga o banco a percorrer e descartar todas as linhas das páginas anteriores),
+# a próxima página começa logo depois da última linha devolvida: WHERE (coluna_ordenacao, num_cda) > (último valor, último num_cda).
+# Com os índices compostos de fatos_cdas, a página N custa o mesmo que a página 1.
+# O cursor é opaco para o cliente: um JSON em base64 com a ordenação usada e a posição da última linha.
+
+COLUNAS_ORDENACAO = {
+    "ano": "f.ano_inscricao",
+    "valor": "f.valor_saldo",
+}
+
+CABECALHO_PROXIMO_CURSOR = "X-Next-Cursor"
+
+
+def codificar_cursor(sort_by: str, sort_order: str, ultimo_valor, ultimo_num_cda) -> str:
+    #O valor vai como texto para não perder precisão (valor_saldo é DECIMAL)
+    dados = {"s": sort_by, "o": sort_order, "v": str(ultimo_valor), "c": int(ultimo_num_cda)}
+    return base64.urlsafe_b64encode(json.dumps(dados, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor: str, sort_by: str, sort_order: str):
+    """Devolve (último valor da coluna de ordenação, último num_cda). O cursor precisa ter sido gerado com a mesma ordenação."""
+    try:
+        dados = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        valor = int(dados["v"]) if dados["s"] == "ano" else Decimal(dados["v"])
+        num_cda = int(dados["c"])
+        ordenacao = (dados["s"], dados["o"])
+    except (ValueError, KeyError, TypeError, InvalidOperation):
+        raise HTTPException(
+            status_code=400,
+            detail="Parâmetro inválido: 'cursor' não é um cursor válido."
+        )
+    if ordenacao != (sort_by, sort_order):
+        raise HTTPException(
+            status_code=400,
+            detail="Parâmetro inválido: o 'cursor' foi gerado com outra ordenação ('sort_by'/'sort_order')."
+        )
+    return valor, num_cda
+
+
+def condicao_cursor(sort_by: str, sort_order: str) -> str:
+    #Equivalente a (coluna, num_cda) > (:cursor_valor, :cursor_cda), escrito de forma que o MySQL use um range
+    #no índice (coluna, num_cda). Na ordem decrescente, as comparações se invertem.
+    coluna = COLUNAS_ORDENACAO[sort_by]
+    comparacao = "<" if sort_order == "desc" else ">"
+    return (
+        f"{coluna} {comparacao}= :cursor_valor AND "
+        f"({coluna} {comparacao} :cursor_valor OR f.num_cda {comparacao} :cursor_cda)"
+    )
@@ -0,0 +1,145 @@
+import hashlib
+import os
+import threading
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# Payloads pré-renderizados dos endpoints /resumo/*.
+# A cada carga que altera o DW, o ETL incrementa a "geração" dos dados (tabela geracao_dw) e grava a resposta
+# já serializada de cada rota de resumo em payloads_resumo. Como a tabela fica no DW, todas as réplicas da API
+# atrás do nginx servem exatamente os mesmos bytes, com o mesmo ETag (hash do conteúdo).
+# Cada réplica também guarda em memória o último payload de cada rota: enquanto a geração não muda,
+# uma requisição custa só a leitura de uma linha (a geração) no banco.
+# Se a geração mudou e o ETL ainda não gravou o payload novo, a primeira réplica que recebe a requisição
+# o renderiza e grava para as demais.
+
+CACHE_CONTROL = os.getenv('API_CACHE_CONTROL', 'public, no-cache')
+
+_cache = {}
+_trava = threading.Lock()
+
+
+SELECT_GERACAO = "SELECT geracao FROM geracao_dw WHERE id = 1"
+SELECT_PAYLOAD = "SELECT etag, conteudo FROM payloads_resumo WHERE rota = :rota AND geracao = :geracao"
+
+
+def geracao_atual(db: Session):
+    """Geração do DW, lida uma vez por sessão (cada requisição tem a sua). Os caches da réplica (dimensões, snapshot,
+    busca, sketches e payloads) usam o mesmo valor sem uma consulta cada um, e uma requisição não mistura gerações."""
+    if 'geracao' not in db.info:
+        try:
+            db.info['geracao'] = db.execute(text(SELECT_GERACAO)).scalar()
+        except Exception:
+            db.rollback()
+            db.info['geracao'] = None
+    return db.info['geracao']
+
+
+async def geracao_atual_async(db):
+    """geracao_atual com uma AsyncSession (modo 'async' da API, ver rota() em api/main.py)."""
+    if 'geracao' not in db.info:
+        try:
+            db.info['geracao'] = (await db.execute(text(SELECT_GERACAO))).scalar()
+        except Exception:
+            await db.rollback()
+            db.info['geracao'] = None
+    return db.info['geracao']
+
+
+def calcular_etag(conteudo: bytes) -> str:
+    #ETag forte: muda sempre que o conteúdo muda, e é igual em todas as réplicas para o mesmo conteúdo.
+    return '"' + hashlib.sha256(conteudo).hexdigest()[:32] + '"'
+
+
+def etag_confere(if_none_match, etag: str) -> bool:
+    #If-None-Match pode trazer vários ETags separados por vírgula, ETags fracos (W/"...") ou "*".
+    if not if_none_match:
+        return False
+    candidatos = [candidato.strip() for candidato in if_none_match.split(',')]
+    return '*' in candidatos or any(candidato.removeprefix('W/') == etag for candidato in candidatos)
+
+
+# Upsert do payload de uma rota, por dialeto. Nunca substitui um payload de uma geração mais nova.
+UPSERT_PAYLOAD = {
+    #geracao é atualizada por último, pois o MySQL aplica as atribuições do UPDATE em ordem
+    'mysql': """
+        INSERT INTO payloads_resumo (rota, geracao, etag, conteudo)
+        VALUES (:rota, :geracao, :etag, :conteudo) AS novo
+        ON DUPLICATE KEY UPDATE
+            etag = IF(novo.geracao >= payloads_resumo.geracao, novo.etag, payloads_resumo.etag),
+            conteudo = IF(novo.geracao >= payloads_resumo.geracao, novo.conteudo, payloads_resumo.conteudo),
+            geracao = GREATEST(novo.geracao, payloads_resumo.geracao)
+    """,
+    #SQLite do backend embutido do benchmark (api/benchmark.py): a condição vai no WHERE do ON CONFLICT
+    'sqlite': """
+        INSERT INTO payloads_resumo (rota, geracao, etag, conteudo)
+        VALUES (:rota, :geracao, :etag, :conteudo)
+        ON CONFLICT (rota) DO UPDATE SET
+            geracao = excluded.geracao,
+            etag = excluded.etag,
+            conteudo = excluded.conteudo
+        WHERE excluded.geracao >= payloads_resumo.geracao
+    """,
+}
+
+
+def _guardar(rota: str, geracao: int, etag: str, conteudo: bytes):
+    with _trava:
+        _cache[rota] = (geracao, etag, conteudo)
+
+
+def _em_memoria(rota: str, geracao: int):
+    with _trava:
+        em_memoria = _cache.get(rota)
+    if em_memoria is not None and em_memoria[0] == geracao:
+        return em_memoria[1], em_memoria[2]
+    return None
+
+
+def _parametros_upsert(rota: str, geracao: int, conteudo: bytes) -> dict:
+    return {"rota": rota, "geracao": geracao, "etag": calcular_etag(conteudo), "conteudo": conteudo}
+
+
+def gravar_payload(db: Session, rota: str, geracao: int, conteudo: bytes) -> str:
+    parametros = _parametros_upsert(rota, geracao, conteudo)
+    db.execute(text(UPSERT_PAYLOAD[db.get_bind().dialect.name]), parametros)
+    db.commit()
+    _guardar(rota, geracao, parametros["etag"], conteudo)
+    return parametros["etag"]
+
+
+def obter_payload(db: Session, rota: str, geracao: int, renderizar):
+    """Devolve (etag, conteudo) da rota para a geração: da memória, do DW ou renderizando na hora."""
+    em_memoria = _em_memoria(rota, geracao)
+    if em_memoria is not None:
+        return em_memoria
+
+    linha = db.execute(text(SELECT_PAYLOAD), {"rota": rota, "geracao": geracao}).fetchone()
+    if linha is not None:
+        etag, conteudo = linha.etag, bytes(linha.conteudo)
+        _guardar(rota, geracao, etag, conteudo)
+        return etag, conteudo
+
+    conteudo = renderizar()
+    return gravar_payload(db, rota, geracao, conteudo), conteudo
+
+
+async def obter_payload_async(db, rota: str, geracao: int, renderizar):
+    """obter_payload com uma AsyncSession; renderizar é uma função assíncrona."""
+    em_memoria = _em_memoria(rota, geracao)
+    if em_memoria is not None:
+        return em_memoria
+
+    linha = (await db.execute(text(SELECT_PAYLOAD), {"rota": rota, "geracao": geracao})).fetchone()
+    if linha is not None:
+        etag, conteudo = linha.etag, bytes(linha.conteudo)
+        _guardar(rota, geracao, etag, conteudo)
+        return etag, conteudo
+
+    conteudo = await renderizar()
+    parametros = _parametros_upsert(rota, geracao, conteudo)
+    await db.execute(text(UPSERT_PAYLOAD[db.get_bind().dialect.name]), parametros)
+    await db.commit()
+    _guardar(rota, geracao, parametros["etag"], conteudo)
+    return parametros["etag"], conteudo
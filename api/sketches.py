@@ -0,0 +1,90 @@
+import threading
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from api import metricas, payloads
+from etl import classificacao
+from etl import sketches as definicao
+
+# Sketches do saldo por (grupo de tributo, ano de inscrição, grupo de situação), usados pelas curvas de montante
+# acumulado com filtros (/resumo/montante_acumulado/curva). O ETL os grava em resumo_sketches (ver etl/sketches.py).
+# Cada réplica guarda em memória as linhas da geração atual do DW, em arrays do NumPy: o tamanho depende só do número
+# de células e de faixas ocupadas, e não da quantidade de CDAs. Uma requisição filtra as linhas das células pedidas
+# e junta as faixas (api/curvas.py), em milissegundos.
+
+COLUNAS = ('cod_tributo', 'ano_inscricao', 'cod_grupo_situacao', 'faixa', 'quantidade', 'saldo', 'saldo_minimo', 'saldo_maximo')
+
+# Grupos de situação aceitos no filtro, na ordem dos códigos; 'outras' são as CDAs sem grupo
+SITUACOES = [*classificacao.GRUPOS, 'outras']
+CODIGOS_SITUACAO = {**classificacao.CODIGOS_GRUPO, 'outras': definicao.SEM_GRUPO}
+
+
+class Sketches:
+    def __init__(self, geracao, linhas):
+        self.geracao = geracao
+        colunas = list(zip(*linhas)) if linhas else [()] * len(COLUNAS)
+        tipos = ('int8', 'int32', 'int8', 'int32', 'int64', 'float64', 'float64', 'float64')
+        for nome, valores, tipo in zip(COLUNAS, colunas, tipos):
+            setattr(self, nome, np.asarray(valores, dtype='float64').astype(tipo))
+
+    def filtrar(self, tributos=None, situacoes=None, min_ano=None, max_ano=None):
+        """Linhas (faixa, quantidade, saldo, mínimo, máximo) das células que atendem aos filtros (None = todas)."""
+        mascara = np.ones(len(self.faixa), dtype=bool)
+        if tributos is not None:
+            mascara &= np.isin(self.cod_tributo, tributos)
+        if situacoes is not None:
+            mascara &= np.isin(self.cod_grupo_situacao, situacoes)
+        if min_ano is not None:
+            mascara &= self.ano_inscricao >= min_ano
+        if max_ano is not None:
+            mascara &= self.ano_inscricao <= max_ano
+        return self.faixa[mascara], self.quantidade[mascara], self.saldo[mascara], self.saldo_minimo[mascara], self.saldo_maximo[mascara]
+
+
+_atual = None
+_trava = threading.Lock()
+
+
+SELECT_RESUMO = f"SELECT {', '.join(COLUNAS)} FROM resumo_sketches"
+
+
+def da_tabela_fato(db: Session) -> Sketches:
+    """Calcula os sketches direto da tabela fato, com a mesma consulta do ETL (quando o resumo está desatualizado)."""
+    return Sketches(None, metricas.buscar(db.execute(text(definicao.SELECT_SKETCHES))))
+
+
+async def da_tabela_fato_async(db) -> Sketches:
+    return Sketches(None, metricas.buscar(await db.execute(text(definicao.SELECT_SKETCHES))))
+
+
+def _em_cache(geracao):
+    atual = _atual
+    return atual if atual is not None and atual.geracao == geracao else None
+
+
+def _guardar(novo: Sketches) -> Sketches:
+    global _atual
+    with _trava:
+        _atual = novo
+    return novo
+
+
+def obter(db: Session) -> Sketches:
+    """Devolve os sketches de resumo_sketches em cache, recarregando-os quando a geração do DW muda."""
+    geracao = payloads.geracao_atual(db)
+    atual = _em_cache(geracao)
+    if atual is not None:
+        return atual
+    #Como nas dimensões (api/dimensoes.py), a consulta é feita fora da trava
+    return _guardar(Sketches(geracao, metricas.buscar(db.execute(text(SELECT_RESUMO)))))
+
+
+async def obter_async(db) -> Sketches:
+    """obter com uma AsyncSession (modo 'async' da API)."""
+    geracao = await payloads.geracao_atual_async(db)
+    atual = _em_cache(geracao)
+    if atual is not None:
+        return atual
+    return _guardar(Sketches(geracao, metricas.buscar(await db.execute(text(SELECT_RESUMO)))))
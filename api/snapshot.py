@@ -0,0 +1,225 @@
+import json
+import os
+import threading
+from collections import namedtuple
+from decimal import Decimal
+
+import numpy as np
+
+from api import curvas, dimensoes, payloads
+from etl import classificacao
+
+# Leitura do snapshot colunar do DW gravado pelo ETL (ver etl/snapshot.py).
+# As colunas da tabela fato são arquivos .npy mapeados em memória (np.load com mmap_mode): todas as réplicas
+# da API dividem as mesmas páginas pelo cache do sistema operacional, e nada é copiado para a memória do processo.
+# Com o snapshot, os endpoints /resumo/* e o /cda/search são respondidos com operações vetorizadas do NumPy,
+# sem consultar o MySQL (a não ser pela leitura da geração atual, que garante que o snapshot corresponde ao DW).
+# Sem snapshot, ou com um snapshot de outra geração, os endpoints voltam para o MySQL.
+# A busca exata por numCDA é uma busca binária na coluna num_cda, que o ETL grava ordenada.
+
+DIR_SNAPSHOT = os.getenv('DW_SNAPSHOT_DIR')
+ARQUIVO_ATUAL = 'ATUAL'
+COLUNAS = ('num_cda', 'ano_inscricao', 'valor_centavos', 'prob_recuperacao', 'natureza', 'fk_situacao',
+           'tributo', 'grupo_situacao', 'ordem_ano', 'ordem_valor')
+
+# Linha da busca, com os mesmos nomes das colunas do SELECT do /cda/search
+LinhaCda = namedtuple('LinhaCda', ['numCDA', 'valor_saldo_atualizado', 'ano_inscricao', 'agrupamento_situacao', 'fk_natureza', 'score'])
+
+GRUPOS = classificacao.GRUPOS
+
+
+def _centavos_para_decimal(centavos):
+    return Decimal(int(round(centavos))) / 100
+
+
+class Snapshot:
+    def __init__(self, pasta: str):
+        with open(os.path.join(pasta, 'meta.json'), encoding='utf-8') as arquivo:
+            meta = json.load(arquivo)
+        self.geracao = meta['geracao']
+        self.colunas = {coluna: np.load(os.path.join(pasta, f'{coluna}.npy'), mmap_mode='r') for coluna in COLUNAS}
+        self.ids_naturezas = np.array([id_natureza for id_natureza, _ in meta['naturezas']], dtype='int64')
+        self.dims = dimensoes.Dimensoes(self.geracao, dict(meta['naturezas']), dict(meta['situacoes']))
+        self.nomes_naturezas = [descricao for _, descricao in meta['naturezas']]
+        #Snapshots gravados antes da ordenação por num_cda continuam sendo lidos, com a busca exata por máscara
+        self.num_cda_ordenado = meta.get('num_cda_ordenado', False)
+
+    def _por_nome(self, valores):
+        #Junta valores por código de natureza em valores por nome (como o GROUP BY descricao_natureza), em ordem de nome
+        totais = {}
+        for codigo, valor in enumerate(valores):
+            nome = self.nomes_naturezas[codigo]
+            totais[nome] = totais.get(nome, 0) + valor
+        return sorted(totais.items(), key=lambda item: dimensoes.normalizar(item[0]))
+
+    def _contagem_naturezas(self):
+        return np.bincount(self.colunas['natureza'], minlength=len(self.nomes_naturezas))
+
+    # Agregações dos endpoints /resumo/*, no mesmo formato das consultas ao MySQL
+
+    def quantidade_cdas(self):
+        contagem = self._contagem_naturezas()
+        return [
+            {"name": nome, "Quantidade": int(quantidade)}
+            for nome, quantidade in self._por_nome(contagem) if quantidade > 0
+        ]
+
+    def saldo_cdas(self):
+        #Linhas (quantidade, soma em centavos) por natureza; as somas do bincount são exatas até 2^53 centavos
+        contagem = self._contagem_naturezas()
+        somas = np.bincount(self.colunas['natureza'], weights=self.colunas['valor_centavos'], minlength=len(contagem))
+        return [
+            {"name": nome, "Saldo": _centavos_para_decimal(soma)}
+            for nome, (quantidade, soma) in self._por_nome(np.column_stack((contagem, somas))) if quantidade > 0
+        ]
+
+    def inscricoes(self):
+        anos, quantidades = np.unique(self.colunas['ano_inscricao'], return_counts=True)
+        return [{"ano": int(ano), "Quantidade": int(quantidade)} for ano, quantidade in zip(anos, quantidades)]
+
+    def distribuicao_cdas(self):
+        #Contagem por (natureza, grupo de situação), com o código do grupo gravado pelo ETL (len(GRUPOS) para nenhum grupo)
+        grupos = self.colunas['grupo_situacao'].astype('int64')
+        grupos[grupos < 0] = len(GRUPOS)
+        largura = len(GRUPOS) + 1
+        contagem = np.bincount(
+            self.colunas['natureza'] * largura + grupos,
+            minlength=len(self.nomes_naturezas) * largura
+        ).reshape(len(self.nomes_naturezas), largura)
+
+        resposta = []
+        for nome, linha in self._por_nome(contagem):
+            total = linha.sum()
+            if total == 0:
+                continue
+            percentuais = [round(float(linha[i]) * 100.0 / total, 5) for i in range(len(GRUPOS))]
+            resposta.append(dict(zip(["name", "Em cobranca", "Cancelada", "Quitada"], [nome] + percentuais)))
+        return resposta
+
+    def montante_acumulado(self):
+        return curvas.montar_resposta(*curvas.somas_por_percentil_centavos(
+            np.asarray(self.colunas['tributo']), np.asarray(self.colunas['valor_centavos'])
+        ))
+
+    # Busca do /cda/search: filtros como máscaras booleanas e ordenação pelas permutações gravadas pelo ETL
+
+    def _posicoes_cda(self, numero: int):
+        #Posição da CDA na tabela (0 ou 1 posição)
+        num_cda = self.colunas['num_cda']
+        if numero > np.iinfo(num_cda.dtype).max:
+            return np.empty(0, dtype='int64')
+        if not self.num_cda_ordenado:
+            return np.flatnonzero(num_cda == numero)
+        posicao = int(np.searchsorted(num_cda, numero))
+        if posicao < len(num_cda) and num_cda[posicao] == numero:
+            return np.array([posicao], dtype='int64')
+        return np.empty(0, dtype='int64')
+
+    def buscar(self, numCDA, minSaldo, maxSaldo, minAno, maxAno, natureza, agrupamento_situacao,
+               sort_by, sort_order, skip, limit, posicao_cursor=None):
+        #Com numCDA, os filtros são avaliados só na linha da CDA, achada por busca binária (sem varrer as colunas)
+        candidatas = None
+        if numCDA:
+            chave = numCDA.strip()
+            if not (chave.isascii() and chave.isdigit()):
+                return []
+            candidatas = self._posicoes_cda(int(chave))
+        if candidatas is None:
+            colunas = self.colunas
+        else:
+            colunas = {nome: self.colunas[nome][candidatas] for nome in ('num_cda', 'ano_inscricao', 'valor_centavos', 'natureza', 'fk_situacao')}
+
+        condicoes = []
+        if minSaldo is not None:
+            condicoes.append(colunas['valor_centavos'] / 100 >= minSaldo)
+        if maxSaldo is not None:
+            condicoes.append(colunas['valor_centavos'] / 100 <= maxSaldo)
+        if minAno is not None:
+            condicoes.append(colunas['ano_inscricao'] >= minAno)
+        if maxAno is not None:
+            condicoes.append(colunas['ano_inscricao'] <= maxAno)
+        if natureza:
+            ids = self.dims.ids_natureza(natureza)
+            if not ids:
+                return []
+            condicoes.append(np.isin(colunas['natureza'], np.flatnonzero(np.isin(self.ids_naturezas, ids))))
+        if agrupamento_situacao is not None:
+            condicoes.append(colunas['fk_situacao'] == agrupamento_situacao)
+
+        coluna = colunas['ano_inscricao'] if sort_by == "ano" else colunas['valor_centavos']
+        if posicao_cursor is not None:
+            valor, num_cda = posicao_cursor
+            if sort_by == "valor":
+                valor = int(valor * 100)
+            if sort_order == "desc":
+                condicoes.append((coluna < valor) | ((coluna == valor) & (colunas['num_cda'] < num_cda)))
+            else:
+                condicoes.append((coluna > valor) | ((coluna == valor) & (colunas['num_cda'] > num_cda)))
+
+        if candidatas is not None:
+            #No máximo uma linha: não há o que ordenar
+            if condicoes:
+                candidatas = candidatas[np.logical_and.reduce(condicoes)]
+            pagina = candidatas[skip:skip + limit]
+        else:
+            ordem = self.colunas['ordem_ano'] if sort_by == "ano" else self.colunas['ordem_valor']
+            if sort_order == "desc":
+                ordem = ordem[::-1]
+            if condicoes:
+                mascara = np.logical_and.reduce(condicoes)
+                ordem = ordem[mascara[ordem]]
+            pagina = np.asarray(ordem[skip:skip + limit])
+        colunas = self.colunas
+
+        probabilidades = colunas['prob_recuperacao'][pagina]
+        return [
+            LinhaCda(*valores) for valores in zip(
+                colunas['num_cda'][pagina].tolist(),
+                (colunas['valor_centavos'][pagina] / 100).tolist(),
+                colunas['ano_inscricao'][pagina].tolist(),
+                colunas['fk_situacao'][pagina].tolist(),
+                self.ids_naturezas[colunas['natureza'][pagina]].tolist(),
+                [None if np.isnan(p) else p for p in probabilidades.tolist()],
+            )
+        ]
+
+
+_atual = None
+_trava = threading.Lock()
+
+
+def obter(db):
+    """Devolve o snapshot da geração atual do DW, ou None (desativado, ainda não gravado ou de outra geração)."""
+    if not DIR_SNAPSHOT:
+        return None
+    return _da_geracao(payloads.geracao_atual(db))
+
+
+async def obter_async(db):
+    """obter com uma AsyncSession (modo 'async' da API). Só a leitura da geração é assíncrona: o snapshot da
+    geração fica em memória, e abri-lo (uma vez por geração) lê só os cabeçalhos dos arquivos."""
+    if not DIR_SNAPSHOT:
+        return None
+    return _da_geracao(await payloads.geracao_atual_async(db))
+
+
+def _da_geracao(geracao):
+    global _atual
+    if geracao is None:
+        return None
+    atual = _atual
+    if atual is not None and atual.geracao == geracao:
+        return atual
+
+    try:
+        with open(os.path.join(DIR_SNAPSHOT, ARQUIVO_ATUAL)) as arquivo:
+            pasta = os.path.join(DIR_SNAPSHOT, arquivo.read().strip())
+        with open(os.path.join(pasta, 'meta.json'), encoding='utf-8') as arquivo:
+            if json.load(arquivo)['geracao'] != geracao:
+                return None
+        novo = Snapshot(pasta)
+    except (OSError, ValueError, KeyError):
+        return None
+    with _trava:
+        _atual = novo
+    return novo
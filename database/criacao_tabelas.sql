@@ -57,6 +57,23 @@ CREATE TABLE devedores_pj (
     numCNPJ VARCHAR(18)
 );
 
+-- Controle do ETL incremental: "marca d'água" de cada arquivo de origem (hash e tamanho na última execução)
+CREATE TABLE etl_fontes (
+    fonte VARCHAR(16) PRIMARY KEY,
+    hash_arquivo CHAR(64) NOT NULL,
+    tamanho_bytes BIGINT NOT NULL,
+    atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+-- Controle do ETL incremental: hash de cada linha carregada, por tabela e chave de negócio
+-- (usado para identificar as linhas novas ou alteradas sem reler as tabelas de destino)
+CREATE TABLE etl_hashes_linhas (
+    tabela VARCHAR(64) NOT NULL,
+    hash_chave BIGINT UNSIGNED NOT NULL,
+    hash_linha BIGINT UNSIGNED NOT NULL,
+    PRIMARY KEY (tabela, hash_chave)
+);
+
 -- Comentário geral: O código abaixo cria o banco Data Warehouse utilizando o Esquema Estrela.
 -- A tabela fato (fatos_cdas) armazena os dados centrais da análise.
 -- Cada dimensão representa um "atributo complexo" relacionado à tabela fato.
@@ -67,14 +84,18 @@ USE dw_db;
 -- Dimensão das naturezas das dívidas
 CREATE TABLE dim_naturezas (
     id_natureza INT PRIMARY KEY,
-    descricao_natureza VARCHAR(255) NOT NULL
+    descricao_natureza VARCHAR(255) NOT NULL,
+    -- Grupo de tributo (IPTU, ISS, Taxas, Multas, ITBI), calculado pelo ETL (ver etl/classificacao.py)
+    cod_tributo TINYINT
 );
 
 -- Dimensão das situações das CDAs
 CREATE TABLE dim_situacoes (
     id_situacao INT PRIMARY KEY,
     descricao_situacao VARCHAR(255) NOT NULL,
-    tipo_situacao CHAR(1)
+    tipo_situacao CHAR(1),
+    -- Grupo da situação (em cobrança, cancelada, quitada), calculado pelo ETL (ver etl/classificacao.py)
+    cod_grupo_situacao TINYINT
 );
 
 -- Dimensão dos devedores
@@ -95,8 +116,24 @@ CREATE TABLE fatos_cdas (
     prob_recuperacao REAL,
     fk_natureza INT NOT NULL,
     fk_situacao INT NOT NULL,
+    -- Cópias dos códigos das dimensões, para os resumos agruparem e filtrarem sem JOIN nem LIKE
+    cod_tributo TINYINT,
+    cod_grupo_situacao TINYINT,
     CONSTRAINT fk_fatos_para_naturezas FOREIGN KEY (fk_natureza) REFERENCES dim_naturezas(id_natureza),
-    CONSTRAINT fk_fatos_para_situacoes FOREIGN KEY (fk_situacao) REFERENCES dim_situacoes(id_situacao)
+    CONSTRAINT fk_fatos_para_situacoes FOREIGN KEY (fk_situacao) REFERENCES dim_situacoes(id_situacao),
+    -- Índices da busca (/cda/search): um para cada ordenação (ano ou valor), sozinha ou depois dos filtros de igualdade
+    -- por situação e por natureza. Terminam em num_cda, o desempate da ordenação, para que a paginação por cursor
+    -- (WHERE (coluna, num_cda) > (...)) e os filtros de intervalo de ano/saldo virem um range no índice, sem filesort.
+    -- Os índices que começam por fk_natureza e fk_situacao também servem às chaves estrangeiras.
+    INDEX idx_fatos_ano (ano_inscricao, num_cda),
+    INDEX idx_fatos_valor (valor_saldo, num_cda),
+    INDEX idx_fatos_situacao_ano (fk_situacao, ano_inscricao, num_cda),
+    INDEX idx_fatos_situacao_valor (fk_situacao, valor_saldo, num_cda),
+    INDEX idx_fatos_natureza_ano (fk_natureza, ano_inscricao, num_cda),
+    INDEX idx_fatos_natureza_valor (fk_natureza, valor_saldo, num_cda),
+    -- Curvas de montante acumulado (percentis do saldo por tributo) e distribuição das situações por natureza
+    INDEX idx_fatos_tributo_valor (cod_tributo, valor_saldo),
+    INDEX idx_fatos_natureza_grupo (fk_natureza, cod_grupo_situacao)
 );
 
 -- Tabela de junção N:N entre CDAs e Devedores
@@ -106,5 +143,91 @@ CREATE TABLE jun_cdas_devedores (
     fk_devedor INT NOT NULL,
     CONSTRAINT fk_juncao_para_cdas FOREIGN KEY (fk_cda) REFERENCES fatos_cdas(num_cda),
     CONSTRAINT fk_juncao_para_devedores FOREIGN KEY (fk_devedor) REFERENCES dim_devedores(id_devedor),
-    CONSTRAINT uq_cda_devedor_pair UNIQUE KEY (fk_cda, fk_devedor)
-);
\ No newline at end of file
+    CONSTRAINT uq_cda_devedor_pair UNIQUE KEY (fk_cda, fk_devedor),
+    -- Busca das CDAs de um devedor (a chave única começa por fk_cda e não serve para isso)
+    INDEX idx_juncao_devedor (fk_devedor, fk_cda)
+);
+
+-- Tabelas de resumo, recalculadas pelo ETL a cada carga e lidas pelos endpoints /resumo/* da API
+-- (evitam varrer a tabela fato a cada requisição)
+CREATE TABLE resumo_naturezas (
+    natureza VARCHAR(255) PRIMARY KEY,
+    quantidade INT NOT NULL,
+    saldo DECIMAL(38, 2) NOT NULL
+);
+
+CREATE TABLE resumo_inscricoes (
+    ano INT PRIMARY KEY,
+    quantidade INT NOT NULL
+);
+
+CREATE TABLE resumo_distribuicao (
+    natureza VARCHAR(255) PRIMARY KEY,
+    em_cobranca DECIMAL(10, 5) NOT NULL,
+    cancelada DECIMAL(10, 5) NOT NULL,
+    quitada DECIMAL(10, 5) NOT NULL
+);
+
+-- Soma do saldo em cada percentil (NTILE(100)) de cada grupo de tributo e saldo total do tributo: base das curvas de
+-- montante acumulado. DOUBLE: são as somas em float da resposta original (ver etl/montante.py), guardadas sem arredondar
+CREATE TABLE resumo_montante (
+    tributo VARCHAR(16) NOT NULL,
+    percentil TINYINT UNSIGNED NOT NULL,
+    saldo DOUBLE NOT NULL,
+    saldo_tributo DOUBLE NOT NULL,
+    PRIMARY KEY (tributo, percentil)
+);
+
+-- Sketches do saldo por grupo de tributo, ano de inscrição e grupo de situação (-1 = nenhum), em faixas logarítmicas
+-- (ver etl/sketches.py): base das curvas de montante acumulado com filtros (/resumo/montante_acumulado/curva)
+CREATE TABLE resumo_sketches (
+    cod_tributo TINYINT NOT NULL,
+    ano_inscricao INT NOT NULL,
+    cod_grupo_situacao TINYINT NOT NULL,
+    faixa INT NOT NULL,
+    quantidade INT NOT NULL,
+    saldo DECIMAL(38, 2) NOT NULL,
+    saldo_minimo DECIMAL(15, 2) NOT NULL,
+    saldo_maximo DECIMAL(15, 2) NOT NULL,
+    PRIMARY KEY (cod_tributo, ano_inscricao, cod_grupo_situacao, faixa)
+);
+
+-- Carteira de cada devedor (/cda/detalhes_devedor): exposição, probabilidade de recuperação ponderada pelo saldo
+-- e quantidade de CDAs por grupo de situação. Os índices servem à ordenação por exposição (saldo) e por quantidade.
+CREATE TABLE resumo_devedores (
+    id_devedor INT PRIMARY KEY,
+    nome VARCHAR(255) NOT NULL,
+    tipo_pessoa CHAR(2) NOT NULL,
+    cpf_cnpj VARCHAR(18),
+    qtde_cdas INT NOT NULL,
+    saldo_total DECIMAL(38, 2) NOT NULL,
+    prob_recuperacao_ponderada DOUBLE,
+    qtde_em_cobranca INT NOT NULL,
+    qtde_cancelada INT NOT NULL,
+    qtde_quitada INT NOT NULL,
+    INDEX idx_resumo_devedores_saldo (saldo_total, id_devedor),
+    INDEX idx_resumo_devedores_quantidade (qtde_cdas, id_devedor)
+);
+
+-- Momento da última atualização dos dados do DW ('dados') e de cada tabela de resumo.
+-- A API só usa um resumo se ele for mais recente que os dados; caso contrário, consulta a tabela fato diretamente.
+CREATE TABLE atualizacoes_dw (
+    item VARCHAR(64) PRIMARY KEY,
+    atualizado_em TIMESTAMP(6) NOT NULL
+);
+
+-- Geração dos dados do DW: incrementada pelo ETL a cada carga que altera o DW (linha única, id = 1)
+CREATE TABLE geracao_dw (
+    id TINYINT PRIMARY KEY,
+    geracao BIGINT NOT NULL,
+    atualizado_em TIMESTAMP(6) NOT NULL
+);
+
+-- Respostas dos endpoints /resumo/* já serializadas em JSON para a geração atual.
+-- Compartilhadas por todas as réplicas da API, que as servem com ETag e respondem 304 quando nada mudou.
+CREATE TABLE payloads_resumo (
+    rota VARCHAR(128) PRIMARY KEY,
+    geracao BIGINT NOT NULL,
+    etag VARCHAR(80) NOT NULL,
+    conteudo LONGBLOB NOT NULL
+);
@@ -0,0 +1,237 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from functools import partial
+
+import sintetico
+from relatorio import CONFIGURACAO, SEGUNDOS_MINIMOS_COMPARACAO, AmostradorMemoria
+
+# Benchmark de escala do ETL.
+# Para cada escala pedida (ex.: 1M, 10M, 50M de CDAs), gera os CSVs sintéticos (etl/sintetico.py, reaproveitados se
+# já existirem com a mesma semente), limpa os bancos e roda a carga completa do pipeline, medindo cada estágio:
+# tempo de parede, pico de memória (RSS) e linhas/s. Cada escala roda num processo próprio, para que o pico de
+# memória de uma não contamine a outra.
+# O resultado de cada escala é gravado em JSON com o commit, a configuração do ETL e as versões das bibliotecas,
+# e pode ser comparado com o de outro commit (--comparar): estágios que ficaram mais lentos ou usam mais memória
+# além da tolerância são listados e o benchmark termina com código 1.
+# Com mais de um trabalhador, estágios simultâneos dividem o mesmo processo e o pico de RSS de cada um inclui os
+# outros; para atribuir a memória estágio a estágio, use ETL_TRABALHADORES=1.
+
+RAIZ_PROJETO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# O benchmark apaga os dados dos dois bancos: por segurança, só roda contra um MySQL local ou o container "db"
+HOSTS_LOCAIS = {'localhost', '127.0.0.1', 'db'}
+
+def _linhas(resultado):
+    #Linhas processadas por um estágio: as gravadas (estatísticas da carga) ou as dos DataFrames extraídos
+    if not isinstance(resultado, dict):
+        return 0
+    if 'estatisticas' in resultado:
+        return sum(e['linhas'] for e in resultado['estatisticas'])
+    return sum(len(valor) for valor in resultado.values() if hasattr(valor, 'columns'))
+
+
+def _medir_estagio(nome, funcao, amostrador, medicoes, *dependencias):
+    amostrador.iniciar(nome)
+    inicio = time.perf_counter()
+    try:
+        resultado = funcao(*dependencias)
+    finally:
+        segundos = time.perf_counter() - inicio
+        pico = amostrador.terminar(nome)
+    linhas = _linhas(resultado)
+    medicoes[nome] = {
+        'segundos': segundos,
+        'pico_rss_mb': pico / 2**20,
+        'linhas': linhas,
+        'linhas_por_segundo': linhas / segundos if segundos > 0 else 0.0,
+    }
+    return resultado
+
+
+def limpar_bancos(*engines):
+    from sqlalchemy import text
+    for engine in engines:
+        with engine.begin() as conexao:
+            tabelas = [linha[0] for linha in conexao.execute(text("SHOW TABLES"))]
+            conexao.execute(text("SET FOREIGN_KEY_CHECKS = 0"))
+            for tabela in tabelas:
+                conexao.execute(text(f"TRUNCATE TABLE `{tabela}`"))
+            conexao.execute(text("SET FOREIGN_KEY_CHECKS = 1"))
+
+
+def medir_carga():
+    """Roda a carga completa do pipeline (dados em ETL_DIR_DADOS) medindo cada estágio. Executado no processo filho."""
+    import pipeline
+    from estagios import executar_estagios
+
+    limpar_bancos(pipeline.engine_transacional, pipeline.engine_dw)
+    medicoes = {}
+    inicio = time.perf_counter()
+    with AmostradorMemoria() as amostrador:
+        estagios = pipeline.montar_estagios_completo()
+        for estagio in estagios:
+            estagio.funcao = partial(_medir_estagio, estagio.nome, estagio.funcao, amostrador, medicoes)
+        #Sempre com threads: a memória dos estágios só é medida se eles rodarem neste processo
+        executar_estagios(estagios, pipeline.TRABALHADORES, 'thread')
+    return {
+        'estagios': medicoes,
+        'total': {
+            'segundos': time.perf_counter() - inicio,
+            'pico_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        },
+    }
+
+
+def commit_atual():
+    """Commit do projeto e se há alterações não commitadas (também usado pelo benchmark da API)."""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=RAIZ_PROJETO, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        sujo = bool(subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=RAIZ_PROJETO, capture_output=True, text=True
+        ).stdout.strip())
+        return commit, sujo
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def _versoes():
+    import numpy
+    import pandas
+    import sqlalchemy
+    return {
+        'python': platform.python_version(),
+        'pandas': pandas.__version__,
+        'numpy': numpy.__version__,
+        'sqlalchemy': sqlalchemy.__version__,
+    }
+
+
+def executar_escala(escala, semente, dir_dados):
+    quantidade = sintetico.ler_escala(escala)
+    destino = os.path.join(dir_dados, f'{escala}-s{semente}')
+    if sintetico.ja_gerado(destino, quantidade, semente):
+        print(f"Usando os dados sintéticos de {destino}")
+    else:
+        print(f"Gerando {quantidade} CDAs em {destino}...")
+        sintetico.gerar(quantidade, destino, semente, os.path.join(RAIZ_PROJETO, 'data'))
+
+    with tempfile.TemporaryDirectory() as temporaria:
+        relatorio = os.path.join(temporaria, 'medicoes.json')
+        ambiente = {**os.environ, 'ETL_DIR_DADOS': destino, 'ETL_MODO': 'completo'}
+        subprocess.run(
+            [sys.executable, '-u', os.path.abspath(__file__), '--medir', relatorio],
+            cwd=RAIZ_PROJETO, env=ambiente, check=True
+        )
+        with open(relatorio, encoding='utf-8') as arquivo:
+            medicoes = json.load(arquivo)
+
+    commit, sujo = commit_atual()
+    with open(os.path.join(destino, 'sintetico.json'), encoding='utf-8') as arquivo:
+        linhas_csv = json.load(arquivo)['linhas']
+    return {
+        'commit': commit,
+        'commit_com_alteracoes': sujo,
+        'data': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'escala': escala,
+        'cdas': quantidade,
+        'semente': semente,
+        'linhas_csv': linhas_csv,
+        'configuracao': {variavel: os.getenv(variavel) for variavel in CONFIGURACAO},
+        'versoes': _versoes(),
+        'maquina': {'cpus': os.cpu_count(), 'sistema': platform.platform()},
+        **medicoes,
+    }
+
+
+def imprimir(resultado):
+    print(f"\nEscala {resultado['escala']} ({resultado['cdas']} CDAs), commit {(resultado['commit'] or '?')[:12]}")
+    print(f"{'estágio':<28}{'segundos':>10}{'pico RSS (MB)':>15}{'linhas':>12}{'linhas/s':>12}")
+    for nome, medicao in sorted(resultado['estagios'].items(), key=lambda item: -item[1]['segundos']):
+        print(f"{nome:<28}{medicao['segundos']:>10.2f}{medicao['pico_rss_mb']:>15.0f}"
+              f"{medicao['linhas']:>12}{medicao['linhas_por_segundo']:>12.0f}")
+    total = resultado['total']
+    print(f"{'total':<28}{total['segundos']:>10.2f}{total['pico_rss_mb']:>15.0f}")
+
+
+def comparar(resultado, base, tolerancia):
+    """Devolve as regressões (tempo ou memória acima da base em mais que a tolerância) de uma escala."""
+    if base['configuracao'] != resultado['configuracao']:
+        print(f"  Aviso: configuração diferente da base ({base['configuracao']})")
+    pares = [('total', base['total'], resultado['total'])] + [
+        (nome, base['estagios'][nome], medicao)
+        for nome, medicao in resultado['estagios'].items() if nome in base['estagios']
+    ]
+    regressoes = []
+    for nome, antes, depois in pares:
+        if max(antes['segundos'], depois['segundos']) >= SEGUNDOS_MINIMOS_COMPARACAO \
+                and depois['segundos'] > antes['segundos'] * (1 + tolerancia):
+            regressoes.append(f"{nome}: {antes['segundos']:.2f}s -> {depois['segundos']:.2f}s")
+        if depois['pico_rss_mb'] > antes['pico_rss_mb'] * (1 + tolerancia):
+            regressoes.append(f"{nome}: pico de RSS {antes['pico_rss_mb']:.0f} MB -> {depois['pico_rss_mb']:.0f} MB")
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de escala do ETL com dados sintéticos.")
+    parser.add_argument('--escalas', nargs='+', default=['1M'], help="quantidades de CDAs (ex.: 1M 10M 50M)")
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--dados', default=os.path.join(tempfile.gettempdir(), 'lamdec_sintetico'),
+                        help="pasta onde os CSVs sintéticos são gerados e reaproveitados")
+    parser.add_argument('--saida', default=os.path.join(RAIZ_PROJETO, 'benchmarks'),
+                        help="pasta onde os resultados (JSON) são gravados")
+    parser.add_argument('--comparar', nargs='+', default=[], help="resultados (JSON) de outro commit usados como base")
+    parser.add_argument('--tolerancia', type=float, default=0.15, help="aumento relativo tolerado antes de apontar regressão")
+    parser.add_argument('--permitir-host-remoto', action='store_true', help="permite limpar um banco fora de HOSTS_LOCAIS")
+    parser.add_argument('--medir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir:
+        medicoes = medir_carga()
+        with open(args.medir, 'w', encoding='utf-8') as arquivo:
+            json.dump(medicoes, arquivo)
+        return
+
+    if os.getenv('DB_HOST') not in HOSTS_LOCAIS and not args.permitir_host_remoto:
+        sys.exit(f"DB_HOST={os.getenv('DB_HOST')} não é local: o benchmark apaga os dados dos bancos. "
+                 f"Use --permitir-host-remoto se for mesmo um banco descartável.")
+
+    bases = {}
+    for caminho in args.comparar:
+        with open(caminho, encoding='utf-8') as arquivo:
+            base = json.load(arquivo)
+        bases[(base['escala'], base['semente'])] = base
+
+    os.makedirs(args.saida, exist_ok=True)
+    regressoes = []
+    for escala in args.escalas:
+        resultado = executar_escala(escala, args.semente, args.dados)
+        nome = f"{(resultado['commit'] or 'sem-commit')[:12]}-{escala}-s{args.semente}.json"
+        with open(os.path.join(args.saida, nome), 'w', encoding='utf-8') as arquivo:
+            json.dump(resultado, arquivo, indent=2)
+        imprimir(resultado)
+
+        base = bases.get((escala, args.semente))
+        if base is not None:
+            encontradas = comparar(resultado, base, args.tolerancia)
+            print(f"Comparação com {(base['commit'] or '?')[:12]}: "
+                  f"{len(encontradas)} regressão(ões) acima de {args.tolerancia:.0%}")
+            regressoes.extend(f"[{escala}] {texto}" for texto in encontradas)
+
+    for texto in regressoes:
+        print(f"  REGRESSÃO {texto}")
+    if regressoes:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
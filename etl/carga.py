@@ -0,0 +1,184 @@
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+import relatorio
+
+# Camada de carga do ETL.
+# Todas as tabelas do pipeline passam pela função carregar(), que escolhe a estratégia de escrita
+# de acordo com o modo configurado:
+#   - 'to_sql': comportamento original (DataFrame.to_sql do pandas). Fica como modo de segurança.
+#   - 'lote':   INSERTs com várias linhas por comando (INSERT ... VALUES (...),(...),...), em lotes de tamanho ajustável.
+#   - 'infile': grava o DataFrame em um CSV temporário e usa LOAD DATA LOCAL INFILE (o mais rápido no MySQL).
+#               Exige local_infile=1 no servidor e allow_local_infile=True na conexão.
+# Em todos os modos, as checagens de chave estrangeira e de unicidade ficam desligadas durante a carga
+# e são restauradas ao final (os dados já chegam tratados pelo pipeline).
+
+MODO_CARGA = os.getenv('ETL_MODO_CARGA', 'lote')
+TAMANHO_LOTE = int(os.getenv('ETL_TAMANHO_LOTE', '5000'))
+DIR_STAGING = os.getenv('ETL_DIR_STAGING') or tempfile.gettempdir()
+
+# Variáveis de sessão do MySQL desligadas durante a carga. Os valores originais são lidos antes e restaurados depois.
+CHECAGENS_ADIADAS = ('foreign_key_checks', 'unique_checks')
+
+
+def _nome(identificador):
+    return f"`{identificador}`"
+
+
+@contextmanager
+def checagens_adiadas(conexao):
+    #Guarda os valores atuais das variáveis de sessão, desliga as checagens e as restaura no final,
+    #mesmo que a carga falhe no meio.
+    originais = {}
+    for variavel in CHECAGENS_ADIADAS:
+        originais[variavel] = conexao.exec_driver_sql(f"SELECT @@SESSION.{variavel}").scalar()
+        conexao.exec_driver_sql(f"SET SESSION {variavel} = 0")
+    try:
+        yield conexao
+    finally:
+        for variavel, valor in originais.items():
+            conexao.exec_driver_sql(f"SET SESSION {variavel} = {int(valor)}")
+
+
+def _insert_multilinha(tabela_pd, conexao, colunas, linhas, atualizar=False):
+    #Usado como "method" do to_sql: o pandas já converte NaN/NaT em None e separa os dados em lotes
+    #(chunksize), então só precisamos montar um único INSERT com várias linhas por lote.
+    #Com atualizar=True, vira um upsert: linhas cuja chave já existe têm as demais colunas atualizadas.
+    linhas = list(linhas)
+    if not linhas:
+        return 0
+    marcadores = "(" + ", ".join(["%s"] * len(colunas)) + ")"
+    sql = (
+        f"INSERT INTO {_nome(tabela_pd.name)} ({', '.join(_nome(c) for c in colunas)}) "
+        f"VALUES {', '.join([marcadores] * len(linhas))}"
+    )
+    if atualizar:
+        sql += " AS novo ON DUPLICATE KEY UPDATE " + ", ".join(
+            f"{_nome(c)} = novo.{_nome(c)}" for c in colunas
+        )
+    parametros = tuple(valor for linha in linhas for valor in linha)
+    conexao.exec_driver_sql(sql, parametros)
+    return len(linhas)
+
+
+def _upsert_multilinha(tabela_pd, conexao, colunas, linhas):
+    return _insert_multilinha(tabela_pd, conexao, colunas, linhas, atualizar=True)
+
+
+def _carregar_to_sql(df, tabela, conexao, tamanho_lote):
+    df.to_sql(tabela, con=conexao, if_exists='append', index=False)
+
+
+def _carregar_lote(df, tabela, conexao, tamanho_lote):
+    df.to_sql(tabela, con=conexao, if_exists='append', index=False,
+              chunksize=tamanho_lote, method=_insert_multilinha)
+
+
+def _carregar_infile(df, tabela, conexao, tamanho_lote):
+    #O CSV temporário usa \N para nulos (padrão do MySQL) e aspas duplas apenas quando necessário.
+    descritor, caminho = tempfile.mkstemp(prefix=f"{tabela}_", suffix='.csv', dir=DIR_STAGING)
+    os.close(descritor)
+    try:
+        df.to_csv(caminho, index=False, header=False, na_rep='\\N',
+                  date_format='%Y-%m-%d %H:%M:%S.%f', lineterminator='\n')
+        caminho_sql = caminho.replace('\\', '/')
+        conexao.exec_driver_sql(
+            f"LOAD DATA LOCAL INFILE '{caminho_sql}' INTO TABLE {_nome(tabela)} "
+            "CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+            "LINES TERMINATED BY '\\n' "
+            f"({', '.join(_nome(c) for c in df.columns)})"
+        )
+    finally:
+        os.remove(caminho)
+
+
+CARREGADORES = {
+    'to_sql': _carregar_to_sql,
+    'lote': _carregar_lote,
+    'infile': _carregar_infile,
+}
+
+
+def _executar(engine, tabela, modo, linhas, operacao):
+    #Executa a operação numa única transação, com as checagens adiadas, e mede a vazão.
+    #Uma transação por tabela: se algo falhar, nada da tabela fica pela metade.
+    inicio = time.perf_counter()
+    with relatorio.fase('gravacao'), engine.begin() as conexao:
+        with checagens_adiadas(conexao):
+            operacao(conexao)
+    duracao = time.perf_counter() - inicio
+    relatorio.acumular('linhas_gravadas', linhas)
+
+    estatistica = {
+        'tabela': tabela,
+        'modo': modo,
+        'linhas': linhas,
+        'segundos': duracao,
+        'linhas_por_segundo': linhas / duracao if duracao > 0 else 0.0,
+    }
+    print(f"  {tabela}: {estatistica['linhas']} linhas em {duracao:.2f}s "
+          f"({estatistica['linhas_por_segundo']:.0f} linhas/s, modo {modo})")
+    return estatistica
+
+
+def carregar(df, tabela, engine, modo=None, tamanho_lote=None, substituir=False):
+    """Carrega o DataFrame na tabela (append) e devolve as estatísticas da carga.
+    Com substituir=True, as linhas atuais da tabela são apagadas antes, na mesma transação da carga."""
+    modo = modo or MODO_CARGA
+    tamanho_lote = tamanho_lote or TAMANHO_LOTE
+    if modo not in CARREGADORES:
+        raise ValueError(f"Modo de carga inválido: '{modo}'. Use um de {list(CARREGADORES)}.")
+
+    def operacao(conexao):
+        #DELETE em vez de TRUNCATE: o TRUNCATE faz commit implícito, e uma carga que falhasse deixaria a tabela vazia.
+        #Com as checagens de chave estrangeira desligadas, o DELETE não é barrado (nem propagado) pelas tabelas filhas.
+        if substituir:
+            conexao.exec_driver_sql(f"DELETE FROM {_nome(tabela)}")
+        CARREGADORES[modo](df, tabela, conexao, tamanho_lote)
+
+    return _executar(engine, tabela, modo, len(df), operacao)
+
+
+def upsert(df, tabela, engine, tamanho_lote=None):
+    """Insere as linhas novas e atualiza as existentes (INSERT ... ON DUPLICATE KEY UPDATE)."""
+    tamanho_lote = tamanho_lote or TAMANHO_LOTE
+    return _executar(engine, tabela, 'upsert', len(df), lambda conexao: df.to_sql(
+        tabela, con=conexao, if_exists='append', index=False,
+        chunksize=tamanho_lote, method=_upsert_multilinha
+    ))
+
+
+def remover(df_chaves, tabela, engine, tamanho_lote=None):
+    """Apaga da tabela as linhas cujas chaves (as colunas de df_chaves) aparecem no DataFrame."""
+    tamanho_lote = tamanho_lote or TAMANHO_LOTE
+    colunas = list(df_chaves.columns)
+    chaves = [tuple(linha) for linha in df_chaves.astype(object).itertuples(index=False, name=None)]
+
+    def operacao(conexao):
+        #Chave simples: WHERE k IN (...). Chave composta: WHERE (k1, k2) IN ((...), (...)).
+        marcador = "%s" if len(colunas) == 1 else "(" + ", ".join(["%s"] * len(colunas)) + ")"
+        alvo = _nome(colunas[0]) if len(colunas) == 1 else "(" + ", ".join(_nome(c) for c in colunas) + ")"
+        for inicio in range(0, len(chaves), tamanho_lote):
+            lote = chaves[inicio:inicio + tamanho_lote]
+            conexao.exec_driver_sql(
+                f"DELETE FROM {_nome(tabela)} WHERE {alvo} IN ({', '.join([marcador] * len(lote))})",
+                tuple(valor for chave in lote for valor in chave)
+            )
+
+    return _executar(engine, tabela, 'remocao', len(chaves), operacao)
+
+
+def imprimir_resumo(estatisticas):
+    #Tabela final com a vazão de cada carga, para comparar modos e execuções.
+    if not estatisticas:
+        return
+    print(f"{'tabela':<22}{'modo':<10}{'linhas':>10}{'segundos':>10}{'linhas/s':>12}")
+    for e in estatisticas:
+        print(f"{e['tabela']:<22}{e['modo']:<10}{e['linhas']:>10}{e['segundos']:>10.2f}{e['linhas_por_segundo']:>12.0f}")
+    total_linhas = sum(e['linhas'] for e in estatisticas)
+    total_segundos = sum(e['segundos'] for e in estatisticas)
+    vazao = total_linhas / total_segundos if total_segundos > 0 else 0.0
+    print(f"{'total':<32}{total_linhas:>10}{total_segundos:>10.2f}{vazao:>12.0f}")
@@ -0,0 +1,55 @@
+import unicodedata
+
+# Regras de classificação do DW, aplicadas uma vez por carga pelo ETL.
+# Cada natureza recebe o código do seu grupo de tributo e cada situação o código do seu grupo de situação
+# (em cobrança, cancelada, quitada). Os códigos são gravados nas dimensões e copiados para a tabela fato
+# (cod_tributo e cod_grupo_situacao, indexados), então os resumos do ETL e as consultas da API só agrupam e filtram
+# por inteiros, sem avaliar LIKE/CASE por linha.
+# O código de um grupo é a sua posição na lista (TRIBUTOS, GRUPOS); NULL quando a descrição não entra em nenhum.
+# A API importa este módulo (etl.classificacao) apenas para traduzir os códigos nos nomes das respostas.
+
+# Grupos de tributo (/resumo/montante_acumulado): prefixo da descrição da natureza -> grupo, na ordem do CASE original
+TRIBUTOS_POR_PREFIXO = [
+    ('IPTU', 'IPTU'),
+    ('ISS', 'ISS'),
+    ('Taxa', 'Taxas'),
+    ('Multa', 'Multas'),
+    ('ITBI', 'ITBI'),
+]
+TRIBUTOS = [tributo for _, tributo in TRIBUTOS_POR_PREFIXO]
+
+# Agrupamento das situações (/resumo/distribuicao_cdas e carteira dos devedores): grupo -> (prefixos, descrições exatas)
+GRUPOS_SITUACAO = {
+    'em_cobranca': (('Cobrança',), ('Parcelada', 'Leilão', 'Arrematação', 'Negociada', 'Parcelamento Irregular')),
+    'cancelada': (('Cancelada',), ('Migracao Cancelamento',)),
+    'quitada': (('Paga',), ('Migracao Pagos',)),
+}
+GRUPOS = list(GRUPOS_SITUACAO)
+CODIGOS_GRUPO = {grupo: codigo for codigo, grupo in enumerate(GRUPOS)}
+
+
+def normalizar(texto: str) -> str:
+    #Aproxima a collation padrão do MySQL 8 (utf8mb4_0900_ai_ci): comparações sem diferenciar acentos e maiúsculas
+    decomposto = unicodedata.normalize('NFKD', texto)
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).casefold()
+
+
+def codigo_tributo(descricao: str):
+    chave = normalizar(descricao)
+    for codigo, (prefixo, _) in enumerate(TRIBUTOS_POR_PREFIXO):
+        if chave.startswith(normalizar(prefixo)):
+            return codigo
+    return None
+
+
+def codigo_grupo_situacao(descricao: str):
+    chave = normalizar(descricao)
+    for codigo, (prefixos, descricoes) in enumerate(GRUPOS_SITUACAO.values()):
+        if any(chave.startswith(normalizar(p)) for p in prefixos) or any(chave == normalizar(d) for d in descricoes):
+            return codigo
+    return None
+
+
+def codificar(descricoes, regra):
+    """Aplica a regra a uma coluna de descrições (uma vez por descrição distinta). Devolve uma coluna Int8 com nulos."""
+    return descricoes.map({descricao: regra(descricao) for descricao in descricoes.dropna().unique()}).astype('Int8')
@@ -0,0 +1,108 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from carga import carregar, upsert, remover
+
+# Suporte ao modo incremental do ETL.
+# Duas tabelas de controle no banco transacional guardam o estado da última execução:
+#   - etl_fontes: a "marca d'água" de cada CSV de origem (hash SHA-256 e tamanho do arquivo).
+#     Se nenhuma fonte mudou, o ETL termina sem tocar nos dados.
+#   - etl_hashes_linhas: um hash por linha carregada, indexado pelo hash da chave de negócio.
+#     Com ele sabemos quais linhas são novas ou alteradas sem precisar comparar com o conteúdo do banco
+#     (que volta com tipos diferentes: DECIMAL, TIMESTAMP arredondado, etc).
+# As remoções são detectadas comparando as chaves que estão na tabela de destino com as chaves do novo arquivo.
+
+TABELA_FONTES = 'etl_fontes'
+TABELA_HASHES = 'etl_hashes_linhas'
+
+
+def impressao_digital(caminho, tamanho_bloco=1 << 20):
+    #Lê o arquivo em blocos para não carregar tudo na memória só para calcular o hash.
+    sha = hashlib.sha256()
+    with open(caminho, 'rb') as arquivo:
+        for bloco in iter(lambda: arquivo.read(tamanho_bloco), b''):
+            sha.update(bloco)
+    return {'hash_arquivo': sha.hexdigest(), 'tamanho_bytes': os.path.getsize(caminho)}
+
+
+def ler_marcas(engine):
+    #Devolve {fonte: hash_arquivo} da última execução bem-sucedida.
+    df = pd.read_sql(f"SELECT fonte, hash_arquivo FROM {TABELA_FONTES}", engine)
+    return dict(zip(df['fonte'], df['hash_arquivo']))
+
+
+def gravar_marcas(engine, impressoes):
+    #Só deve ser chamada no final do ETL: se a execução falhar no meio, as fontes continuam marcadas como alteradas.
+    df = pd.DataFrame([{'fonte': fonte, **impressao} for fonte, impressao in impressoes.items()])
+    upsert(df, TABELA_FONTES, engine)
+
+
+def invalidar_estado(engine, tabelas):
+    #Usada quando as tabelas mudam por fora do ETL (por exemplo, o DW revertido para a publicação anterior): a próxima
+    #execução incremental considera todas as fontes alteradas e regrava todas as linhas dessas tabelas.
+    with engine.begin() as conexao:
+        conexao.execute(text(f"UPDATE {TABELA_FONTES} SET hash_arquivo = ''"))
+        for tabela in tabelas:
+            conexao.execute(text(f"DELETE FROM {TABELA_HASHES} WHERE tabela = :tabela"), {'tabela': tabela})
+
+
+def hash_linhas(df, chaves):
+    #hash_chave identifica a linha pela chave de negócio; hash_linha muda se qualquer coluna da linha mudar.
+    #As chaves são sempre inteiras, então são convertidas para int64 para o hash não depender do tipo lido.
+    return pd.DataFrame({
+        'hash_chave': pd.util.hash_pandas_object(df[chaves].astype('int64'), index=False).to_numpy(),
+        'hash_linha': pd.util.hash_pandas_object(df, index=False).to_numpy(),
+    })
+
+
+def _ler_hashes(engine, tabela):
+    df = pd.read_sql(
+        text(f"SELECT hash_chave, hash_linha FROM {TABELA_HASHES} WHERE tabela = :tabela"),
+        engine, params={'tabela': tabela}
+    )
+    return df.astype('uint64')
+
+
+def gravar_hashes(engine, tabela, df, chaves):
+    #Usada depois de uma carga completa: substitui todo o estado da tabela.
+    with engine.begin() as conexao:
+        conexao.execute(text(f"DELETE FROM {TABELA_HASHES} WHERE tabela = :tabela"), {'tabela': tabela})
+    hashes = hash_linhas(df.drop_duplicates(subset=chaves), chaves)
+    hashes.insert(0, 'tabela', tabela)
+    return carregar(hashes, TABELA_HASHES, engine)
+
+
+def aplicar_diferenca(df_novo, tabela, chaves, engine, engine_controle):
+    """Aplica na tabela só o que mudou em relação à última carga: upsert de linhas novas ou alteradas e remoção
+    das chaves que sumiram da fonte. Devolve a lista de estatísticas das operações executadas."""
+    estatisticas = []
+    df_novo = df_novo.drop_duplicates(subset=chaves).reset_index(drop=True)
+    hashes_novos = hash_linhas(df_novo, chaves)
+    hashes_anteriores = _ler_hashes(engine_controle, tabela)
+
+    #Como hash_linha inclui as colunas da chave, uma linha está inalterada se o seu hash já existia.
+    alteradas = ~np.isin(hashes_novos['hash_linha'].to_numpy(), hashes_anteriores['hash_linha'].to_numpy())
+
+    #Remoções: chaves presentes na tabela de destino que não existem mais na fonte.
+    colunas_chave = ", ".join(f"`{c}`" for c in chaves)
+    chaves_atuais = pd.read_sql(f"SELECT DISTINCT {colunas_chave} FROM `{tabela}`", engine).astype('int64')
+    removidas = chaves_atuais.merge(
+        df_novo[chaves].astype('int64'), on=chaves, how='left', indicator=True
+    ).query("_merge == 'left_only'")[chaves]
+
+    print(f"  {tabela}: {int(alteradas.sum())} novas/alteradas, {len(removidas)} removidas")
+    if alteradas.any():
+        estatisticas.append(upsert(df_novo[alteradas], tabela, engine))
+        novos = hashes_novos[alteradas].copy()
+        novos.insert(0, 'tabela', tabela)
+        upsert(novos, TABELA_HASHES, engine_controle)
+    if len(removidas):
+        estatisticas.append(remover(removidas, tabela, engine))
+        hashes_removidos = hash_linhas(removidas, chaves)[['hash_chave']]
+        hashes_removidos.insert(0, 'tabela', tabela)
+        remover(hashes_removidos, TABELA_HASHES, engine_controle)
+    return estatisticas
@@ -0,0 +1,165 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import relatorio
+
+# Leitura tipada dos CSVs de origem.
+# Cada arquivo tem um esquema declarado: só as colunas usadas pelo pipeline são lidas (usecols), com tipos
+# compactos (ids int32, anos int16, nomes de poucos valores como category, datas como datetime64).
+# O saldo continua float64: os 15 dígitos de um DECIMAL(15, 2) cabem na precisão do float64, então o valor
+# gravado no banco (arredondado em 2 casas) é exatamente o do CSV.
+# Colunas que podem vir vazias usam os inteiros com nulo do pandas (Int16, Int64).
+#
+# Modos de leitura:
+#   - 'inteira': cada arquivo é lido de uma vez (padrão).
+#   - 'blocos':  o arquivo é lido em blocos de linhas, com a quantidade calculada a partir do orçamento de memória.
+#                Só os blocos já tipados e sem duplicados ficam em memória; o texto do CSV nunca é carregado inteiro.
+# Nos dois modos os duplicados são removidos globalmente (mantendo a primeira ocorrência, como o drop_duplicates),
+# com as chaves já vistas guardadas em arrays int64 ordenados (ConjuntoChaves), e não em cópias dos DataFrames.
+
+MODO_LEITURA = os.getenv('ETL_MODO_LEITURA', 'inteira')
+MEMORIA_LEITURA_MB = int(os.getenv('ETL_MEMORIA_LEITURA_MB', '256'))
+# Memória usada pelo pandas por byte de CSV durante o parse de um bloco (strings intermediárias, conversões)
+FATOR_PARSE = 10
+LINHAS_MINIMAS_BLOCO = 10_000
+
+# Esquema de cada fonte: {coluna: tipo} das colunas lidas e as colunas de data
+ESQUEMAS = {
+    '001': {
+        'tipos': {
+            'numCDA': 'int64',
+            'anoInscricao': 'int16',
+            'idNaturezaDivida': 'int32',
+            'codSituacaoCDA': 'int32',
+            'codFaseCobranca': 'Int16',
+            'ValSaldo': 'float64',
+        },
+        'datas': ['DatSituacao', 'datCadastramento'],
+    },
+    '002': {
+        'tipos': {'idNaturezadivida': 'int32', 'nomnaturezadivida': 'category'},
+    },
+    '003': {
+        'tipos': {'codSituacaoCDA': 'int32', 'nomSituacaoCDA': 'category', 'tipoSituacao': 'category'},
+    },
+    '004': {
+        'tipos': {'numCDA': 'int64', 'probRecuperacao': 'float64'},
+    },
+    '005': {
+        'tipos': {'numCDA': 'int64', 'idPessoa': 'int32'},
+    },
+    '006': {
+        'tipos': {'idpessoa': 'int32', 'descNome': 'object', 'numcpf': 'Int64'},
+    },
+    '007': {
+        'tipos': {'idpessoa': 'int32', 'descNome': 'object', 'numCNPJ': 'Int64'},
+    },
+}
+
+
+class ConjuntoChaves:
+    """Conjunto das chaves inteiras já vistas, com 8 bytes por chave.
+
+    As chaves novas de cada bloco entram como uma sequência ordenada; quando as sequências pendentes passam do
+    tamanho da principal, todas são intercaladas nela (custo total O(n log n), como numa LSM tree).
+    """
+
+    def __init__(self):
+        self._principal = np.empty(0, dtype='int64')
+        self._pendentes = []
+
+    @staticmethod
+    def _contidas(ordenadas, chaves):
+        if len(ordenadas) == 0:
+            return np.zeros(len(chaves), dtype=bool)
+        posicao = np.minimum(np.searchsorted(ordenadas, chaves), len(ordenadas) - 1)
+        return ordenadas[posicao] == chaves
+
+    def primeiras(self, chaves):
+        """Máscara das chaves que aparecem pela primeira vez (no bloco e em todos os blocos anteriores)."""
+        chaves = np.asarray(chaves, dtype='int64')
+        mascara = np.zeros(len(chaves), dtype=bool)
+        unicas, posicoes = np.unique(chaves, return_index=True)
+        mascara[posicoes] = True
+        for ordenadas in [self._principal, *self._pendentes]:
+            mascara[posicoes] &= ~self._contidas(ordenadas, unicas)
+
+        novas = chaves[mascara]
+        if len(novas):
+            self._pendentes.append(np.sort(novas))
+            if sum(len(p) for p in self._pendentes) >= len(self._principal):
+                self._principal = np.sort(np.concatenate([self._principal, *self._pendentes]))
+                self._pendentes = []
+        return mascara
+
+
+def linhas_por_bloco(caminho, memoria_mb=None):
+    #Estima o tamanho médio das linhas pelo começo do arquivo e divide o orçamento de memória pelo custo do parse
+    memoria_mb = memoria_mb or MEMORIA_LEITURA_MB
+    with open(caminho, 'rb') as arquivo:
+        arquivo.readline()
+        amostra = arquivo.read(1 << 16)
+    bytes_linha = len(amostra) / max(amostra.count(b'\n'), 1) or 1
+    return max(int(memoria_mb * 2**20 / (bytes_linha * FATOR_PARSE)), LINHAS_MINIMAS_BLOCO)
+
+
+def _blocos(caminho, esquema, modo):
+    tipos = esquema['tipos']
+    datas = esquema.get('datas', [])
+    leitura = pd.read_csv(
+        caminho,
+        usecols=[*tipos, *datas],
+        dtype=tipos,
+        chunksize=linhas_por_bloco(caminho) if modo == 'blocos' else None,
+    )
+    for bloco in ([leitura] if modo != 'blocos' else leitura):
+        for coluna in datas:
+            bloco[coluna] = pd.to_datetime(bloco[coluna], format='ISO8601', errors='coerce')
+        yield bloco
+
+
+def _concatenar(blocos, esquema):
+    #Blocos com categorias diferentes viram object no concat; todos recebem antes a união das categorias
+    if not blocos:
+        tipos = {**esquema['tipos'], **{coluna: 'datetime64[ns]' for coluna in esquema.get('datas', [])}}
+        return pd.DataFrame({coluna: pd.Series(dtype=tipo) for coluna, tipo in tipos.items()})
+    categoricas = [coluna for coluna, tipo in esquema['tipos'].items() if tipo == 'category']
+    for coluna in categoricas:
+        categorias = pd.api.types.union_categoricals([bloco[coluna] for bloco in blocos]).categories
+        for bloco in blocos:
+            bloco[coluna] = bloco[coluna].cat.set_categories(categorias)
+    if len(blocos) == 1:
+        return blocos[0]
+    return pd.concat(blocos, ignore_index=True)
+
+
+def ler_fonte(caminho, fonte, unicos=None, anular_repetidos=None, modo=None):
+    """Lê um CSV de origem com o esquema declarado da fonte.
+
+    unicos: coluna chave; só a primeira linha de cada chave é mantida.
+    anular_repetidos: coluna (com nulos) cujos valores repetidos viram nulo, mantendo o da primeira linha.
+    """
+    esquema = ESQUEMAS[fonte]
+    modo = modo or MODO_LEITURA
+    vistos_unicos = ConjuntoChaves()
+    vistos_repetidos = ConjuntoChaves()
+
+    blocos = []
+    with relatorio.fase('leitura_csv'):
+        for bloco in _blocos(caminho, esquema, modo):
+            relatorio.acumular('linhas_entrada', len(bloco))
+            if unicos:
+                primeiras = vistos_unicos.primeiras(bloco[unicos].to_numpy())
+                relatorio.descartar(f'{unicos}_duplicado', len(bloco) - primeiras.sum())
+                bloco = bloco[primeiras].reset_index(drop=True)
+            if anular_repetidos:
+                preenchidos = bloco[anular_repetidos].notna().to_numpy()
+                repetidos = np.zeros(len(bloco), dtype=bool)
+                repetidos[preenchidos] = ~vistos_repetidos.primeiras(bloco.loc[preenchidos, anular_repetidos].to_numpy('int64'))
+                relatorio.corrigir(f'{anular_repetidos}_repetido_anulado', repetidos.sum())
+                bloco.loc[repetidos, anular_repetidos] = pd.NA
+            blocos.append(bloco)
+        relatorio.acumular('bytes_lidos', os.path.getsize(caminho))
+        return _concatenar(blocos, esquema)
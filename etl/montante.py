@@ -0,0 +1,81 @@
+import numpy as np
+
+# Somas do saldo em cada percentil (NTILE(100)) de cada grupo de tributo, base das curvas de montante acumulado
+# (/resumo/montante_acumulado). Usado pelo ETL, que grava as somas em resumo_montante, e pela API (api/curvas.py),
+# a partir do snapshot ou da tabela fato, para que os três caminhos deem exatamente a mesma resposta.
+# Os percentis são definidos pelos saldos em centavos inteiros (ordenação exata), mas as somas são feitas sobre os
+# saldos em reais (float), na ordem dos saldos e com a soma compensada (Kahan) do groupby do pandas, como na versão
+# original do endpoint: somar os centavos e dividir no final muda as últimas casas dos percentuais.
+# O módulo não depende do resto do ETL.
+
+N_PERCENTIS = 100
+
+# Código do grupo de tributo (cod_tributo) e saldo das CDAs dos cinco grupos. O SQL é o mesmo no MySQL e no SQLite.
+SELECT_SALDOS = """
+    SELECT
+        f.cod_tributo,
+        f.valor_saldo
+    FROM
+        fatos_cdas f
+    WHERE
+        f.cod_tributo IS NOT NULL
+"""
+
+
+def centavos(valores):
+    return np.rint(np.asarray(valores, dtype='float64') * 100).astype('int64')
+
+
+def soma_compensada(matriz, acumulada: bool = False):
+    """Soma compensada (Kahan) de cada linha da matriz, coluna a coluna, com as mesmas operações do sum e do cumsum do
+    groupby do pandas. Com acumulada=True, devolve as somas parciais (matriz do mesmo formato)."""
+    matriz = np.asarray(matriz, dtype='float64')
+    soma = np.zeros(len(matriz))
+    compensacao = np.zeros(len(matriz))
+    parciais = np.zeros_like(matriz) if acumulada else None
+    for coluna in range(matriz.shape[1]):
+        y = matriz[:, coluna] - compensacao
+        t = soma + y
+        compensacao = (t - soma) - y
+        soma = t
+        if acumulada:
+            parciais[:, coluna] = t
+    return parciais if acumulada else soma
+
+
+def _soma_sequencial(valores):
+    #A mesma soma compensada numa sequência só (o total de um tributo): um laço simples é mais rápido que o NumPy
+    soma = compensacao = 0.0
+    for valor in valores:
+        y = valor - compensacao
+        t = soma + y
+        compensacao = (t - soma) - y
+        soma = t
+    return soma
+
+
+def somas_por_percentil(codigos, centavos_cdas, grupos: int):
+    """Equivalente de NTILE(100) OVER (PARTITION BY cod_tributo ORDER BY saldo) seguido de SUM(saldo) por percentil.
+    codigos: cod_tributo de cada linha (0 a grupos - 1; outros valores são ignorados); centavos_cdas: saldo em centavos.
+    Devolve (somas, totais, presentes): a soma em reais de cada (tributo, percentil), o saldo total de cada tributo
+    e se o percentil tem alguma linha."""
+    codigos = np.asarray(codigos)
+    centavos_cdas = np.asarray(centavos_cdas)
+    somas = np.zeros((grupos, N_PERCENTIS), dtype='float64')
+    totais = np.zeros(grupos, dtype='float64')
+    presentes = np.zeros((grupos, N_PERCENTIS), dtype=bool)
+
+    for i in range(grupos):
+        #O float de c / 100 é o mesmo valor que o banco devolve para o DECIMAL com duas casas
+        valores = np.sort(centavos_cdas[codigos == i]) / 100
+        if len(valores) == 0:
+            continue
+        #Como no NTILE: com n linhas, os (n % 100) primeiros percentis têm uma linha a mais que os demais.
+        #Cada grupo de percentis de mesmo tamanho vira uma matriz (percentil x CDAs), somada coluna a coluna.
+        base, sobra = divmod(len(valores), N_PERCENTIS)
+        maiores = sobra * (base + 1)
+        somas[i, :sobra] = soma_compensada(valores[:maiores].reshape(sobra, base + 1))
+        somas[i, sobra:] = soma_compensada(valores[maiores:].reshape(N_PERCENTIS - sobra, base))
+        totais[i] = _soma_sequencial(valores.tolist())
+        presentes[i] = np.arange(N_PERCENTIS) < len(valores)
+    return somas, totais, presentes
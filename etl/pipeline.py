@@ -2,7 +2,19 @@ import pandas as pd
 from sqlalchemy import create_engine
 import os
 import sys
+import time
+from datetime import datetime, timezone
+from functools import partial
 from dotenv import load_dotenv
+from carga import carregar, imprimir_resumo
+from estagios import Estagio, executar_estagios
+import classificacao
+import incremental
+import leitura
+import publicacao
+import relatorio
+import resumos
+import snapshot
 
 load_dotenv()
 
@@ -14,109 +26,263 @@ DB_PORT = os.getenv('DB_PORT')
 DB_TRANSACIONAL_NAME = os.getenv('DB_TRANSACIONAL_NAME')
 DB_DW_NAME = os.getenv('DB_DW_NAME')
 
+# Origem dos dados do DW:
+#   - 'memoria': a transformação do DW consome diretamente os DataFrames já tratados (e as chaves dos fatos e devedores
+#     ficam em memória para filtrar a junção). A gravação no transacional vira apenas mais um destino, em paralelo.
+#   - 'banco': comportamento original, relê do transacional (e do DW, para a junção) as tabelas recém-gravadas.
+HANDOFF = os.getenv('ETL_HANDOFF', 'memoria')
+
+# Paralelismo da carga completa: quantidade de estágios executados ao mesmo tempo e tipo de pool ('thread' ou 'process')
+TRABALHADORES = int(os.getenv('ETL_TRABALHADORES', '4'))
+TIPO_POOL = os.getenv('ETL_TIPO_POOL', 'thread')
+
+# Cada estágio em execução usa a sua própria conexão do pool, então o pool precisa comportar todos os trabalhadores
 engine_transacional = create_engine(
-    f'mysql+mysqlconnector://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_TRANSACIONAL_NAME}'
+    f'mysql+mysqlconnector://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_TRANSACIONAL_NAME}',
+    connect_args={'allow_local_infile': True},  # necessário para o modo de carga 'infile'
+    pool_size=max(5, TRABALHADORES)
 )
 engine_dw = create_engine(
-    f'mysql+mysqlconnector://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_DW_NAME}'
+    f'mysql+mysqlconnector://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_DW_NAME}',
+    connect_args={'allow_local_infile': True},
+    pool_size=max(5, TRABALHADORES)
 )
 
-try:
-    print("=== ETL Iniciado ===")
+# Modo de execução:
+#   - 'completo': carga inicial, com as tabelas vazias (comportamento original).
+#   - 'incremental': compara as fontes com a última execução e aplica só as linhas novas, alteradas ou removidas.
+#     Se ainda não houver nenhuma execução registrada, faz a carga completa.
+MODO_ETL = os.getenv('ETL_MODO', 'completo')
 
-    # Extração (Extract) e transformação (Transform): CSV -> Banco Transacional
-    print("Carregando dados no Transacional...")
+# Arquivos de origem (a pasta pode ser trocada, por exemplo pelos dados sintéticos do benchmark em etl/benchmark.py)
+DIR_DADOS = os.getenv('ETL_DIR_DADOS', 'data')
+FONTES = {
+    '001': os.path.join(DIR_DADOS, '001.csv'),
+    '002': os.path.join(DIR_DADOS, '002.csv'),
+    '003': os.path.join(DIR_DADOS, '003.csv'),
+    '004': os.path.join(DIR_DADOS, '004.csv'),
+    '005': os.path.join(DIR_DADOS, '005.csv'),
+    '006': os.path.join(DIR_DADOS, '006.csv'),
+    '007': os.path.join(DIR_DADOS, '007.csv'),
+}
 
-    # CDA com tratamento de datas inválidas (fonte: /data/001.csv)
-    df_cda = pd.read_csv('data/001.csv')
-    df_cda = df_cda.drop_duplicates(subset=['numCDA'], keep='first')
-    if 'datCadastramento' in df_cda.columns:
-        df_cda['datCadastramento'] = pd.to_datetime(df_cda['datCadastramento'], errors='coerce')
-        mask = df_cda['datCadastramento'].dt.year < 1980
-        df_cda.loc[mask, 'datCadastramento'] = pd.to_datetime('1980-01-01 00:00:00.000')
+# Chave de negócio de cada tabela (usada no modo incremental para comparar e aplicar as diferenças)
+CHAVES = {
+    'cda': ['numCDA'],
+    'naturezas_divida': ['idNaturezaDivida'],
+    'situacoes_cda': ['codSituacaoCDA'],
+    'probabilidades': ['numCDA'],
+    'cda_devedores': ['numCDA', 'idPessoa'],
+    'devedores_pf': ['idPessoa'],
+    'devedores_pj': ['idPessoa'],
+    'dim_naturezas': ['id_natureza'],
+    'dim_situacoes': ['id_situacao'],
+    'dim_devedores': ['id_devedor'],
+    'fatos_cdas': ['num_cda'],
+    'jun_cdas_devedores': ['fk_cda', 'fk_devedor'],
+}
+
+# Fontes das quais cada tabela depende. Uma tabela só é reprocessada no modo incremental se alguma delas mudou.
+# (cda depende de 002 por causa da normalização dos ids de natureza; a junção é filtrada pelos fatos e devedores)
+DEPENDENCIAS = {
+    'cda': {'001', '002'},
+    'naturezas_divida': {'002'},
+    'situacoes_cda': {'003'},
+    'probabilidades': {'004'},
+    'cda_devedores': {'005'},
+    'devedores_pf': {'006'},
+    'devedores_pj': {'007'},
+    'dim_naturezas': {'002'},
+    'dim_situacoes': {'003'},
+    'dim_devedores': {'006', '007'},
+    'fatos_cdas': {'001', '002', '003', '004'},
+    'jun_cdas_devedores': {'001', '002', '004', '005', '006', '007'},
+}
+
+# Tabelas do transacional lidas de volta para montar o DW (no handoff 'banco')
+TABELAS_TRANSACIONAIS = ['naturezas_divida', 'situacoes_cda', 'devedores_pf', 'devedores_pj',
+                         'cda', 'probabilidades', 'cda_devedores']
+
+# Estágio de extração que produz cada tabela do transacional (na ordem de carga original)
+ORIGEM_TRANSACIONAL = {
+    'cda': 'extrair_cda',
+    'naturezas_divida': 'extrair_naturezas',
+    'situacoes_cda': 'extrair_situacoes',
+    'probabilidades': 'extrair_probabilidades',
+    'cda_devedores': 'extrair_cda_devedores',
+    'devedores_pf': 'extrair_devedores_pf',
+    'devedores_pj': 'extrair_devedores_pj',
+}
+
+# Estágios dos quais cada tabela do DW depende. As dimensões só dependem da sua tabela no transacional;
+# o caminho crítico é cda -> fatos_cdas -> jun_cdas_devedores.
+ESTAGIOS_DW = {
+    'dim_naturezas': ['naturezas_divida'],
+    'dim_situacoes': ['situacoes_cda'],
+    'dim_devedores': ['devedores_pf', 'devedores_pj'],
+    'fatos_cdas': ['cda', 'probabilidades', 'naturezas_divida', 'situacoes_cda'],
+    'jun_cdas_devedores': ['cda_devedores', 'fatos_cdas', 'dim_devedores'],
+}
+
+# Mesmo grafo com o DW alimentado em memória: as tabelas do DW dependem das extrações, e não das cargas no transacional
+ESTAGIOS_DW_MEMORIA = {
+    'dim_naturezas': ['extrair_naturezas'],
+    'dim_situacoes': ['extrair_situacoes'],
+    'dim_devedores': ['extrair_devedores_pf', 'extrair_devedores_pj'],
+    'fatos_cdas': ['extrair_cda', 'extrair_probabilidades', 'extrair_naturezas', 'extrair_situacoes'],
+    'jun_cdas_devedores': ['extrair_cda_devedores', 'fatos_cdas', 'dim_devedores'],
+}
+
+# Tabelas do transacional cujas linhas são a entrada de cada tabela do DW no relatório da execução
+# (linhas de entrada - descartes = linhas gravadas)
+ENTRADAS_DW = {
+    'dim_naturezas': ['naturezas_divida'],
+    'dim_situacoes': ['situacoes_cda'],
+    'dim_devedores': ['devedores_pf', 'devedores_pj'],
+    'fatos_cdas': ['cda'],
+    'jun_cdas_devedores': ['cda_devedores'],
+}
 
+# Raiz do projeto: o ETL reutiliza o código da API para pré-renderizar os payloads dos endpoints de resumo
+RAIZ_PROJETO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Estatísticas de cada carga (linhas/s por tabela), impressas no final da execução
+# (os passos medidos para o relatório da execução ficam em etl/relatorio.py)
+estatisticas = []
+
+
+# Extração (Extract) e transformação (Transform): CSV -> tabelas do Transacional.
+# Cada fonte tem sua própria função (um estágio do pipeline), que devolve {tabela: DataFrame}.
+
+def extrair_naturezas():
     # Naturezas da dívida (fonte: /data/002.csv)  mantém apenas colunas do schema
-    df_nat_raw = pd.read_csv('data/002.csv')[['idNaturezadivida', 'nomnaturezadivida']]
+    df_nat_raw = leitura.ler_fonte(FONTES['002'], '002')
     df_nat_raw.columns = ['idNaturezaDivida', 'nomNaturezaDivida']  # padroniza nomes como no banco
 
     # Normaliza IDs duplicados de naturezas
     df_nat_unique = df_nat_raw.drop_duplicates(subset=['nomNaturezaDivida']).reset_index(drop=True)
+    relatorio.descartar('natureza_duplicada', len(df_nat_raw) - len(df_nat_unique))
     df_nat_unique['idNaturezaDivida'] = range(1, len(df_nat_unique) + 1)
     mapa_ids_natureza = pd.merge(
         df_nat_raw, df_nat_unique, on='nomNaturezaDivida', suffixes=('_old', '')
     ).set_index('idNaturezaDivida_old')['idNaturezaDivida'].to_dict()
 
+    return {'naturezas_divida': df_nat_unique, 'mapa_ids_natureza': mapa_ids_natureza}
+
+
+def extrair_cda(naturezas):
+    # CDA com tratamento de datas inválidas (fonte: /data/001.csv)
+    df_cda = leitura.ler_fonte(FONTES['001'], '001', unicos='numCDA')
+    if 'datCadastramento' in df_cda.columns:
+        mask = df_cda['datCadastramento'].dt.year < 1980
+        relatorio.corrigir('data_cadastramento_anterior_1980', mask.sum())
+        df_cda.loc[mask, 'datCadastramento'] = pd.to_datetime('1980-01-01 00:00:00.000')
+
     # Aplica o mapeamento (ids diferentes que levavam para o mesmo id agora SÃO o mesmo ID)
     if 'idNaturezaDivida' in df_cda.columns:
-        df_cda['idNaturezaDivida'] = df_cda['idNaturezaDivida'].map(mapa_ids_natureza)
+        df_cda['idNaturezaDivida'] = df_cda['idNaturezaDivida'].map(naturezas['mapa_ids_natureza'])
 
-    df_cda.to_sql('cda', con=engine_transacional, if_exists='append', index=False)
-    df_nat_unique.to_sql('naturezas_divida', con=engine_transacional, if_exists='append', index=False)
+    return {'cda': df_cda}
 
+
+def extrair_situacoes():
     # Situações das CDAs (fonte: /data/003.csv), remove duplicados
-    df_sit_raw = pd.read_csv('data/003.csv')[['codSituacaoCDA', 'nomSituacaoCDA', 'tipoSituacao']]
+    df_sit_raw = leitura.ler_fonte(FONTES['003'], '003')
+    return {'situacoes_cda': df_sit_raw}
 
-    df_sit_raw.to_sql('situacoes_cda', con=engine_transacional, if_exists='append', index=False)
 
+def extrair_probabilidades():
     # Probabilidades (fonte: /data/004.csv), remove coluna desnecessária e duplicados
-    df_prob_raw = pd.read_csv('data/004.csv')[['numCDA', 'probRecuperacao']]
-    df_prob_raw = df_prob_raw.drop_duplicates(subset=['numCDA'], keep='first')
-    df_prob_raw.to_sql('probabilidades', con=engine_transacional, if_exists='append', index=False)
+    df_prob_raw = leitura.ler_fonte(FONTES['004'], '004', unicos='numCDA')
+    return {'probabilidades': df_prob_raw}
+
 
+def extrair_cda_devedores():
     # CDA_Devedores (fonte: /data/005.csv)  mantém apenas colunas do schema
-    df_cdadev = pd.read_csv('data/005.csv')[['numCDA', 'idPessoa']]
-    df_cdadev.to_sql('cda_devedores', con=engine_transacional, if_exists='append', index=False)
+    df_cdadev = leitura.ler_fonte(FONTES['005'], '005')
+    return {'cda_devedores': df_cdadev}
+
 
+def extrair_devedores_pf():
     # Devedores Pessoa Física (fonte: /data/006.csv)  remove CPFs duplicados e padroniza colunas
-    df_pf = pd.read_csv('data/006.csv')[['idpessoa', 'descNome', 'numcpf']]
-    df_pf = df_pf.drop_duplicates(subset=['idpessoa'], keep='first')  # evita duplicar PK no transacional
-    indices_duplicados = df_pf.duplicated(subset=['numcpf'], keep='first') & df_pf['numcpf'].notna()
-    df_pf.loc[indices_duplicados, 'numcpf'] = None
+    # (sem duplicar a PK no transacional; CPFs repetidos viram nulo, mantendo o primeiro)
+    df_pf = leitura.ler_fonte(FONTES['006'], '006', unicos='idpessoa', anular_repetidos='numcpf')
     df_pf.columns = ['idPessoa', 'descNome', 'numCPF']  # padroniza nomes para o schema
-    df_pf.to_sql('devedores_pf', con=engine_transacional, if_exists='append', index=False)
+    return {'devedores_pf': df_pf}
 
+
+def extrair_devedores_pj():
     # Devedores Pessoa Jurídica (fonte: /data/007.csv)  remove CNPJs duplicados e padroniza colunas
-    df_pj = pd.read_csv('data/007.csv')[['idpessoa', 'descNome', 'numCNPJ']]
-    df_pj = df_pj.drop_duplicates(subset=['idpessoa'], keep='first')  # evita duplicar PK no transacional
-    indices_duplicados = df_pj.duplicated(subset=['numCNPJ'], keep='first') & df_pj['numCNPJ'].notna()
-    df_pj.loc[indices_duplicados, 'numCNPJ'] = None
+    # (sem duplicar a PK no transacional; CNPJs repetidos viram nulo, mantendo o primeiro)
+    df_pj = leitura.ler_fonte(FONTES['007'], '007', unicos='idpessoa', anular_repetidos='numCNPJ')
     df_pj.columns = ['idPessoa', 'descNome', 'numCNPJ']  # padroniza nomes para o schema
-    df_pj.to_sql('devedores_pj', con=engine_transacional, if_exists='append', index=False)
+    return {'devedores_pj': df_pj}
 
 
-    print("Dados carregados no Transacional.")
+def extrair_transacional():
+    #Versão sequencial da extração (usada pelo modo incremental), na ordem de carga original
+    naturezas = extrair_naturezas()
+    return {
+        **extrair_cda(naturezas),
+        'naturezas_divida': naturezas['naturezas_divida'],
+        **extrair_situacoes(),
+        **extrair_probabilidades(),
+        **extrair_cda_devedores(),
+        **extrair_devedores_pf(),
+        **extrair_devedores_pj(),
+    }
 
-    # Transformação (Transform) + Carga (Load): Transacional -> DW
-    print("Transformando dados e carregando no DW...")
 
-    # Naturezas
-    df_nat = pd.read_sql("SELECT * FROM naturezas_divida", engine_transacional).rename(
+def ler_transacional(tabelas=TABELAS_TRANSACIONAIS):
+    with relatorio.fase('releitura'):
+        return {tabela: pd.read_sql(f"SELECT * FROM {tabela}", engine_transacional) for tabela in tabelas}
+
+
+def transformar_naturezas(transacional):
+    # Naturezas, com o código do grupo de tributo (regras em etl/classificacao.py)
+    df_nat = transacional['naturezas_divida'].rename(
         columns={'idNaturezaDivida': 'id_natureza', 'nomNaturezaDivida': 'descricao_natureza'}
     )
-    df_nat.to_sql('dim_naturezas', con=engine_dw, if_exists='append', index=False)
+    df_nat['cod_tributo'] = classificacao.codificar(df_nat['descricao_natureza'], classificacao.codigo_tributo)
+    return df_nat
+
 
-    # Situações
-    df_sit = pd.read_sql("SELECT * FROM situacoes_cda", engine_transacional).rename(
+def transformar_situacoes(transacional):
+    # Situações, com o código do grupo de situação (em cobrança, cancelada, quitada)
+    df_sit = transacional['situacoes_cda'].rename(
         columns={'codSituacaoCDA': 'id_situacao', 'nomSituacaoCDA': 'descricao_situacao', 'tipoSituacao': 'tipo_situacao'}
     ).drop_duplicates(subset=['id_situacao'])
-    df_sit.to_sql('dim_situacoes', con=engine_dw, if_exists='append', index=False)
+    df_sit['cod_grupo_situacao'] = classificacao.codificar(df_sit['descricao_situacao'], classificacao.codigo_grupo_situacao)
+    return df_sit
+
 
+def transformar_devedores(transacional):
     # Devedores PF + PJ
-    df_pf = pd.read_sql("SELECT * FROM devedores_pf", engine_transacional).rename(
+    df_pf = transacional['devedores_pf'].rename(
         columns={'idPessoa': 'id_devedor', 'descNome': 'nome', 'numCPF': 'cpf_cnpj'}
     )
     df_pf['tipo_pessoa'] = 'PF'
-    df_pj = pd.read_sql("SELECT * FROM devedores_pj", engine_transacional).rename(
+    df_pj = transacional['devedores_pj'].rename(
         columns={'idPessoa': 'id_devedor', 'descNome': 'nome', 'numCNPJ': 'cpf_cnpj'}
     )
     df_pj['tipo_pessoa'] = 'PJ'
-    df_dev = pd.concat([df_pf, df_pj], ignore_index=True).drop_duplicates(subset=['id_devedor'])
-    df_dev.to_sql('dim_devedores', con=engine_dw, if_exists='append', index=False)
+    df_dev = pd.concat([df_pf, df_pj], ignore_index=True)
+    df_unicos = df_dev.drop_duplicates(subset=['id_devedor'])
+    relatorio.descartar('devedor_duplicado', len(df_dev) - len(df_unicos))
+    return df_unicos
+
+
+def transformar_dimensoes(transacional):
+    return {
+        'dim_naturezas': transformar_naturezas(transacional),
+        'dim_situacoes': transformar_situacoes(transacional),
+        'dim_devedores': transformar_devedores(transacional),
+    }
+
 
+def transformar_fatos(transacional):
     # Fatos CDAs
-    df_cda = pd.read_sql("SELECT * FROM cda", engine_transacional)
-    df_prob = pd.read_sql("SELECT * FROM probabilidades", engine_transacional)
-    df_fatos = pd.merge(df_cda, df_prob, on='numCDA', how='left').rename(columns={
+    df_fatos = pd.merge(transacional['cda'], transacional['probabilidades'], on='numCDA', how='left').rename(columns={
     'numCDA': 'num_cda',
     'anoInscricao': 'ano_inscricao',
     'datCadastramento': 'data_cadastramento',
@@ -130,26 +296,301 @@ try:
      'valor_saldo', 'prob_recuperacao', 'fk_natureza', 'fk_situacao']
     ] #Remove a coluna codFaseCobrança, pois nao é útil para o DW
 
-    df_fatos = df_fatos[df_fatos['valor_saldo'] >= 0]
-    df_fatos.to_sql('fatos_cdas', con=engine_dw, if_exists='append', index=False)
+    # Copia os códigos de tributo e de grupo de situação das dimensões, calculados uma vez por natureza/situação
+    tributos = transformar_naturezas(transacional).set_index('id_natureza')['cod_tributo']
+    grupos = transformar_situacoes(transacional).set_index('id_situacao')['cod_grupo_situacao']
+    df_fatos = df_fatos.assign(
+        cod_tributo=df_fatos['fk_natureza'].map(tributos).astype('Int8'),
+        cod_grupo_situacao=df_fatos['fk_situacao'].map(grupos).astype('Int8'),
+    )
+
+    saldo_valido = df_fatos['valor_saldo'] >= 0
+    relatorio.descartar('saldo_negativo', (~saldo_valido).sum())
+    return df_fatos[saldo_valido]
+
 
+def transformar_juncao(transacional, chaves_cdas, chaves_devedores):
     # Junção CDA - Devedores
-    df_junc = pd.read_sql("SELECT * FROM cda_devedores", engine_transacional).rename(
+    df_vinculos = transacional['cda_devedores'].rename(
         columns={'numCDA': 'fk_cda', 'idPessoa': 'fk_devedor'}
-    ).drop_duplicates(subset=['fk_cda', 'fk_devedor'])
-    fatos_cd_keys = pd.read_sql("SELECT num_cda FROM fatos_cdas", engine_dw)
-    dev_keys = pd.read_sql("SELECT id_devedor FROM dim_devedores", engine_dw)
+    )
+    df_junc = df_vinculos.drop_duplicates(subset=['fk_cda', 'fk_devedor'])
+    relatorio.descartar('vinculo_duplicado', len(df_vinculos) - len(df_junc))
     #Filtra quanto fk_cda e fk_devedor não levam a nenhum CDA ou devedor na tabela fato.
     #(provavelmente aconteceu por conta de alguma filtragem anterior, como remover CDAs
     #com saldo negativo ou duplicados
-    df_junc = df_junc[
-    df_junc['fk_cda'].isin(fatos_cd_keys['num_cda']) &
-    df_junc['fk_devedor'].isin(dev_keys['id_devedor'])
+    com_cda = df_junc['fk_cda'].isin(chaves_cdas)
+    com_devedor = df_junc['fk_devedor'].isin(chaves_devedores)
+    relatorio.descartar('vinculo_sem_cda', (~com_cda).sum())
+    relatorio.descartar('vinculo_sem_devedor', (com_cda & ~com_devedor).sum())
+    return df_junc[com_cda & com_devedor]
+
+
+def ler_chaves_dw(nome_tabela=lambda tabela: tabela):
+    with relatorio.fase('releitura'):
+        fatos_cd_keys = pd.read_sql(f"SELECT num_cda FROM {nome_tabela('fatos_cdas')}", engine_dw)
+        dev_keys = pd.read_sql(f"SELECT id_devedor FROM {nome_tabela('dim_devedores')}", engine_dw)
+    return fatos_cd_keys['num_cda'], dev_keys['id_devedor']
+
+
+# Estágios da carga completa. Cada estágio de carga tem o nome da tabela que grava e devolve
+# {tabela: DataFrame gravado, 'estatisticas': [...]}, para que o processo principal junte as estatísticas
+# (funciona tanto com threads quanto com processos).
+
+def carregar_transacional(tabela, extraido):
+    df = extraido[tabela]
+    relatorio.acumular('linhas_entrada', len(df))
+    # A carga completa substitui o conteúdo da tabela: numa recarga, as linhas da execução anterior não podem
+    # ficar (no modo 'infile', duplicadas eram ignoradas e as antigas ficavam) nem barrar a carga (chave duplicada no 'lote')
+    return {tabela: df, 'estatisticas': [carregar(df, tabela, engine_transacional, substituir=True)]}
+
+
+def carregar_dw(tabela, *dependencias):
+    # Transformação (Transform) + Carga (Load): Transacional -> DW
+    if HANDOFF == 'memoria':
+        # Os resultados das dependências já trazem os DataFrames tratados ({tabela: DataFrame})
+        origem = {}
+        for resultado in dependencias:
+            origem.update(resultado)
+    else:
+        # Lê de volta do transacional apenas as tabelas de origem desta tabela do DW
+        origem = ler_transacional([d for d in ESTAGIOS_DW[tabela] if d in TABELAS_TRANSACIONAIS])
+    relatorio.acumular('linhas_entrada', sum(len(origem[entrada]) for entrada in ENTRADAS_DW[tabela]))
+
+    if tabela == 'jun_cdas_devedores':
+        # As chaves dos fatos e devedores vêm dos estágios anteriores (memória) ou do próprio DW (banco, já nas sombras)
+        if HANDOFF == 'memoria':
+            chaves = origem['fatos_cdas']['num_cda'], origem['dim_devedores']['id_devedor']
+        else:
+            chaves = ler_chaves_dw(publicacao.nome_carga)
+        df = transformar_juncao(origem, *chaves)
+    else:
+        df = TRANSFORMACOES_DW[tabela](origem)
+    # Na publicação 'sombra', a carga grava na cópia <tabela>_novo, trocada pela tabela atual no estágio publicar_dw.
+    # Na 'direta', grava na tabela atual, substituindo o conteúdo dela (como no transacional)
+    return {tabela: df, 'estatisticas': [carregar(df, publicacao.nome_carga(tabela), engine_dw, substituir=True)]}
+
+
+def preparar_dw():
+    # Cria as sombras vazias das tabelas do DW e dos resumos, onde a carga completa grava enquanto a API lê as atuais
+    publicacao.preparar_sombras(engine_dw, list(ESTAGIOS_DW) + list(resumos.RESUMOS))
+    return {}
+
+
+def publicar_dw(*dependencias):
+    # Valida as sombras (linhas carregadas e chaves estrangeiras) e as troca pelas tabelas atuais de uma vez,
+    # junto com as sombras dos resumos e as marcas de atualização e a geração do DW
+    esperadas = {tabela: len(resultado[tabela]) for resultado in dependencias for tabela in resultado if tabela in ESTAGIOS_DW}
+    linhas_resumos = {e['tabela']: e['linhas'] for resultado in dependencias for e in resultado.get('resumos', [])}
+    estatistica = publicacao.publicar(engine_dw, {**esperadas, **linhas_resumos}, list(linhas_resumos))
+    return {'estatisticas': [estatistica] if estatistica else []}
+
+
+def registrar_estado(tabela, resultado):
+    # No modo incremental, a carga completa já registra o hash de cada linha para as próximas execuções
+    return {'estatisticas': [incremental.gravar_hashes(engine_transacional, tabela, resultado[tabela], CHAVES[tabela])]}
+
+
+def atualizar_resumos(*dependencias):
+    # Recalcula as tabelas de resumo usadas pelos endpoints /resumo/* depois que os fatos e dimensões foram carregados.
+    # Na publicação 'sombra', calcula a partir das sombras do DW nas sombras dos resumos, publicadas em publicar_dw;
+    # na 'direta', no lugar, marcando os dados e cada resumo como atualizados
+    if publicacao.MODO_PUBLICACAO == 'sombra':
+        estatisticas = resumos.calcular_resumos(engine_dw, publicacao.nome_carga)
+        return {'resumos': estatisticas, 'estatisticas': estatisticas}
+    return {'estatisticas': resumos.atualizar_resumos(engine_dw)}
+
+
+def pre_renderizar_payloads(*dependencias):
+    # Grava as respostas já serializadas dos endpoints /resumo/* para a nova geração do DW, usando o mesmo código
+    # (consultas e modelos) da API. Importado aqui para o resto do ETL não depender do código da API.
+    if RAIZ_PROJETO not in sys.path:
+        sys.path.append(RAIZ_PROJETO)
+    from api.main import SessionLocal, pre_renderizar_resumos
+
+    inicio = time.perf_counter()
+    with SessionLocal() as db:
+        quantidade = pre_renderizar_resumos(db)
+    print(f"  payloads_resumo: {quantidade} rotas pré-renderizadas em {time.perf_counter() - inicio:.2f}s")
+    return {}
+
+
+
+def gravar_snapshot(*dependencias):
+    # Grava o snapshot colunar da nova geração do DW, mapeado em memória pelas réplicas da API (ver etl/snapshot.py)
+    estatistica = snapshot.gravar_snapshot(engine_dw)
+    return {'estatisticas': [estatistica] if estatistica else []}
+
+
+TRANSFORMACOES_DW = {
+    'dim_naturezas': transformar_naturezas,
+    'dim_situacoes': transformar_situacoes,
+    'dim_devedores': transformar_devedores,
+    'fatos_cdas': transformar_fatos,
+}
+
+
+def montar_estagios_completo():
+    estagios = [
+        Estagio('extrair_naturezas', extrair_naturezas),
+        Estagio('extrair_cda', extrair_cda, ['extrair_naturezas']),
+        Estagio('extrair_situacoes', extrair_situacoes),
+        Estagio('extrair_probabilidades', extrair_probabilidades),
+        Estagio('extrair_cda_devedores', extrair_cda_devedores),
+        Estagio('extrair_devedores_pf', extrair_devedores_pf),
+        Estagio('extrair_devedores_pj', extrair_devedores_pj),
     ]
-    df_junc.to_sql('jun_cdas_devedores', con=engine_dw, if_exists='append', index=False)
+    for tabela, origem in ORIGEM_TRANSACIONAL.items():
+        estagios.append(Estagio(tabela, partial(carregar_transacional, tabela), [origem]))
+    estagios.append(Estagio('preparar_dw', preparar_dw))
+    for tabela, dependencias in (ESTAGIOS_DW_MEMORIA if HANDOFF == 'memoria' else ESTAGIOS_DW).items():
+        estagios.append(Estagio(tabela, partial(carregar_dw, tabela), dependencias + ['preparar_dw']))
+    estagios.append(Estagio('resumos', atualizar_resumos, list(ESTAGIOS_DW)))
+    estagios.append(Estagio('publicar_dw', publicar_dw, list(ESTAGIOS_DW) + ['resumos']))
+    estagios.append(Estagio('payloads', pre_renderizar_payloads, ['publicar_dw']))
+    estagios.append(Estagio('snapshot', gravar_snapshot, ['publicar_dw']))
+    if MODO_ETL == 'incremental':
+        for tabela in CHAVES:
+            estagios.append(Estagio(f'estado_{tabela}', partial(registrar_estado, tabela), [tabela]))
+    return estagios
+
+
+def _reiniciar_conexoes():
+    #Com o pool de processos, cada processo filho precisa abrir as suas próprias conexões
+    #(as herdadas do processo pai não podem ser compartilhadas).
+    engine_transacional.dispose(close=False)
+    engine_dw.dispose(close=False)
+
+
+def executar_completo():
+    print(f"Executando a carga completa em estágios ({TRABALHADORES} trabalhadores)...")
+    # Cada estágio é medido como um passo do relatório da execução (ver etl/relatorio.py)
+    estagios = montar_estagios_completo()
+    for estagio in estagios:
+        estagio.funcao = partial(relatorio.executar_estagio, estagio.nome, estagio.funcao)
+    resultados = executar_estagios(
+        estagios, TRABALHADORES, TIPO_POOL,
+        inicializador=_reiniciar_conexoes if TIPO_POOL == 'process' else None
+    )
+    for resultado in resultados.values():
+        estatisticas.extend(resultado.get('estatisticas', []))
+        # Com o pool de processos, os passos medidos nos processos filhos só chegam pelos resultados
+        if TIPO_POOL == 'process':
+            relatorio.adicionar(resultado.get('relatorio', []))
+
+
+def executar_incremental(alteradas):
+    print(f"Fontes alteradas: {', '.join(sorted(alteradas))}")
+
+    def afetada(tabela):
+        return bool(DEPENDENCIAS[tabela] & alteradas)
+
+    def aplicar(df, tabela, engine_destino):
+        # Cada tabela afetada é um passo do relatório da execução
+        with relatorio.medir(tabela):
+            relatorio.acumular('linhas_entrada', len(df))
+            estatisticas.extend(incremental.aplicar_diferenca(
+                df, tabela, CHAVES[tabela], engine_destino, engine_transacional
+            ))
+
+    print("Aplicando diferenças no Transacional...")
+    with relatorio.medir('extrair_transacional') as passo:
+        transacional = extrair_transacional()
+        passo['linhas_saida'] = relatorio.linhas_produzidas(transacional)
+    for tabela, df in transacional.items():
+        if afetada(tabela):
+            aplicar(df, tabela, engine_transacional)
+
+    print("Aplicando diferenças no DW...")
+    with relatorio.medir('transformar_dw') as passo:
+        origem = transacional if HANDOFF == 'memoria' else ler_transacional()
+        tabelas_dw = transformar_dimensoes(origem)
+        tabelas_dw['fatos_cdas'] = transformar_fatos(origem)
+        passo['linhas_saida'] = relatorio.linhas_produzidas(tabelas_dw)
+    for tabela, df in tabelas_dw.items():
+        if afetada(tabela):
+            aplicar(df, tabela, engine_dw)
+    # A junção depende dos fatos e devedores já atualizados no DW
+    if afetada('jun_cdas_devedores'):
+        with relatorio.medir('transformar_jun_cdas_devedores') as passo:
+            if HANDOFF == 'memoria':
+                chaves = tabelas_dw['fatos_cdas']['num_cda'], tabelas_dw['dim_devedores']['id_devedor']
+            else:
+                chaves = ler_chaves_dw()
+            df_junc = transformar_juncao(origem, *chaves)
+            passo['linhas_saida'] = len(df_junc)
+        aplicar(df_junc, 'jun_cdas_devedores', engine_dw)
+
+    if any(afetada(tabela) for tabela in ESTAGIOS_DW):
+        print("Atualizando as tabelas de resumo do DW...")
+        atualizar_derivados()
+
+
+def atualizar_derivados(recalcular_resumos=True):
+    # Resumos, payloads e snapshot da nova geração do DW, cada um como um passo do relatório da execução
+    if recalcular_resumos:
+        with relatorio.medir('resumos'):
+            estatisticas.extend(resumos.atualizar_resumos(engine_dw))
+    with relatorio.medir('payloads'):
+        pre_renderizar_payloads()
+    with relatorio.medir('snapshot'):
+        estatisticas.extend(gravar_snapshot()['estatisticas'])
+
+
+def reverter_dw():
+    print("Revertendo o DW para a publicação anterior...")
+    with relatorio.medir('reverter_dw'):
+        # Os resumos voltam junto com os dados (foram publicados no mesmo RENAME TABLE)
+        publicacao.reverter(engine_dw, list(ESTAGIOS_DW) + list(resumos.RESUMOS), list(resumos.RESUMOS))
+        # O estado do modo incremental descreve o DW que saiu: a próxima execução incremental regrava o DW a partir das fontes
+        incremental.invalidar_estado(engine_transacional, list(ESTAGIOS_DW))
+    atualizar_derivados(recalcular_resumos=False)
+
+
+def main():
+    # O relatório da execução (etl/relatorio.py) é gravado no final, inclusive quando o ETL falha
+    inicio = datetime.now(timezone.utc)
+    inicio_contagem = time.perf_counter()
+    modo, status, erro = MODO_ETL, 'sucesso', None
+    try:
+        print("=== ETL Iniciado ===")
+
+        if '--reverter' in sys.argv[1:]:
+            modo = 'reverter'
+            reverter_dw()
+            imprimir_resumo(estatisticas)
+            print("=== ETL concluído com sucesso! ===")
+            return
+
+        impressoes = {fonte: incremental.impressao_digital(caminho) for fonte, caminho in FONTES.items()}
+        marcas = incremental.ler_marcas(engine_transacional) if MODO_ETL == 'incremental' else {}
+        alteradas = {fonte for fonte, impressao in impressoes.items() if marcas.get(fonte) != impressao['hash_arquivo']}
+
+        if MODO_ETL == 'incremental' and marcas:
+            if not alteradas:
+                status = 'sem_alteracoes'
+                print("Nenhuma fonte foi alterada desde a última execução. Nada a fazer.")
+                print("=== ETL concluído com sucesso! ===")
+                return
+            executar_incremental(alteradas)
+        else:
+            modo = 'completo'
+            executar_completo()
+
+        # As marcas d'água só são gravadas no final, depois que tudo foi carregado com sucesso
+        incremental.gravar_marcas(engine_transacional, impressoes)
+
+        imprimir_resumo(estatisticas)
+        print("=== ETL concluído com sucesso! ===")
+
+    except Exception as e:
+        status, erro = 'erro', str(e)
+        print(f"Erro no ETL: {e}")
+        sys.exit(1)
+
+    finally:
+        relatorio.concluir(modo, status, inicio, time.perf_counter() - inicio_contagem, estatisticas, erro)
 
-    print("=== ETL concluído com sucesso! ===")
 
-except Exception as e:
-    print(f"Erro no ETL: {e}")
-    sys.exit(1)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
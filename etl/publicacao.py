@@ -0,0 +1,178 @@
+import os
+import time
+
+from sqlalchemy import text
+
+import resumos
+from carga import checagens_adiadas
+
+# Publicação do DW sem indisponibilidade (blue/green).
+# Na carga completa, as tabelas do DW não são gravadas no lugar das que a API está lendo: cada uma ganha uma cópia
+# "sombra" (<tabela>_novo, criada com CREATE TABLE ... LIKE e com as mesmas chaves estrangeiras, apontando para
+# as outras sombras), que é carregada em paralelo enquanto a API continua respondendo com os dados atuais.
+# Depois da carga, as sombras são validadas (quantidade de linhas e chaves estrangeiras sem órfãos) e trocadas pelas
+# tabelas atuais num único RENAME TABLE, que é atômico: quem consulta o DW vê os dados antigos ou os novos, nunca
+# uma mistura. As tabelas substituídas ficam como <tabela>_antigo até a próxima publicação, e reverter é só trocar
+# de novo (python -u etl/pipeline.py --reverter).
+# As chaves estrangeiras acompanham a tabela renomeada no InnoDB: as antigas continuam apontando para as antigas.
+# As tabelas de resumo (etl/resumos.py) também são calculadas em sombras, a partir das sombras do DW, e entram no
+# mesmo RENAME TABLE. As tabelas de controle lidas pela API (as marcas de atualização e a geração do DW) também:
+# as cópias já marcam os dados e os resumos como atualizados e trazem a geração seguinte, então os dados, os resumos e
+# a geração que versiona os caches da API mudam juntos. Um RENAME é DDL (não entra numa transação), por isso as
+# marcas são trocadas como tabelas, e não gravadas depois da troca.
+
+# 'sombra' (padrão) carrega nas cópias e troca no final; 'direta' grava nas tabelas atuais (comportamento original)
+MODO_PUBLICACAO = os.getenv('ETL_PUBLICACAO_DW', 'sombra')
+# Redução máxima de linhas aceita em relação à tabela atual (0.5 = recusa publicar se mais da metade sumir)
+QUEDA_MAXIMA = float(os.getenv('ETL_QUEDA_MAXIMA_DW', '0.5'))
+
+SUFIXO_NOVO = '_novo'
+SUFIXO_ANTIGO = '_antigo'
+SUFIXO_TROCA = '_troca'
+
+TABELAS_CONTROLE = (resumos.TABELA_ATUALIZACOES, resumos.TABELA_GERACAO)
+
+
+def _nome(identificador):
+    return f"`{identificador}`"
+
+
+def nome_carga(tabela):
+    """Tabela onde a carga completa grava os dados de uma tabela do DW."""
+    return tabela + SUFIXO_NOVO if MODO_PUBLICACAO == 'sombra' else tabela
+
+
+def _chaves_estrangeiras(conexao, tabela):
+    #[(nome, [colunas], tabela referenciada, [colunas referenciadas])] da tabela, lidas do information_schema
+    linhas = conexao.execute(text("""
+        SELECT CONSTRAINT_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME
+        FROM information_schema.KEY_COLUMN_USAGE
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :tabela AND REFERENCED_TABLE_NAME IS NOT NULL
+        ORDER BY CONSTRAINT_NAME, ORDINAL_POSITION
+    """), {'tabela': tabela}).fetchall()
+    chaves = {}
+    for restricao, coluna, referenciada, coluna_referenciada in linhas:
+        chave = chaves.setdefault(restricao, (restricao, [], referenciada, []))
+        chave[1].append(coluna)
+        chave[3].append(coluna_referenciada)
+    return list(chaves.values())
+
+
+def _contar(conexao, tabela):
+    return conexao.execute(text(f"SELECT COUNT(*) FROM {_nome(tabela)}")).scalar()
+
+
+def preparar_sombras(engine, tabelas):
+    """Recria as sombras vazias das tabelas, com os índices e as chaves estrangeiras das tabelas atuais."""
+    if MODO_PUBLICACAO != 'sombra':
+        return
+    with engine.begin() as conexao, checagens_adiadas(conexao):
+        #Sombras que sobraram de uma carga que falhou no meio são descartadas
+        conexao.execute(text(f"DROP TABLE IF EXISTS {', '.join(_nome(t + SUFIXO_NOVO) for t in tabelas)}"))
+        for tabela in tabelas:
+            conexao.execute(text(f"CREATE TABLE {_nome(tabela + SUFIXO_NOVO)} LIKE {_nome(tabela)}"))
+        #CREATE TABLE ... LIKE não copia as chaves estrangeiras. Elas são recriadas sem nome: o InnoDB gera
+        #<tabela>_novo_ibfk_N, que o RENAME TABLE transforma em <tabela>_ibfk_N.
+        for tabela in tabelas:
+            for _, colunas, referenciada, colunas_referenciadas in _chaves_estrangeiras(conexao, tabela):
+                if referenciada in tabelas:
+                    referenciada += SUFIXO_NOVO
+                conexao.execute(text(
+                    f"ALTER TABLE {_nome(tabela + SUFIXO_NOVO)} ADD FOREIGN KEY ({', '.join(map(_nome, colunas))}) "
+                    f"REFERENCES {_nome(referenciada)} ({', '.join(map(_nome, colunas_referenciadas))})"
+                ))
+
+
+def validar_sombras(conexao, esperadas):
+    """Confere as sombras antes da troca. Devolve a lista de problemas encontrados (vazia se estiver tudo certo)."""
+    problemas = []
+    for tabela, linhas_esperadas in esperadas.items():
+        sombra = tabela + SUFIXO_NOVO
+        linhas = _contar(conexao, sombra)
+        if linhas != linhas_esperadas:
+            problemas.append(f"{sombra}: {linhas} linhas gravadas, {linhas_esperadas} esperadas")
+        atuais = _contar(conexao, tabela)
+        if atuais and linhas < atuais * (1 - QUEDA_MAXIMA):
+            problemas.append(f"{sombra}: {linhas} linhas contra {atuais} na tabela atual (queda maior que {QUEDA_MAXIMA:.0%})")
+
+        #A carga roda com foreign_key_checks = 0, então as chaves estrangeiras são conferidas aqui (anti-join)
+        for _, colunas, referenciada, colunas_referenciadas in _chaves_estrangeiras(conexao, sombra):
+            juncao = ' AND '.join(f"f.{_nome(c)} = r.{_nome(cr)}" for c, cr in zip(colunas, colunas_referenciadas))
+            orfaos = conexao.execute(text(
+                f"SELECT COUNT(*) FROM {_nome(sombra)} f LEFT JOIN {_nome(referenciada)} r ON {juncao} "
+                f"WHERE f.{_nome(colunas[0])} IS NOT NULL AND r.{_nome(colunas_referenciadas[0])} IS NULL"
+            )).scalar()
+            if orfaos:
+                problemas.append(f"{sombra}: {orfaos} linhas sem correspondência em {referenciada} ({', '.join(colunas)})")
+    return problemas
+
+
+def _trocar(conexao, pares):
+    #Um único RENAME TABLE com todas as trocas: o MySQL aplica todas ou nenhuma, de forma atômica para os leitores
+    conexao.execute(text("RENAME TABLE " + ", ".join(f"{_nome(a)} TO {_nome(b)}" for a, b in pares)))
+
+
+def _preparar_controle(engine, atualizadas):
+    """Cria as sombras das tabelas de controle: cópias das atuais com os dados do DW e as tabelas atualizadas
+    (os resumos) marcados agora e a geração seguinte. Devolve os pares do RENAME TABLE que as publicam."""
+    with engine.begin() as conexao:
+        for tabela in TABELAS_CONTROLE:
+            conexao.execute(text(f"DROP TABLE IF EXISTS {_nome(tabela + SUFIXO_NOVO)}, {_nome(tabela + SUFIXO_ANTIGO)}"))
+            conexao.execute(text(f"CREATE TABLE {_nome(tabela + SUFIXO_NOVO)} LIKE {_nome(tabela)}"))
+            conexao.execute(text(f"INSERT INTO {_nome(tabela + SUFIXO_NOVO)} SELECT * FROM {_nome(tabela)}"))
+        #'dados' antes dos resumos: o NOW(6) de cada comando é o do início dele, então os resumos ficam mais recentes
+        for item in ['dados', *atualizadas]:
+            resumos.marcar_atualizacao(conexao, item, resumos.TABELA_ATUALIZACOES + SUFIXO_NOVO)
+        resumos.incrementar_geracao(conexao, resumos.TABELA_GERACAO + SUFIXO_NOVO)
+    return [par for t in TABELAS_CONTROLE for par in ((t, t + SUFIXO_ANTIGO), (t + SUFIXO_NOVO, t))]
+
+
+def publicar(engine, esperadas, atualizadas=()):
+    """Valida as sombras e as troca pelas tabelas atuais, junto com as tabelas de controle.
+    esperadas: {tabela: linhas carregadas}; atualizadas: as tabelas de resumo entre elas, marcadas como atualizadas."""
+    if MODO_PUBLICACAO != 'sombra':
+        return None
+    inicio = time.perf_counter()
+    with engine.connect() as conexao:
+        problemas = validar_sombras(conexao, esperadas)
+        if problemas:
+            #As tabelas atuais não são tocadas; as sombras ficam no banco para investigação
+            raise RuntimeError("Publicação do DW cancelada:\n  " + "\n  ".join(problemas))
+
+        tabelas = list(esperadas)
+        with checagens_adiadas(conexao):
+            conexao.execute(text(f"DROP TABLE IF EXISTS {', '.join(_nome(t + SUFIXO_ANTIGO) for t in tabelas)}"))
+        controle = _preparar_controle(engine, atualizadas)
+        _trocar(conexao, [par for t in tabelas for par in ((t, t + SUFIXO_ANTIGO), (t + SUFIXO_NOVO, t))] + controle)
+
+    duracao = time.perf_counter() - inicio
+    linhas = sum(esperadas.values())
+    print(f"  publicação do DW: {len(esperadas)} tabelas trocadas ({linhas} linhas) em {duracao:.2f}s")
+    return {
+        'tabela': 'publicacao_dw',
+        'modo': 'rename',
+        'linhas': linhas,
+        'segundos': duracao,
+        'linhas_por_segundo': linhas / duracao if duracao > 0 else 0.0,
+    }
+
+
+def reverter(engine, tabelas, atualizadas=()):
+    """Troca as tabelas atuais pelas substituídas na última publicação (e vice-versa: reverter de novo desfaz).
+    Como na publicação, as tabelas de controle mudam no mesmo RENAME TABLE: as atualizadas (os resumos, que
+    voltam junto com os dados) ficam marcadas e a geração avança, para a API descartar os caches da versão que saiu."""
+    with engine.connect() as conexao:
+        faltando = [
+            t + SUFIXO_ANTIGO for t in tabelas
+            if conexao.execute(text(
+                "SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :tabela"
+            ), {'tabela': t + SUFIXO_ANTIGO}).scalar() == 0
+        ]
+        if faltando:
+            raise RuntimeError(f"Nada a reverter: tabelas inexistentes: {', '.join(faltando)}")
+        controle = _preparar_controle(engine, atualizadas)
+        _trocar(conexao, [
+            par for t in tabelas
+            for par in ((t, t + SUFIXO_TROCA), (t + SUFIXO_ANTIGO, t), (t + SUFIXO_TROCA, t + SUFIXO_ANTIGO))
+        ] + controle)
+    print(f"  DW revertido: {', '.join(tabelas)}")
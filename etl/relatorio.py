@@ -0,0 +1,265 @@
+import glob
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+# Relatório de execução do ETL.
+# Cada passo lógico da execução (um estágio da carga completa: leitura e limpeza de um CSV, gravação de uma tabela
+# do transacional, transformação e gravação de uma tabela do DW; ou um bloco do modo incremental) é medido:
+#   segundos             tempo de parede do passo
+#   fases                tempo dentro do passo gasto em leitura_csv, releitura (do banco) e gravacao (no banco)
+#   linhas_entrada/saida linhas lidas pelo passo e linhas dos DataFrames que ele produziu
+#   linhas_gravadas      linhas escritas no banco (inserções, upserts e remoções)
+#   descartes            linhas removidas por regra (duplicados, saldo negativo, vínculos órfãos...)
+#   corrigidos           valores ajustados por regra, sem remover a linha (datas antigas, CPFs repetidos...)
+#   bytes_lidos          tamanho dos CSVs lidos
+#   pico_rss_mb          maior memória residente do processo durante o passo (com estágios simultâneos, inclui a
+#                        memória dos outros; para atribuir a memória passo a passo, use ETL_TRABALHADORES=1)
+# As medições de um passo ficam num ContextVar, preenchido pelo próprio código do pipeline (leitura, carga, regras de
+# limpeza) com acumular(), fase(), descartar() e corrigir(); fora de um passo, essas funções não fazem nada.
+# No final, o relatório é gravado em JSON (um arquivo por execução, em ETL_RELATORIO_DIR) e resumido numa tabela.
+# Os passos são comparados com os da última execução bem-sucedida do mesmo modo: os que ficaram mais lentos além da
+# tolerância são impressos como regressões e registrados no próprio relatório, para alertas.
+
+# Pasta dos relatórios (vazio desativa a gravação do JSON; a tabela continua sendo impressa)
+DIR_RELATORIO = os.getenv('ETL_RELATORIO_DIR', 'relatorios')
+# Aumento relativo de tempo tolerado antes de apontar regressão
+TOLERANCIA = float(os.getenv('ETL_RELATORIO_TOLERANCIA', '0.5'))
+
+# Configuração do ETL registrada junto com os relatórios e benchmarks (só são comparáveis execuções com a mesma)
+CONFIGURACAO = ('ETL_MODO_CARGA', 'ETL_TAMANHO_LOTE', 'ETL_HANDOFF', 'ETL_TRABALHADORES',
+                'ETL_MODO_LEITURA', 'ETL_MEMORIA_LEITURA_MB', 'ETL_PUBLICACAO_DW')
+
+# Intervalo de amostragem da memória e duração mínima para um passo entrar na comparação (abaixo disso é ruído)
+INTERVALO_AMOSTRAGEM = 0.02
+SEGUNDOS_MINIMOS_COMPARACAO = 1.0
+
+
+def rss_atual() -> int:
+    """Memória residente do processo em bytes (pico do processo, se /proc não estiver disponível)."""
+    try:
+        with open('/proc/self/statm') as arquivo:
+            return int(arquivo.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class AmostradorMemoria:
+    #Thread que lê o RSS a cada INTERVALO_AMOSTRAGEM e guarda o maior valor visto durante cada estágio em execução
+    def __init__(self):
+        self.picos = {}
+        self._ativos = set()
+        self._trava = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._amostrar, daemon=True)
+
+    def _registrar(self):
+        rss = rss_atual()
+        with self._trava:
+            for nome in self._ativos:
+                self.picos[nome] = max(self.picos.get(nome, 0), rss)
+
+    def _amostrar(self):
+        while not self._parar.wait(INTERVALO_AMOSTRAGEM):
+            self._registrar()
+
+    def iniciar(self, nome):
+        with self._trava:
+            self._ativos.add(nome)
+        self._registrar()
+
+    def terminar(self, nome):
+        self._registrar()
+        with self._trava:
+            self._ativos.discard(nome)
+            return self.picos.pop(nome)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *erro):
+        self._parar.set()
+        self._thread.join()
+
+
+_passo = ContextVar('passo_etl', default=None)
+_passos = []
+_trava = threading.Lock()
+# Um amostrador por processo (com o pool de processos, cada filho mede os seus passos)
+_amostrador = {'pid': None, 'instancia': None}
+
+
+def _amostrador_do_processo():
+    with _trava:
+        if _amostrador['pid'] != os.getpid():
+            _amostrador['pid'], _amostrador['instancia'] = os.getpid(), AmostradorMemoria().__enter__()
+        return _amostrador['instancia']
+
+
+def acumular(nome: str, valor):
+    passo = _passo.get()
+    if passo is not None:
+        passo[nome] = passo.get(nome, 0) + valor
+
+
+def _contar(grupo: str, regra: str, quantidade):
+    passo = _passo.get()
+    if passo is not None and quantidade:
+        passo[grupo][regra] = passo[grupo].get(regra, 0) + int(quantidade)
+
+
+def descartar(regra: str, quantidade):
+    """Registra linhas removidas por uma regra de limpeza no passo atual."""
+    _contar('descartes', regra, quantidade)
+
+
+def corrigir(regra: str, quantidade):
+    """Registra valores ajustados por uma regra de limpeza (sem remover linhas) no passo atual."""
+    _contar('corrigidos', regra, quantidade)
+
+
+@contextmanager
+def fase(nome: str):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        passo = _passo.get()
+        if passo is not None:
+            passo['fases'][nome] = passo['fases'].get(nome, 0.0) + time.perf_counter() - inicio
+
+
+@contextmanager
+def medir(nome: str):
+    """Mede um passo do ETL. O registro é guardado no relatório da execução mesmo que o passo falhe."""
+    passo = {
+        'passo': nome, 'segundos': 0.0, 'fases': {}, 'linhas_entrada': 0, 'linhas_saida': 0, 'linhas_gravadas': 0,
+        'descartes': {}, 'corrigidos': {}, 'bytes_lidos': 0, 'pico_rss_mb': 0.0,
+    }
+    amostrador = _amostrador_do_processo()
+    chave = f"{nome}#{id(passo)}"
+    amostrador.iniciar(chave)
+    token = _passo.set(passo)
+    inicio = time.perf_counter()
+    try:
+        yield passo
+    except BaseException as erro:
+        passo['erro'] = f"{type(erro).__name__}: {erro}"
+        raise
+    finally:
+        _passo.reset(token)
+        passo['segundos'] = time.perf_counter() - inicio
+        passo['pico_rss_mb'] = amostrador.terminar(chave) / 2**20
+        with _trava:
+            _passos.append(passo)
+
+
+def linhas_produzidas(resultado) -> int:
+    #Linhas dos DataFrames devolvidos por um estágio ({tabela: DataFrame, ...})
+    return sum(len(valor) for valor in resultado.values() if hasattr(valor, 'columns'))
+
+
+def executar_estagio(nome, funcao, *dependencias):
+    """Executa a função de um estágio como um passo do relatório. O registro também volta no resultado
+    ('relatorio'), para que o processo principal o receba quando o estágio roda num processo filho."""
+    with medir(nome) as passo:
+        resultado = funcao(*dependencias)
+        passo['linhas_saida'] = linhas_produzidas(resultado)
+    return {**resultado, 'relatorio': [passo]}
+
+
+def adicionar(passos):
+    with _trava:
+        _passos.extend(passos)
+
+
+def _anterior(diretorio: str, modo: str):
+    #Último relatório bem-sucedido do mesmo modo (os nomes dos arquivos começam pela data, em UTC)
+    for caminho in sorted(glob.glob(os.path.join(diretorio, 'etl-*.json')), reverse=True):
+        try:
+            with open(caminho, encoding='utf-8') as arquivo:
+                relatorio = json.load(arquivo)
+        except (OSError, ValueError):
+            continue
+        if relatorio.get('status') == 'sucesso' and relatorio.get('modo') == modo:
+            return relatorio
+    return None
+
+
+def comparar(relatorio, base, tolerancia=None):
+    """Devolve as regressões de tempo (acima da tolerância) de uma execução em relação a outra."""
+    tolerancia = TOLERANCIA if tolerancia is None else tolerancia
+    antes = {passo['passo']: passo['segundos'] for passo in base['passos']}
+    pares = [('total', base['segundos'], relatorio['segundos'])] + [
+        (passo['passo'], antes[passo['passo']], passo['segundos'])
+        for passo in relatorio['passos'] if passo['passo'] in antes
+    ]
+    return [
+        f"{nome}: {anterior:.2f}s -> {atual:.2f}s"
+        for nome, anterior, atual in pares
+        if max(anterior, atual) >= SEGUNDOS_MINIMOS_COMPARACAO and atual > anterior * (1 + tolerancia)
+    ]
+
+
+def imprimir(relatorio):
+    #Tabela final com os passos na ordem em que terminaram
+    print(f"{'passo':<28}{'segundos':>10}{'csv (s)':>9}{'banco (s)':>10}{'entrada':>10}{'saída':>10}"
+          f"{'descartes':>11}{'MB lidos':>10}{'pico RSS':>10}")
+    for passo in relatorio['passos']:
+        fases = passo['fases']
+        banco = fases.get('gravacao', 0.0) + fases.get('releitura', 0.0)
+        print(f"{passo['passo']:<28}{passo['segundos']:>10.2f}{fases.get('leitura_csv', 0.0):>9.2f}{banco:>10.2f}"
+              f"{passo['linhas_entrada']:>10}{passo['linhas_saida']:>10}{sum(passo['descartes'].values()):>11}"
+              f"{passo['bytes_lidos'] / 2**20:>10.1f}{passo['pico_rss_mb']:>10.0f}")
+    print(f"{'total':<28}{relatorio['segundos']:>10.2f}{'':>60}{relatorio['pico_rss_mb']:>10.0f}")
+    descartes = {}
+    for passo in relatorio['passos']:
+        for regra, quantidade in passo['descartes'].items():
+            descartes[regra] = descartes.get(regra, 0) + quantidade
+    if descartes:
+        print("Linhas descartadas: " + ", ".join(f"{regra} {quantidade}" for regra, quantidade in descartes.items()))
+
+
+def concluir(modo: str, status: str, inicio: datetime, segundos: float, cargas=(), erro=None):
+    """Monta o relatório da execução, compara com a anterior, grava o JSON e imprime o resumo. Devolve o relatório."""
+    with _trava:
+        passos = list(_passos)
+    relatorio = {
+        'inicio': inicio.isoformat(timespec='seconds'),
+        'modo': modo,
+        'status': status,
+        'erro': erro,
+        'segundos': segundos,
+        'pico_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'configuracao': {variavel: os.getenv(variavel) for variavel in CONFIGURACAO},
+        'passos': passos,
+        'cargas': list(cargas),
+        'regressoes': [],
+    }
+    if status == 'sem_alteracoes':
+        return relatorio
+
+    if DIR_RELATORIO:
+        base = _anterior(DIR_RELATORIO, modo) if status == 'sucesso' else None
+        if base is not None:
+            relatorio['regressoes'] = comparar(relatorio, base)
+            relatorio['comparado_com'] = base['inicio']
+        nome = f"etl-{inicio.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}-{modo}.json"
+        try:
+            os.makedirs(DIR_RELATORIO, exist_ok=True)
+            with open(os.path.join(DIR_RELATORIO, nome), 'w', encoding='utf-8') as arquivo:
+                json.dump(relatorio, arquivo, indent=2, ensure_ascii=False)
+            print(f"Relatório da execução gravado em {os.path.join(DIR_RELATORIO, nome)}")
+        except OSError as e:
+            print(f"Não foi possível gravar o relatório da execução: {e}")
+
+    imprimir(relatorio)
+    for texto in relatorio['regressoes']:
+        print(f"  REGRESSÃO {texto} (em relação à execução de {relatorio['comparado_com']})")
+    return relatorio
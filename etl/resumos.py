@@ -0,0 +1,186 @@
+import re
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+import classificacao
+import montante
+import sketches
+
+# Tabelas de resumo do DW, lidas pelos endpoints /resumo/* da API.
+# Os dados do DW só mudam quando o ETL roda, então as agregações (que varrem toda a tabela fato) são calculadas
+# uma vez por carga, aqui, em vez de a cada requisição. Quase tudo é feito dentro do MySQL (INSERT ... SELECT); só
+# o resumo_montante é calculado em Python, para ter as mesmas somas em float que a API (ver etl/montante.py).
+# A tabela atualizacoes_dw registra quando os dados do DW ('dados') e cada resumo foram atualizados pela última vez:
+# a API só usa um resumo se ele for mais recente que os dados; caso contrário, volta para a consulta direta.
+# Junto com a marca 'dados', a "geração" do DW (geracao_dw) é incrementada: ela versiona os payloads
+# pré-renderizados dos endpoints de resumo (ver api/payloads.py).
+# Na publicação 'sombra' da carga completa (etl/publicacao.py), os resumos são calculados a partir das sombras do DW
+# em sombras próprias (<resumo>_novo), e as marcas e a geração mudam no mesmo RENAME TABLE que publica os dados.
+
+TABELA_ATUALIZACOES = 'atualizacoes_dw'
+TABELA_GERACAO = 'geracao_dw'
+# Tabelas do DW lidas pelos resumos
+TABELAS_LIDAS = ('fatos_cdas', 'dim_naturezas', 'dim_devedores', 'jun_cdas_devedores')
+
+# Códigos dos grupos de situação e nomes dos grupos de tributo (regras em etl/classificacao.py). Os resumos agrupam
+# e filtram pelos códigos gravados na tabela fato, sem JOIN com dim_situacoes nem LIKE por linha.
+EM_COBRANCA = classificacao.CODIGOS_GRUPO['em_cobranca']
+CANCELADA = classificacao.CODIGOS_GRUPO['cancelada']
+QUITADA = classificacao.CODIGOS_GRUPO['quitada']
+#Nome do tributo a partir do código (avaliado uma vez por linha do resumo, e não por linha da tabela fato)
+NOME_TRIBUTO = "CASE cod_tributo " + " ".join(
+    f"WHEN {codigo} THEN '{tributo}'" for codigo, tributo in enumerate(classificacao.TRIBUTOS)
+) + " END"
+
+
+def _nas_tabelas(sql, nome):
+    #Troca os nomes das tabelas do DW e dos resumos no SQL por nome(tabela) (as sombras, na publicação 'sombra')
+    return re.sub(r'\b(' + '|'.join(TABELAS_LIDAS + tuple(RESUMOS)) + r')\b', lambda m: nome(m.group(1)), sql)
+
+
+def gravar_montante(conexao, nome):
+    #As somas são as mesmas que a API calcula sem o resumo (etl/montante.py): somas em float com soma compensada,
+    #que o SUM do banco não reproduz. Devolve a quantidade de linhas gravadas.
+    linhas = conexao.execute(text(_nas_tabelas(montante.SELECT_SALDOS, nome))).fetchall()
+    codigos = np.array([linha[0] for linha in linhas], dtype='int64')
+    somas, totais, presentes = montante.somas_por_percentil(
+        codigos, montante.centavos([linha[1] for linha in linhas]), len(classificacao.TRIBUTOS)
+    )
+    registros = [
+        {'tributo': tributo, 'percentil': percentil + 1, 'saldo': float(somas[i, percentil]), 'saldo_tributo': float(totais[i])}
+        for i, tributo in enumerate(classificacao.TRIBUTOS)
+        for percentil in np.flatnonzero(presentes[i]).tolist()
+    ]
+    if registros:
+        conexao.execute(text(
+            f"INSERT INTO {nome('resumo_montante')} (tributo, percentil, saldo, saldo_tributo) "
+            "VALUES (:tributo, :percentil, :saldo, :saldo_tributo)"
+        ), registros)
+    return len(registros)
+
+
+RESUMOS = {
+    # Quantidade de CDAs e saldo total por natureza (/resumo/quantidade_cdas e /resumo/saldo_cdas)
+    'resumo_naturezas': """
+        INSERT INTO resumo_naturezas (natureza, quantidade, saldo)
+        SELECT
+            d.descricao_natureza,
+            COUNT(*),
+            SUM(f.valor_saldo)
+        FROM fatos_cdas f
+        JOIN dim_naturezas d ON f.fk_natureza = d.id_natureza
+        GROUP BY d.descricao_natureza
+    """,
+    # Quantidade de CDAs por ano de inscrição (/resumo/inscricoes)
+    'resumo_inscricoes': """
+        INSERT INTO resumo_inscricoes (ano, quantidade)
+        SELECT f.ano_inscricao, COUNT(*)
+        FROM fatos_cdas f
+        GROUP BY f.ano_inscricao
+    """,
+    # Percentual de CDAs em cobrança, canceladas e quitadas por natureza (/resumo/distribuicao_cdas)
+    'resumo_distribuicao': f"""
+        INSERT INTO resumo_distribuicao (natureza, em_cobranca, cancelada, quitada)
+        SELECT
+            d.descricao_natureza,
+            (COUNT(CASE WHEN f.cod_grupo_situacao = {EM_COBRANCA} THEN 1 END) * 100.0 / COUNT(*)),
+            (COUNT(CASE WHEN f.cod_grupo_situacao = {CANCELADA} THEN 1 END) * 100.0 / COUNT(*)),
+            (COUNT(CASE WHEN f.cod_grupo_situacao = {QUITADA} THEN 1 END) * 100.0 / COUNT(*))
+        FROM fatos_cdas f
+        JOIN dim_naturezas d ON f.fk_natureza = d.id_natureza
+        GROUP BY d.descricao_natureza
+    """,
+    # Soma do saldo em cada percentil (NTILE(100) por grupo de tributo), base das curvas de /resumo/montante_acumulado.
+    # A API só faz a soma acumulada dessas (no máximo) 500 linhas. Calculado em Python (ver gravar_montante).
+    'resumo_montante': gravar_montante,
+    # Sketches do saldo por (tributo, ano, grupo de situação), juntados pela API para as curvas de montante acumulado
+    # com filtros (/resumo/montante_acumulado/curva)
+    'resumo_sketches': f"""
+        INSERT INTO resumo_sketches (
+            cod_tributo, ano_inscricao, cod_grupo_situacao, faixa, quantidade, saldo, saldo_minimo, saldo_maximo
+        )
+        {sketches.SELECT_SKETCHES}
+    """,
+    # Carteira de cada devedor (/cda/detalhes_devedor): quantidade de CDAs, saldo total (exposição), probabilidade de
+    # recuperação média ponderada pelo saldo e quantidade de CDAs em cada grupo de situação.
+    # Os dados do devedor são copiados para a tabela, então o endpoint lê só ela, ordenando pelo índice da exposição.
+    'resumo_devedores': f"""
+        INSERT INTO resumo_devedores (
+            id_devedor, nome, tipo_pessoa, cpf_cnpj, qtde_cdas, saldo_total,
+            prob_recuperacao_ponderada, qtde_em_cobranca, qtde_cancelada, qtde_quitada
+        )
+        SELECT
+            d.id_devedor,
+            d.nome,
+            d.tipo_pessoa,
+            d.cpf_cnpj,
+            COUNT(*),
+            SUM(f.valor_saldo),
+            SUM(f.prob_recuperacao * f.valor_saldo) / NULLIF(SUM(f.valor_saldo), 0),
+            COUNT(CASE WHEN f.cod_grupo_situacao = {EM_COBRANCA} THEN 1 END),
+            COUNT(CASE WHEN f.cod_grupo_situacao = {CANCELADA} THEN 1 END),
+            COUNT(CASE WHEN f.cod_grupo_situacao = {QUITADA} THEN 1 END)
+        FROM jun_cdas_devedores j
+        JOIN dim_devedores d ON j.fk_devedor = d.id_devedor
+        JOIN fatos_cdas f ON j.fk_cda = f.num_cda
+        GROUP BY d.id_devedor, d.nome, d.tipo_pessoa, d.cpf_cnpj
+    """,
+}
+
+
+def calcular_resumo(conexao, resumo, nome=str):
+    """Grava as linhas de um resumo (INSERT ... SELECT ou função em Python). Devolve a quantidade de linhas.
+    nome(tabela) dá a tabela onde cada tabela do DW e cada resumo é lida ou gravada (por padrão, a própria)."""
+    calculo = RESUMOS[resumo]
+    if callable(calculo):
+        return calculo(conexao, nome)
+    return conexao.execute(text(_nas_tabelas(calculo, nome))).rowcount
+
+
+def marcar_atualizacao(conexao, item, tabela=TABELA_ATUALIZACOES):
+    conexao.execute(text(
+        f"INSERT INTO {tabela} (item, atualizado_em) VALUES (:item, NOW(6)) "
+        "ON DUPLICATE KEY UPDATE atualizado_em = NOW(6)"
+    ), {'item': item})
+
+
+def incrementar_geracao(conexao, tabela=TABELA_GERACAO):
+    conexao.execute(text(
+        f"INSERT INTO {tabela} (id, geracao, atualizado_em) VALUES (1, 1, NOW(6)) "
+        "ON DUPLICATE KEY UPDATE geracao = geracao + 1, atualizado_em = NOW(6)"
+    ))
+
+
+def calcular_resumos(engine, nome=str, marcar=False):
+    """Recalcula todas as tabelas de resumo (ver calcular_resumo); com marcar=True, marca cada uma como atualizada.
+    Devolve as estatísticas."""
+    estatisticas = []
+    for resumo in RESUMOS:
+        inicio = time.perf_counter()
+        #DELETE + INSERT na mesma transação: quem lê o resumo enquanto isso continua vendo a versão anterior
+        with engine.begin() as conexao:
+            conexao.execute(text(f"DELETE FROM {nome(resumo)}"))
+            linhas = calcular_resumo(conexao, resumo, nome)
+            if marcar:
+                marcar_atualizacao(conexao, resumo)
+        duracao = time.perf_counter() - inicio
+        print(f"  {resumo}: {linhas} linhas em {duracao:.2f}s")
+        estatisticas.append({
+            'tabela': resumo,
+            'modo': 'resumo',
+            'linhas': linhas,
+            'segundos': duracao,
+            'linhas_por_segundo': linhas / duracao if duracao > 0 else 0.0,
+        })
+    return estatisticas
+
+
+def atualizar_resumos(engine):
+    """Marca os dados do DW como alterados e recalcula todas as tabelas de resumo. Devolve as estatísticas."""
+    #A marca 'dados' vem antes: se algum resumo falhar, ele fica mais antigo que os dados e a API usa a consulta direta.
+    with engine.begin() as conexao:
+        marcar_atualizacao(conexao, 'dados')
+        incrementar_geracao(conexao)
+    return calcular_resumos(engine, marcar=True)
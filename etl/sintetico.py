@@ -0,0 +1,244 @@
+import argparse
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+# Gerador determinístico de dados sintéticos no formato dos CSVs de data/ (001.csv a 007.csv), em qualquer escala
+# (1M, 10M, 50M de CDAs...), para medir o ETL em tamanhos de produção (ver etl/benchmark.py).
+# As linhas são reamostradas dos próprios arquivos de data/ e as taxas das "sujeiras" que o pipeline trata são medidas
+# neles e mantidas na escala gerada:
+#   - numCDA duplicado (001 e 004), com datCadastramento anterior a 1980 e saldos negativos (reamostrados do 001);
+#   - ids de natureza duplicados (002 é copiado como está, e as CDAs usam os mesmos ids do 001);
+#   - idPessoa duplicado, CPFs/CNPJs repetidos e ausentes (006 e 007);
+#   - linhas da junção (005) que apontam para CDAs ou devedores inexistentes.
+# A saída depende só da escala e da semente: cada bloco de BLOCO linhas usa o seu próprio gerador aleatório,
+# derivado de (semente, arquivo, bloco), e é gravado em seguida, então a memória não cresce com a escala.
+
+BLOCO = 1_000_000
+VERSAO = 1
+
+# Faixas das chaves geradas (todas cabem nas colunas INT/BIGINT do transacional)
+BASE_CDA = 10_000_000_000_000
+BASE_PF = 1
+BASE_PJ = 500_000_000
+BASE_ORFAO = 1_500_000_000
+
+# Arquivos de dimensão pequenos, copiados como estão (mantêm os ids de natureza duplicados)
+COPIADOS = ('002', '003')
+
+
+def ler_escala(texto: str) -> int:
+    """Converte '500k', '1M', '10M' ou '50000' em quantidade de CDAs."""
+    texto = texto.strip().lower()
+    multiplicadores = {'k': 1_000, 'm': 1_000_000}
+    if texto and texto[-1] in multiplicadores:
+        return int(float(texto[:-1]) * multiplicadores[texto[-1]])
+    return int(texto)
+
+
+def _ler_base(diretorio):
+    return {
+        '001': pd.read_csv(os.path.join(diretorio, '001.csv'), dtype={'DatSituacao': str, 'datCadastramento': str}),
+        '004': pd.read_csv(os.path.join(diretorio, '004.csv')),
+        '005': pd.read_csv(os.path.join(diretorio, '005.csv')),
+        '006': pd.read_csv(os.path.join(diretorio, '006.csv'), dtype={'numcpf': str}),
+        '007': pd.read_csv(os.path.join(diretorio, '007.csv'), dtype={'numCNPJ': str}),
+    }
+
+
+def _perfil_devedores(df, coluna_documento, quantidade_cdas):
+    documentos = df[coluna_documento].dropna()
+    return {
+        'por_cda': len(df) / quantidade_cdas,
+        'taxa_id_duplicado': float(df['idpessoa'].duplicated().mean()),
+        'taxa_sem_documento': float(df[coluna_documento].isna().mean()),
+        'taxa_documento_repetido': float(documentos.duplicated().mean()) if len(documentos) else 0.0,
+    }
+
+
+def medir_perfil(base):
+    """Mede nos arquivos de data/ as proporções que o gerador mantém em qualquer escala."""
+    cda, juncao = base['001'], base['005']
+    cdas_unicas = cda['numCDA'].nunique()
+    pessoas = set(base['006']['idpessoa']) | set(base['007']['idpessoa'])
+    cadastramento = pd.to_datetime(cda['datCadastramento'], errors='coerce')
+    return {
+        'taxa_cda_duplicada': float(cda['numCDA'].duplicated().mean()),
+        # Só informativas: vêm da reamostragem das linhas do 001
+        'taxa_saldo_negativo': float((cda['ValSaldo'] < 0).mean()),
+        'taxa_cadastro_antes_1980': float((cadastramento.dt.year < 1980).mean()),
+        'juncao_por_cda': len(juncao) / cdas_unicas,
+        'taxa_juncao_cda_orfa': float((~juncao['numCDA'].isin(cda['numCDA'])).mean()),
+        'taxa_juncao_devedor_orfao': float((~juncao['idPessoa'].isin(pessoas)).mean()),
+        'pf': _perfil_devedores(base['006'], 'numcpf', cdas_unicas),
+        'pj': _perfil_devedores(base['007'], 'numCNPJ', cdas_unicas),
+    }
+
+
+def _gerador(semente, arquivo, bloco):
+    return np.random.default_rng([semente, int(arquivo), bloco])
+
+
+def _blocos(total):
+    for numero, inicio in enumerate(range(0, total, BLOCO)):
+        yield numero, inicio, min(inicio + BLOCO, total)
+
+
+def _duplicar(rng, valores, taxa):
+    #Copia em algumas posições o valor de outra posição do mesmo bloco (a primeira ocorrência é a que o ETL mantém)
+    posicoes = np.flatnonzero(rng.random(len(valores)) < taxa)
+    valores[posicoes] = valores[rng.integers(0, len(valores), size=len(posicoes))]
+    return valores
+
+
+@contextmanager
+def _arquivo_csv(origem, destino):
+    #Abre o CSV gerado com a linha de cabeçalho original (com as mesmas aspas); os blocos são anexados sem cabeçalho
+    with open(origem, encoding='utf-8') as arquivo:
+        cabecalho = arquivo.readline()
+    with open(destino, 'w', encoding='utf-8', newline='') as arquivo:
+        arquivo.write(cabecalho)
+        yield arquivo
+
+
+def _anexar(arquivo, bloco, **opcoes):
+    bloco.to_csv(arquivo, header=False, index=False, lineterminator='\n', **opcoes)
+    return len(bloco)
+
+
+def _escrever(origem, destino, blocos, **opcoes):
+    with _arquivo_csv(origem, destino) as arquivo:
+        return sum(_anexar(arquivo, bloco, **opcoes) for bloco in blocos)
+
+
+def _blocos_cda(base, perfil, quantidade, semente):
+    #Cada bloco gera as linhas do 001 e, com os mesmos numCDA (inclusive os duplicados), as do 004
+    cda, probabilidades = base['001'], base['004']
+    for numero, inicio, fim in _blocos(quantidade):
+        rng = _gerador(semente, '001', numero)
+        linhas = cda.iloc[rng.integers(0, len(cda), size=fim - inicio)].reset_index(drop=True)
+        linhas['numCDA'] = _duplicar(rng, np.arange(BASE_CDA + inicio, BASE_CDA + fim, dtype='int64'), perfil['taxa_cda_duplicada'])
+        # Variação no saldo, mantendo o sinal (e, portanto, a taxa de saldos negativos)
+        linhas['ValSaldo'] = np.round(linhas['ValSaldo'].to_numpy() * np.exp(rng.normal(0.0, 0.25, size=len(linhas))), 2)
+
+        prob = probabilidades.iloc[rng.integers(0, len(probabilidades), size=len(linhas))].reset_index(drop=True)
+        prob['numCDA'] = linhas['numCDA']
+        yield linhas, prob
+
+
+def _blocos_devedores(perfil, quantidade, base_id, documento, semente, arquivo):
+    for numero, inicio, fim in _blocos(quantidade):
+        rng = _gerador(semente, arquivo, numero)
+        indices = np.arange(inicio, fim, dtype='int64')
+        ids = _duplicar(rng, base_id + indices, perfil['taxa_id_duplicado'])
+        documentos = pd.array(_duplicar(rng, documento(indices), perfil['taxa_documento_repetido']), dtype='Int64')
+        documentos[rng.random(len(indices)) < perfil['taxa_sem_documento']] = pd.NA
+        yield pd.DataFrame({'idpessoa': ids, 'descNome': [f'Zeca Loteiro {i}' for i in ids.tolist()], 'documento': documentos})
+
+
+def _documento_pf(indices):
+    #Permutação de [0, 10^11): CPFs distintos, com tamanhos variados como no 006 (zeros à esquerda perdidos)
+    return ((indices + 1) * 7907) % 10**11
+
+
+def _documento_pj(indices):
+    #Permutação de [10^11, 10^14): CNPJs distintos entre si e dos CPFs
+    return 10**11 + ((indices + 1) * 7919) % (10**14 - 10**11)
+
+
+def _blocos_juncao(base, perfil, quantidade_cdas, quantidade_pf, quantidade_pj, semente):
+    juncao = base['005']
+    total = int(round(quantidade_cdas * perfil['juncao_por_cda']))
+    for numero, inicio, fim in _blocos(total):
+        rng = _gerador(semente, '005', numero)
+        tamanho = fim - inicio
+        linhas = juncao.iloc[rng.integers(0, len(juncao), size=tamanho)].reset_index(drop=True)
+
+        cdas = BASE_CDA + rng.integers(0, quantidade_cdas, size=tamanho)
+        orfas = rng.random(tamanho) < perfil['taxa_juncao_cda_orfa']
+        cdas[orfas] = BASE_CDA + quantidade_cdas + rng.integers(0, quantidade_cdas, size=orfas.sum())
+
+        pj = rng.random(tamanho) < quantidade_pj / max(quantidade_pf + quantidade_pj, 1)
+        pessoas = np.where(
+            pj,
+            BASE_PJ + rng.integers(0, max(quantidade_pj, 1), size=tamanho),
+            BASE_PF + rng.integers(0, max(quantidade_pf, 1), size=tamanho),
+        )
+        orfaos = rng.random(tamanho) < perfil['taxa_juncao_devedor_orfao']
+        pessoas[orfaos] = BASE_ORFAO + rng.integers(0, 10**8, size=orfaos.sum())
+
+        linhas['numCDA'] = cdas
+        linhas['idPessoa'] = pessoas
+        yield linhas
+
+
+def gerar(quantidade_cdas: int, destino: str, semente: int = 42, origem: str = 'data'):
+    """Gera 001.csv a 007.csv com quantidade_cdas CDAs em destino. Devolve os metadados gravados em sintetico.json."""
+    inicio = time.perf_counter()
+    base = _ler_base(origem)
+    perfil = medir_perfil(base)
+    os.makedirs(destino, exist_ok=True)
+
+    def caminhos(codigo):
+        return os.path.join(origem, f'{codigo}.csv'), os.path.join(destino, f'{codigo}.csv')
+
+    for codigo in COPIADOS:
+        shutil.copyfile(*caminhos(codigo))
+
+    #001 e 004 saem do mesmo gerador (as probabilidades usam os mesmos numCDA, inclusive os duplicados)
+    linhas = {'001': 0, '004': 0}
+    with _arquivo_csv(*caminhos('001')) as arquivo_cda, _arquivo_csv(*caminhos('004')) as arquivo_prob:
+        for cda, prob in _blocos_cda(base, perfil, quantidade_cdas, semente):
+            linhas['001'] += _anexar(arquivo_cda, cda, float_format='%.2f')
+            linhas['004'] += _anexar(arquivo_prob, prob, float_format='%.4f')
+
+    quantidade_pf = int(round(quantidade_cdas * perfil['pf']['por_cda']))
+    quantidade_pj = int(round(quantidade_cdas * perfil['pj']['por_cda']))
+    linhas['006'] = _escrever(*caminhos('006'), _blocos_devedores(perfil['pf'], quantidade_pf, BASE_PF, _documento_pf, semente, '006'))
+    linhas['007'] = _escrever(*caminhos('007'), _blocos_devedores(perfil['pj'], quantidade_pj, BASE_PJ, _documento_pj, semente, '007'))
+    linhas['005'] = _escrever(*caminhos('005'), _blocos_juncao(base, perfil, quantidade_cdas, quantidade_pf, quantidade_pj, semente))
+
+    meta = {
+        'versao_gerador': VERSAO,
+        'cdas': quantidade_cdas,
+        'semente': semente,
+        'linhas': linhas,
+        'perfil': perfil,
+        'segundos': time.perf_counter() - inicio,
+    }
+    with open(os.path.join(destino, 'sintetico.json'), 'w', encoding='utf-8') as arquivo:
+        json.dump(meta, arquivo, indent=2)
+    return meta
+
+
+def ja_gerado(destino: str, quantidade_cdas: int, semente: int) -> bool:
+    """Indica se destino já tem os dados dessa escala e semente (gerados pela mesma versão do gerador)."""
+    try:
+        with open(os.path.join(destino, 'sintetico.json'), encoding='utf-8') as arquivo:
+            meta = json.load(arquivo)
+    except (OSError, ValueError):
+        return False
+    return (meta.get('versao_gerador'), meta.get('cdas'), meta.get('semente')) == (VERSAO, quantidade_cdas, semente)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera CSVs sintéticos no formato de data/ em qualquer escala.")
+    parser.add_argument('--cdas', default='1M', help="quantidade de CDAs (ex.: 500k, 1M, 10M, 50M)")
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--saida', required=True, help="pasta onde os CSVs são gravados")
+    parser.add_argument('--origem', default='data', help="pasta com os CSVs originais (base da reamostragem)")
+    args = parser.parse_args()
+
+    meta = gerar(ler_escala(args.cdas), args.saida, args.semente, args.origem)
+    for codigo, quantidade in sorted(meta['linhas'].items()):
+        print(f"  {codigo}.csv: {quantidade} linhas")
+    print(f"Dados gerados em {args.saida} em {meta['segundos']:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
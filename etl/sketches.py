@@ -0,0 +1,42 @@
+import math
+import os
+
+# Sketches do saldo das CDAs, base das curvas de montante acumulado com filtros (/resumo/montante_acumulado/curva).
+# Para cada célula (grupo de tributo, ano de inscrição, grupo de situação), os saldos são divididos em faixas
+# logarítmicas: a faixa k >= 1 contém os saldos em [SALDO_MINIMO * GAMMA^(k-1), SALDO_MINIMO * GAMMA^k), e a faixa 0
+# os saldos abaixo de SALDO_MINIMO (zerados). Cada faixa guarda a quantidade de CDAs, a soma, o mínimo e o máximo
+# dos saldos, então os sketches de células diferentes se juntam somando as faixas de mesmo índice (sem reler a tabela
+# fato) e o tamanho não depende da quantidade de CDAs, só do número de células e de faixas ocupadas.
+# Quantidades e somas são exatas; só a soma das CDAs de uma faixa cortada por um percentil é estimada, e como o
+# maior saldo de uma faixa é no máximo GAMMA vezes o menor, o erro relativo do montante acumulado em qualquer
+# percentil fica abaixo de GAMMA - 1 = 2 * ERRO_RELATIVO / (1 - ERRO_RELATIVO). A API calcula o limite exato de cada
+# ponto a partir do mínimo e do máximo da faixa (ver api/curvas.py).
+# O módulo não depende do resto do ETL: a API usa a mesma consulta quando o resumo está desatualizado.
+
+# Precisão relativa das faixas (0.01 = faixas de ~2%; menor = curvas mais precisas e mais linhas em resumo_sketches)
+ERRO_RELATIVO = float(os.getenv('ETL_SKETCH_ERRO', '0.01'))
+GAMMA = (1 + ERRO_RELATIVO) / (1 - ERRO_RELATIVO)
+SALDO_MINIMO = 0.01
+# Código gravado para as CDAs sem grupo de situação (cod_grupo_situacao nulo)
+SEM_GRUPO = -1
+
+FAIXA = (
+    f"CASE WHEN f.valor_saldo < {SALDO_MINIMO} THEN 0 "
+    f"ELSE 1 + FLOOR(LN(f.valor_saldo / {SALDO_MINIMO}) / {math.log(GAMMA)!r}) END"
+)
+
+# Uma linha por (célula, faixa ocupada). O SQL é o mesmo no MySQL e no SQLite do benchmark da API.
+SELECT_SKETCHES = f"""
+    SELECT
+        f.cod_tributo,
+        f.ano_inscricao,
+        COALESCE(f.cod_grupo_situacao, {SEM_GRUPO}) AS cod_grupo_situacao,
+        {FAIXA} AS faixa,
+        COUNT(*) AS quantidade,
+        SUM(f.valor_saldo) AS saldo,
+        MIN(f.valor_saldo) AS saldo_minimo,
+        MAX(f.valor_saldo) AS saldo_maximo
+    FROM fatos_cdas f
+    WHERE f.cod_tributo IS NOT NULL
+    GROUP BY f.cod_tributo, f.ano_inscricao, f.cod_grupo_situacao, faixa
+"""
@@ -0,0 +1,122 @@
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+# Snapshot colunar do DW, lido pelas réplicas da API com memory-map (ver api/snapshot.py).
+# Depois de cada carga, a tabela fato é gravada como arquivos .npy (uma coluna por arquivo) numa pasta por geração
+# do DW, junto com as dimensões (meta.json) e as permutações de ordenação usadas pelo /cda/search.
+# As réplicas mapeiam os mesmos arquivos e dividem as páginas pelo cache do sistema operacional; o MySQL continua
+# sendo a fonte da verdade: a API só usa o snapshot cuja geração é a atual do DW.
+# As linhas são gravadas em ordem de num_cda, para a busca exata por numCDA ser uma busca binária na coluna.
+# A publicação é atômica: a pasta é escrita com outro nome, renomeada e só então o ponteiro ATUAL é trocado.
+
+DIR_SNAPSHOT = os.getenv('DW_SNAPSHOT_DIR')
+ARQUIVO_ATUAL = 'ATUAL'
+# Quantas gerações antigas são mantidas (réplicas que ainda as mapeiam continuam lendo normalmente)
+GERACOES_MANTIDAS = 2
+
+
+def _ler_dw(engine):
+    with engine.connect() as conexao:
+        geracao = conexao.execute(text("SELECT geracao FROM geracao_dw WHERE id = 1")).scalar()
+        fatos = pd.read_sql(text(
+            "SELECT num_cda, ano_inscricao, valor_saldo, prob_recuperacao, fk_natureza, fk_situacao, "
+            "cod_tributo, cod_grupo_situacao FROM fatos_cdas ORDER BY num_cda"
+        ), conexao)
+        naturezas = pd.read_sql(text("SELECT id_natureza, descricao_natureza FROM dim_naturezas ORDER BY id_natureza"), conexao)
+        situacoes = pd.read_sql(text("SELECT id_situacao, descricao_situacao FROM dim_situacoes ORDER BY id_situacao"), conexao)
+    return geracao, fatos, naturezas, situacoes
+
+
+def _colunas(fatos, naturezas):
+    # A natureza vira um código denso (posição na lista de meta.json), para agregar com bincount.
+    # CDAs de naturezas inexistentes ficam de fora, como no JOIN com dim_naturezas.
+    natureza = pd.Categorical(fatos['fk_natureza'], categories=naturezas['id_natureza']).codes
+    manter = natureza >= 0
+
+    num_cda = fatos['num_cda'].to_numpy('int64')[manter]
+    ano = fatos['ano_inscricao'].to_numpy('int32')[manter]
+    # Saldo em centavos inteiros: agregações exatas e comparações sem erro de ponto flutuante
+    centavos = np.rint(fatos['valor_saldo'].astype('float64').to_numpy() * 100).astype('int64')[manter]
+    probabilidade = fatos['prob_recuperacao'].astype('float64').to_numpy()[manter]
+
+    return {
+        'num_cda': num_cda,
+        'ano_inscricao': ano,
+        'valor_centavos': centavos,
+        'prob_recuperacao': probabilidade,
+        'natureza': natureza[manter].astype('int16'),
+        'fk_situacao': fatos['fk_situacao'].to_numpy('int32')[manter],
+        # Códigos de tributo e de grupo de situação gravados pelo ETL (-1 para nenhum grupo)
+        'tributo': fatos['cod_tributo'].fillna(-1).to_numpy('int8')[manter],
+        'grupo_situacao': fatos['cod_grupo_situacao'].fillna(-1).to_numpy('int8')[manter],
+        # Ordem crescente por (coluna, num_cda), como o ORDER BY do /cda/search; a decrescente é a inversa
+        'ordem_ano': np.lexsort((num_cda, ano)),
+        'ordem_valor': np.lexsort((num_cda, centavos)),
+    }
+
+
+def _limpar_antigas(diretorio, atual):
+    pastas = sorted(
+        (p for p in os.listdir(diretorio) if p.startswith('g') and p != atual and os.path.isdir(os.path.join(diretorio, p))),
+        key=lambda p: os.path.getmtime(os.path.join(diretorio, p))
+    )
+    for pasta in pastas[:max(len(pastas) - (GERACOES_MANTIDAS - 1), 0)]:
+        shutil.rmtree(os.path.join(diretorio, pasta), ignore_errors=True)
+
+
+def gravar_snapshot(engine, diretorio=None):
+    """Grava o snapshot colunar da geração atual do DW. Devolve as estatísticas (ou None se desativado)."""
+    diretorio = diretorio or DIR_SNAPSHOT
+    if not diretorio:
+        return None
+
+    inicio = time.perf_counter()
+    geracao, fatos, naturezas, situacoes = _ler_dw(engine)
+    if geracao is None:
+        print("  snapshot: DW sem geração registrada, nada a gravar")
+        return None
+
+    colunas = _colunas(fatos, naturezas)
+    os.makedirs(diretorio, exist_ok=True)
+    nome = f'g{geracao}'
+    temporaria = os.path.join(diretorio, f'.{nome}-{os.getpid()}')
+    shutil.rmtree(temporaria, ignore_errors=True)
+    os.makedirs(temporaria)
+
+    for coluna, valores in colunas.items():
+        np.save(os.path.join(temporaria, f'{coluna}.npy'), valores)
+    meta = {
+        'geracao': int(geracao),
+        'linhas': int(len(colunas['num_cda'])),
+        'num_cda_ordenado': True,
+        'naturezas': [[int(i), d] for i, d in naturezas.itertuples(index=False)],
+        'situacoes': [[int(i), d] for i, d in situacoes.itertuples(index=False)],
+    }
+    with open(os.path.join(temporaria, 'meta.json'), 'w', encoding='utf-8') as arquivo:
+        json.dump(meta, arquivo, ensure_ascii=False)
+
+    destino = os.path.join(diretorio, nome)
+    shutil.rmtree(destino, ignore_errors=True)
+    os.rename(temporaria, destino)
+    ponteiro = os.path.join(diretorio, f'.{ARQUIVO_ATUAL}-{os.getpid()}')
+    with open(ponteiro, 'w') as arquivo:
+        arquivo.write(nome)
+    os.replace(ponteiro, os.path.join(diretorio, ARQUIVO_ATUAL))
+    _limpar_antigas(diretorio, nome)
+
+    duracao = time.perf_counter() - inicio
+    linhas = meta['linhas']
+    print(f"  snapshot: geração {geracao}, {linhas} linhas em {duracao:.2f}s")
+    return {
+        'tabela': 'snapshot',
+        'modo': 'snapshot',
+        'linhas': linhas,
+        'segundos': duracao,
+        'linhas_por_segundo': linhas / duracao if duracao > 0 else 0.0,
+    }